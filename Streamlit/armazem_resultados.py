@@ -0,0 +1,223 @@
+# armazem_resultados.py
+# Armazém persistente (SQLite) dos resultados por linha do cálculo de preços. Cada linha é
+# guardada pela chave (hash do custo e do peso) junto com a impressão digital dos parâmetros,
+# das comissões, das regras e das tabelas de frete (ver chaves_calculo); ao recalcular um
+# catálogo quase igual ao anterior só as linhas novas ou alteradas passam pelo solver. As linhas
+# são gravadas em blocos (chaves e valores como arrays binários), assim ler e gravar centenas
+# de milhares de linhas custa poucas operações no SQLite. As chaves de cada impressão digital ficam num índice em
+# memória (chaves ordenadas -> bloco e linha), carregado uma vez e completado só com os blocos
+# novos; cada consulta lê do disco apenas os valores dos blocos que têm as chaves pedidas. Quando
+# o armazém passa de max_linhas, os blocos usados há mais tempo são descartados.
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+MAX_LINHAS_PADRAO = 2_000_000
+LINHAS_POR_BLOCO = 100_000
+# Impressões digitais com índice de chaves em memória (cerca de 24 bytes por linha guardada)
+MAX_INDICES_MEMORIA = 4
+
+
+class ArmazemResultados:
+    """Resultados por linha num arquivo SQLite, com contagem de acertos e falhas.
+
+    Os valores de cada linha são um vetor de floats. Pode ser usado por várias threads; enviado
+    a outro processo (pickle), o arquivo é aberto uma única vez por processo e as tarefas
+    seguintes reaproveitam a conexão e o índice de chaves em memória.
+    """
+
+    def __init__(self, caminho, max_linhas=MAX_LINHAS_PADRAO):
+        self.caminho = caminho
+        self.max_linhas = max_linhas
+        self.acertos = 0
+        self.falhas = 0
+        self._trava = threading.Lock()
+        self._indices = OrderedDict()
+        self._conexao = sqlite3.connect(caminho, timeout=30, check_same_thread=False)
+        self._conexao.executescript("""
+            PRAGMA page_size = 65536;
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            PRAGMA foreign_keys = ON;
+            CREATE TABLE IF NOT EXISTS blocos (
+                id INTEGER PRIMARY KEY,
+                impressao TEXT NOT NULL,
+                linhas INTEGER NOT NULL,
+                uso INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS blocos_impressao ON blocos (impressao);
+            -- Os arrays ficam numa tabela à parte para que atualizar o uso não regrave os dados
+            CREATE TABLE IF NOT EXISTS dados_blocos (
+                id INTEGER PRIMARY KEY REFERENCES blocos (id) ON DELETE CASCADE,
+                chaves BLOB NOT NULL,
+                valores BLOB NOT NULL
+            );
+        """)
+        self._uso = self._conexao.execute("SELECT COALESCE(MAX(uso), 0) FROM blocos").fetchone()[0]
+
+    def __reduce__(self):
+        # Em outro processo vira o armazém do mesmo arquivo aberto uma vez naquele processo
+        return _armazem_do_processo, (self.caminho, self.max_linhas)
+
+    def _indice(self, impressao):
+        """Índice em memória das chaves da impressão, completado com os blocos gravados desde a última consulta."""
+        indice = self._indices.pop(impressao, None)
+        if indice is None:
+            indice = {"ultimo_id": 0, "chaves": np.zeros(0, dtype=np.int64), "blocos": np.zeros(0, dtype=np.int64), "linhas": np.zeros(0, dtype=np.int64)}
+        self._indices[impressao] = indice
+        while len(self._indices) > MAX_INDICES_MEMORIA:
+            self._indices.popitem(last=False)
+        novos = self._conexao.execute(
+            "SELECT b.id, d.chaves FROM blocos b JOIN dados_blocos d ON d.id = b.id WHERE b.impressao = ? AND b.id > ? ORDER BY b.id",
+            (impressao, indice["ultimo_id"])
+        ).fetchall()
+        if novos:
+            chaves = [np.frombuffer(blob, dtype=np.int64) for _, blob in novos]
+            tamanhos = [len(bloco) for bloco in chaves]
+            chaves = np.concatenate(chaves)
+            blocos = np.repeat(np.array([id_bloco for id_bloco, _ in novos], dtype=np.int64), tamanhos)
+            linhas = np.arange(len(chaves)) - np.repeat(np.cumsum(tamanhos) - tamanhos, tamanhos)
+            # Uma chave gravada mais de uma vez tem sempre os mesmos valores: fica a mais recente
+            # (a de maior posição, já que os blocos vêm em ordem de gravação)
+            ordem = np.argsort(chaves)
+            ordenadas = chaves[ordem]
+            inicios = np.flatnonzero(np.r_[True, ordenadas[1:] != ordenadas[:-1]])
+            ultimas = np.maximum.reduceat(ordem, inicios)
+            chaves, blocos, linhas = ordenadas[inicios], blocos[ultimas], linhas[ultimas]
+            posicoes = np.searchsorted(indice["chaves"], chaves)
+            existentes = np.zeros(len(chaves), dtype=bool)
+            if len(indice["chaves"]):
+                existentes = indice["chaves"][np.minimum(posicoes, len(indice["chaves"]) - 1)] == chaves
+            indice["blocos"][posicoes[existentes]] = blocos[existentes]
+            indice["linhas"][posicoes[existentes]] = linhas[existentes]
+            novas = ~existentes
+            for campo, valores in (("chaves", chaves), ("blocos", blocos), ("linhas", linhas)):
+                indice[campo] = np.insert(indice[campo], posicoes[novas], valores[novas])
+            indice["ultimo_id"] = novos[-1][0]
+        return indice
+
+    def _esquecer_blocos(self, ids):
+        """Tira do índice em memória as linhas dos blocos descartados."""
+        for indice in self._indices.values():
+            manter = ~np.isin(indice["blocos"], ids)
+            for campo in ("chaves", "blocos", "linhas"):
+                indice[campo] = indice[campo][manter]
+
+    def consultar(self, impressao, chaves, n_valores):
+        """Procura as chaves. Retorna (máscara das encontradas, array (encontradas, n_valores) na mesma ordem)."""
+        chaves = np.asarray(chaves, dtype=np.int64)
+        with self._trava:
+            self._uso += 1
+            indice = self._indice(impressao)
+            encontrados = np.zeros(len(chaves), dtype=bool)
+            if len(indice["chaves"]):
+                # Procurar as chaves já ordenadas é bem mais rápido (acessos à memória em sequência)
+                ordem_chaves = np.argsort(chaves)
+                posicoes = np.empty(len(chaves), dtype=np.int64)
+                posicoes[ordem_chaves] = np.searchsorted(indice["chaves"], chaves[ordem_chaves])
+                posicoes = np.minimum(posicoes, len(indice["chaves"]) - 1)
+                encontrados = indice["chaves"][posicoes] == chaves
+                posicoes = posicoes[encontrados]
+            blocos = indice["blocos"][posicoes] if encontrados.any() else np.zeros(0, dtype=np.int64)
+            linhas = indice["linhas"][posicoes] if encontrados.any() else np.zeros(0, dtype=np.int64)
+            dados = np.empty((len(blocos), n_valores))
+            lidos = np.zeros(len(blocos), dtype=bool)
+            usados = np.unique(blocos).tolist()
+            if usados:
+                marcadores = ",".join("?" * len(usados))
+                ordem = np.argsort(blocos, kind="stable")
+                inicios = np.searchsorted(blocos[ordem], usados)
+                fins = np.searchsorted(blocos[ordem], usados, side="right")
+                tamanho_linha = n_valores * 8
+                linhas_por_bloco = dict(self._conexao.execute(f"SELECT id, linhas FROM blocos WHERE id IN ({marcadores})", usados))
+                for id_bloco, inicio, fim in zip(usados, inicios, fins):
+                    # Blocos descartados por outro processo ficam como não lidos
+                    if id_bloco not in linhas_por_bloco:
+                        continue
+                    destino = ordem[inicio:fim] if len(usados) > 1 else slice(None)
+                    linhas_bloco = linhas[destino]
+                    primeira, ultima = int(linhas_bloco.min()), int(linhas_bloco.max()) + 1
+                    # Lê do blob só o trecho entre a primeira e a última linha pedidas
+                    try:
+                        with self._conexao.blobopen("dados_blocos", "valores", id_bloco, readonly=True) as blob:
+                            if len(blob) != linhas_por_bloco[id_bloco] * tamanho_linha:
+                                continue
+                            blob.seek(primeira * tamanho_linha)
+                            valores = np.frombuffer(blob.read((ultima - primeira) * tamanho_linha), dtype=np.float64).reshape(-1, n_valores)
+                    except sqlite3.OperationalError:
+                        continue
+                    dados[destino] = valores[linhas_bloco - primeira]
+                    lidos[destino] = True
+                self._conexao.execute(f"UPDATE blocos SET uso = ? WHERE id IN ({marcadores})", [self._uso, *usados])
+                self._conexao.commit()
+            if not lidos.all():
+                # Blocos descartados por outro processo desde que o índice foi carregado
+                self._esquecer_blocos(np.unique(blocos[~lidos]))
+                encontrados[np.flatnonzero(encontrados)[~lidos]] = False
+                dados = dados[lidos]
+        self.acertos += int(encontrados.sum())
+        self.falhas += int((~encontrados).sum())
+        return encontrados, dados
+
+    def guardar(self, impressao, chaves, valores):
+        """Guarda os valores (array (linhas, n_valores)) de cada chave e descarta os blocos usados há mais tempo se passar do limite."""
+        chaves = np.ascontiguousarray(chaves, dtype=np.int64)
+        if not len(chaves):
+            return
+        valores = np.ascontiguousarray(valores, dtype=np.float64)
+        with self._trava:
+            for inicio in range(0, len(chaves), LINHAS_POR_BLOCO):
+                fim = inicio + LINHAS_POR_BLOCO
+                cursor = self._conexao.execute("INSERT INTO blocos (impressao, linhas, uso) VALUES (?, ?, ?)",
+                                               (impressao, len(chaves[inicio:fim]), self._uso))
+                self._conexao.execute("INSERT INTO dados_blocos (id, chaves, valores) VALUES (?, ?, ?)",
+                                      (cursor.lastrowid, chaves[inicio:fim].tobytes(), valores[inicio:fim].tobytes()))
+            total = self._conexao.execute("SELECT COALESCE(SUM(linhas), 0) FROM blocos").fetchone()[0]
+            descartar = []
+            if total > self.max_linhas:
+                for id_bloco, linhas in self._conexao.execute("SELECT id, linhas FROM blocos ORDER BY uso, id"):
+                    if total <= self.max_linhas:
+                        break
+                    descartar.append(id_bloco)
+                    total -= linhas
+                self._conexao.execute(f"DELETE FROM blocos WHERE id IN ({','.join('?' * len(descartar))})", descartar)
+                self._esquecer_blocos(descartar)
+            self._conexao.commit()
+
+    def estatisticas(self):
+        with self._trava:
+            linhas = self._conexao.execute("SELECT COALESCE(SUM(linhas), 0) FROM blocos").fetchone()[0]
+        return {
+            "acertos": self.acertos,
+            "falhas": self.falhas,
+            "linhas": linhas,
+            "tamanho_mb": round(os.path.getsize(self.caminho) / 1024 ** 2, 2) if os.path.exists(self.caminho) else 0.0,
+        }
+
+    def limpar(self):
+        with self._trava:
+            self._conexao.execute("DELETE FROM blocos")
+            self._conexao.commit()
+            self._indices.clear()
+            self._conexao.execute("VACUUM")
+
+    def fechar(self):
+        with self._trava:
+            self._conexao.close()
+
+
+# Um armazém por arquivo em cada processo (ver ArmazemResultados.__reduce__)
+_ARMAZENS_DO_PROCESSO = {}
+_TRAVA_ARMAZENS = threading.Lock()
+
+
+def _armazem_do_processo(caminho, max_linhas):
+    chave = (os.getpid(), os.path.abspath(caminho), max_linhas)
+    with _TRAVA_ARMAZENS:
+        armazem = _ARMAZENS_DO_PROCESSO.get(chave)
+        if armazem is None:
+            armazem = _ARMAZENS_DO_PROCESSO[chave] = ArmazemResultados(caminho, max_linhas)
+    return armazem
@@ -0,0 +1,166 @@
+# benchmark.py
+# Mede como o cálculo de preços escala com o tamanho do catálogo: vazão (linhas/s) e pico de
+# memória do caminho escalar (uma linha por vez), do caminho em lote (com e sem agrupar as linhas
+# repetidas), da leitura do arquivo e da escrita da saída. O memo do solver é limpo antes de
+# cada medição. Os resultados são salvos em JSON para comparar commits, por exemplo:
+#
+#     python benchmark.py --tamanhos 1k 100k --saida bench_antes.json
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import calculadora_modulo as calculadora
+import price_calculator_app as app
+from catalogo_sintetico import COLUNA_CUSTO, COLUNA_PESO, TAMANHOS_PADRAO, gerar_catalogo, salvar_catalogo
+from escritores_saida import EXTENSOES, escrever_resultado
+from leitura_planilha import ler_planilha
+
+PARAMETROS = dict(margem_desejada_perc=30.0, custo_embalagem=1.50, imposto_perc=7.0)
+
+
+def medir(funcao, com_memoria=True):
+    """Executa funcao() e devolve (segundos, pico de memória em MB ou None).
+
+    O tempo é medido numa execução sem tracemalloc (que deixa o código Python mais lento) e o
+    pico de memória numa segunda execução com tracemalloc.
+    """
+    inicio = time.perf_counter()
+    funcao()
+    segundos = time.perf_counter() - inicio
+    pico_mb = None
+    if com_memoria:
+        tracemalloc.start()
+        try:
+            funcao()
+            pico_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        finally:
+            tracemalloc.stop()
+    return segundos, pico_mb
+
+
+def _resultado(etapa, linhas, segundos, pico_mb, **extras):
+    return {
+        "etapa": etapa,
+        "linhas": linhas,
+        "segundos": round(segundos, 4),
+        "linhas_por_segundo": round(linhas / segundos, 1) if segundos > 0 else None,
+        "pico_memoria_mb": None if pico_mb is None else round(pico_mb, 2),
+        **extras,
+    }
+
+
+def medir_tamanho(n_linhas, limite_escalar, formatos, com_memoria, pasta):
+    """Mede todas as etapas para um catálogo de n_linhas produtos."""
+    df = gerar_catalogo(n_linhas)
+    resultados = []
+
+    # Caminho escalar: calcular_preco_venda e calcular_frete_* linha a linha, numa amostra
+    amostra = df.head(limite_escalar)
+    custos = amostra[COLUNA_CUSTO].tolist()
+    pesos = amostra[COLUNA_PESO].tolist()
+
+    def escalar():
+        for custo, peso in zip(custos, pesos):
+            app.calcular_preco_venda(custo, PARAMETROS["custo_embalagem"], PARAMETROS["margem_desejada_perc"], PARAMETROS["imposto_perc"], peso)
+
+    def frete_escalar():
+        for peso in pesos:
+            app.calcular_frete_ml(100.0, peso)
+            app.calcular_frete_amazon(100.0, peso)
+
+    segundos, pico = medir(escalar, com_memoria)
+    resultados.append(_resultado("escalar", len(amostra), segundos, pico))
+    segundos, pico = medir(frete_escalar, com_memoria)
+    resultados.append(_resultado("frete_escalar", len(amostra), segundos, pico))
+
+    # Caminho em lote: o catálogo inteiro de uma vez
+    tabelas = app.FRETES_PADRAO
+    pesos_array = df[COLUNA_PESO].to_numpy(dtype=float)
+
+    def lote(deduplicar=True):
+        # Sem o memo do solver da execução anterior, que faria a medição reaproveitar resultados
+        calculadora.limpar_memo_solver()
+        calculadora.calcular_precos_lote(df[COLUNA_CUSTO], df[COLUNA_PESO], tabelas_frete=tabelas, comissoes_perc=app.COMISSOES_PADRAO,
+                                         deduplicar=deduplicar, **PARAMETROS)
+
+    def frete_lote():
+        for tabela in tabelas.values():
+            tabela.custo(pesos_array)
+
+    segundos, pico = medir(lote, com_memoria)
+    resultados.append(_resultado("lote", n_linhas, segundos, pico))
+    segundos, pico = medir(lambda: lote(deduplicar=False), com_memoria)
+    resultados.append(_resultado("lote_sem_dedup", n_linhas, segundos, pico))
+    segundos, pico = medir(frete_lote, com_memoria)
+    resultados.append(_resultado("frete_lote", n_linhas, segundos, pico))
+
+    # Leitura do arquivo de entrada (CSV, como no processar_tabela)
+    caminho_entrada = os.path.join(pasta, f"catalogo_{n_linhas}.csv")
+    salvar_catalogo(df, caminho_entrada)
+
+    def leitura():
+        ler_planilha(caminho_entrada, colunas_numericas=(COLUNA_CUSTO, COLUNA_PESO))
+
+    segundos, pico = medir(leitura, com_memoria)
+    resultados.append(_resultado("leitura", n_linhas, segundos, pico, tamanho_arquivo_mb=round(os.path.getsize(caminho_entrada) / 1024 ** 2, 2)))
+
+    # Escrita da saída em cada formato
+    calculadora.limpar_memo_solver()
+    df_resultado, _ = app.precificar_dataframe(df, coluna_custo=COLUNA_CUSTO, coluna_peso=COLUNA_PESO, **PARAMETROS)
+    for formato in formatos:
+        caminho_saida = os.path.join(pasta, f"resultado_{n_linhas}{EXTENSOES[formato]}")
+        segundos, pico = medir(lambda: escrever_resultado(df_resultado, caminho_saida, formato), com_memoria)
+        resultados.append(_resultado(f"escrita_{formato}", n_linhas, segundos, pico, tamanho_arquivo_mb=round(os.path.getsize(caminho_saida) / 1024 ** 2, 2)))
+
+    return resultados
+
+
+def _commit_atual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _ler_tamanho(texto):
+    return TAMANHOS_PADRAO[texto] if texto in TAMANHOS_PADRAO else int(texto)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark do cálculo de preços com catálogos sintéticos.")
+    parser.add_argument('--tamanhos', nargs='+', default=list(TAMANHOS_PADRAO), help='Tamanhos do catálogo: 1k, 100k, 1M ou um número de linhas (padrão: 1k 100k 1M).')
+    parser.add_argument('--limite_escalar', type=int, default=20000, help='Máximo de linhas medidas no caminho escalar (padrão: 20000).')
+    parser.add_argument('--formatos', nargs='+', choices=list(EXTENSOES), default=["csv", "xlsx"], help='Formatos de saída medidos (padrão: csv xlsx).')
+    parser.add_argument('--sem_memoria', action='store_true', help='Não mede o pico de memória (metade do tempo de execução).')
+    parser.add_argument('--saida', default='benchmark.json', help='Arquivo JSON com os resultados (padrão: benchmark.json).')
+    args = parser.parse_args()
+
+    relatorio = {
+        "commit": _commit_atual(),
+        "data": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "resultados": [],
+    }
+    with tempfile.TemporaryDirectory() as pasta:
+        for tamanho in args.tamanhos:
+            n_linhas = _ler_tamanho(tamanho)
+            print(f"Catálogo com {n_linhas} linhas...")
+            for resultado in medir_tamanho(n_linhas, args.limite_escalar, args.formatos, not args.sem_memoria, pasta):
+                relatorio["resultados"].append(resultado)
+                memoria = "" if resultado["pico_memoria_mb"] is None else f", pico {resultado['pico_memoria_mb']:.1f} MB"
+                print(f"  {resultado['etapa']:<16} {resultado['linhas']:>9} linhas  {resultado['segundos']:>8.3f}s  {resultado['linhas_por_segundo'] or 0:>12,.0f} linhas/s{memoria}")
+
+    with open(args.saida, "w", encoding="utf-8") as arquivo:
+        json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+    print(f"Resultados salvos em '{args.saida}'.")
@@ -1,59 +1,325 @@
 # calculadora_modulo.py
+import bisect
 import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from chaves_calculo import chaves_linhas, impressao_digital
+from instrumentacao import SEM_INSTRUMENTACAO
+from regras_marketplace import marketplaces_registrados, obter_regra
+
+class TabelaFrete:
+    """Tabela de frete compilada uma única vez a partir do DataFrame (PesoMaximoG, CustoFrete).
+
+    Guarda os limites de peso ordenados e os custos em arrays e responde consultas por busca
+    binária, tanto para um peso quanto para um array de pesos. Com kg_adicional=True, a linha
+    PesoMaximoG == -1 é o custo por kg extra acima do último limite (regra da Amazon).
+    """
+
+    def __init__(self, tabela_frete_df, kg_adicional=False):
+        self.custo_kg_adicional = None
+        limites = np.array([], dtype=float)
+        custos = np.array([], dtype=float)
+        if tabela_frete_df is not None and not tabela_frete_df.empty:
+            tabela = tabela_frete_df.sort_values(by="PesoMaximoG", kind="stable")
+            if kg_adicional:
+                linha_kg = tabela[tabela["PesoMaximoG"] == -1]
+                self.custo_kg_adicional = float(linha_kg["CustoFrete"].iloc[0]) if not linha_kg.empty else 3.50
+                tabela = tabela[tabela["PesoMaximoG"] != -1]
+            limites = tabela["PesoMaximoG"].to_numpy(dtype=float)
+            custos = tabela["CustoFrete"].to_numpy(dtype=float)
+        self.limites = limites
+        self.custos = custos
+        self._limites_lista = limites.tolist()
+        self._custos_lista = custos.tolist()
+
+    def __len__(self):
+        return len(self.limites)
+
+    def custo(self, pesos):
+        """Custo de frete para um peso (float) ou um array de pesos (ndarray)."""
+        if np.ndim(pesos) == 0:
+            return self._custo_unico(float(pesos))
+        pesos = np.asarray(pesos, dtype=float)
+        if not len(self.limites):
+            return np.zeros(len(pesos))
+        indices = np.searchsorted(self.limites, pesos, side="left")
+        fretes = self.custos[np.minimum(indices, len(self.limites) - 1)]
+        if self.custo_kg_adicional is not None:
+            acima = indices >= len(self.limites)
+            kg_extras = np.ceil((pesos[acima] - self.limites[-1]) / 1000)
+            fretes[acima] = self.custos[-1] + (kg_extras * self.custo_kg_adicional)
+        return fretes
+
+    def _custo_unico(self, peso_g):
+        if not self._limites_lista:
+            return 0.00
+        indice = bisect.bisect_left(self._limites_lista, peso_g)
+        if indice < len(self._limites_lista):
+            return self._custos_lista[indice]
+        if self.custo_kg_adicional is not None:
+            kg_extras = math.ceil((peso_g - self._limites_lista[-1]) / 1000)
+            return self._custos_lista[-1] + (kg_extras * self.custo_kg_adicional)
+        return self._custos_lista[-1]
+
+def compilar_tabela_frete(tabela_frete_df, kg_adicional=False):
+    if isinstance(tabela_frete_df, TabelaFrete):
+        return tabela_frete_df
+    return TabelaFrete(tabela_frete_df, kg_adicional=kg_adicional)
+
+def compilar_tabela_frete_ml(tabela_frete_ml_df):
+    return compilar_tabela_frete(tabela_frete_ml_df, obter_regra("Mercado Livre").kg_adicional)
+
+def compilar_tabela_frete_amazon(tabela_frete_amazon_df):
+    return compilar_tabela_frete(tabela_frete_amazon_df, obter_regra("Amazon").kg_adicional)
+
+def compilar_tabelas_frete(tabelas_frete):
+    """Compila um dicionário {nome da tabela: DataFrame} conforme a regra de frete que usa cada tabela."""
+    kg_adicional = {}
+    for nome in marketplaces_registrados():
+        regra = obter_regra(nome)
+        if regra.tabela_frete is not None:
+            kg_adicional[regra.tabela_frete] = regra.kg_adicional
+    return {nome: compilar_tabela_frete(tabela, kg_adicional.get(nome, False)) for nome, tabela in tabelas_frete.items() if tabela is not None}
+
+def _compilar_tabelas(marketplaces, tabela_frete_ml_df, tabela_frete_amazon_df, tabelas_frete):
+    """Compila uma vez as tabelas de frete usadas pelos marketplaces pedidos, pelo nome da tabela na regra."""
+    fontes = {"tabela_frete_ml_df": tabela_frete_ml_df, "tabela_frete_amazon_df": tabela_frete_amazon_df, **(tabelas_frete or {})}
+    compiladas = {}
+    for nome in marketplaces:
+        regra = obter_regra(nome)
+        if regra is not None and regra.tabela_frete is not None and fontes.get(regra.tabela_frete) is not None:
+            compiladas[regra.tabela_frete] = compilar_tabela_frete(fontes[regra.tabela_frete], regra.kg_adicional)
+    return compiladas
 
 def calcular_taxa_fixa_ml(preco_venda):
-    if preco_venda <= 29.00:
-        return 3.00
-    elif preco_venda <= 50.00:
-        return 3.50
-    elif preco_venda <= 79.00:
-        return 4.00
-    else:
-        return 0.00
+    return obter_regra("Mercado Livre").taxa_fixa(preco_venda)
 
 def calcular_frete_ml(preco_venda, peso_g, tabela_frete_ml_df):
-    if preco_venda <= 79.00:
+    if not obter_regra("Mercado Livre").frete_cobrado(preco_venda):
         return 0.00
-    if tabela_frete_ml_df is None or tabela_frete_ml_df.empty:
+    if tabela_frete_ml_df is None:
         return 0.00
-
-    tabela_frete_ml_df = tabela_frete_ml_df.sort_values(by="PesoMaximoG").reset_index(drop=True)
-    for _, row in tabela_frete_ml_df.iterrows():
-        if peso_g <= row["PesoMaximoG"]:
-            return row["CustoFrete"]
-    return tabela_frete_ml_df["CustoFrete"].iloc[-1]
+    return compilar_tabela_frete_ml(tabela_frete_ml_df).custo(peso_g)
 
 def calcular_taxa_fixa_amazon(preco_venda):
-    if preco_venda <= 30.00:
-        return 4.50
-    elif preco_venda <= 78.99:
-        return 8.00
-    else:
-        return 0.00
+    return obter_regra("Amazon").taxa_fixa(preco_venda)
 
 def calcular_frete_amazon(preco_venda, peso_g, tabela_frete_amazon_df):
-    if preco_venda < 79.00:
+    if not obter_regra("Amazon").frete_cobrado(preco_venda):
         return 0.00
-    if tabela_frete_amazon_df is None or tabela_frete_amazon_df.empty:
+    if tabela_frete_amazon_df is None:
         return 0.00
+    return compilar_tabela_frete_amazon(tabela_frete_amazon_df).custo(peso_g)
+
+def resolver_preco_por_faixas(total_custo_lucro, denominador, pontos_quebra, custo_no_preco):
+    """Resolve preço = (total_custo_lucro + custo(preço)) / denominador faixa a faixa, sem iterar.
+
+    Taxa fixa e frete são degraus do preço: entre dois pontos de quebra o custo é constante e a
+    equação é linear. As faixas (intervalos abertos entre os pontos e os próprios pontos) são
+    testadas em ordem crescente e a primeira que atinge a margem alvo dá o menor preço válido,
+    em no máximo 2 * len(pontos_quebra) + 1 passos. custo_no_preco(preco) recebe um preço da
+    faixa e devolve a taxa fixa + frete (escalar ou um valor por linha).
+
+    Retorna os arrays (precos, custos, faixas, exatos). faixas é o índice da faixa em que o preço
+    ficou (ver rotulos_faixas); o solver testou faixas + 1 faixas até encontrá-lo. Quando nenhuma
+    faixa tem preço consistente (ex.: oscilação em torno de R$ 79), exatos é False e o preço é o
+    primeiro centavo da faixa seguinte, com margem acima da desejada.
+    """
+    total_custo_lucro = np.asarray(total_custo_lucro, dtype=float)
+    n = len(total_custo_lucro)
+    precos = np.full(n, np.nan)
+    custos = np.full(n, np.nan)
+    faixas = np.full(n, -1, dtype=np.int64)
+    exatos = np.zeros(n, dtype=bool)
+    pendentes = np.ones(n, dtype=bool)
+
+    def aceitar(mascara, preco, custo, faixa, exato):
+        precos[mascara] = preco[mascara] if np.ndim(preco) else preco
+        custos[mascara] = custo[mascara]
+        faixas[mascara] = faixa
+        exatos[mascara] = exato[mascara] if np.ndim(exato) else exato
+        pendentes[mascara] = False
+
+    limites = [-math.inf] + sorted(pontos_quebra) + [math.inf]
+    faixa = 0
+    for inicio, fim in zip(limites[:-1], limites[1:]):
+        if not pendentes.any():
+            break
+        # Intervalo aberto (inicio, fim)
+        if inicio == -math.inf:
+            representativo = fim - 1.0
+        elif fim == math.inf:
+            representativo = inicio + 1.0
+        else:
+            representativo = (inicio + fim) / 2
+        custo = np.broadcast_to(np.asarray(custo_no_preco(representativo), dtype=float), (n,))
+        solucao = (total_custo_lucro + custo) / denominador
+        aceitar(pendentes & (solucao > inicio) & (solucao < fim), solucao, custo, faixa, True)
+        primeiro_centavo = round(inicio + 0.01, 2)
+        if primeiro_centavo < fim:
+            aceitar(pendentes & (solucao <= inicio), primeiro_centavo, custo, faixa, False)
+        faixa += 1
 
-    tabela_frete_amazon_df = tabela_frete_amazon_df.sort_values(by="PesoMaximoG").reset_index(drop=True)
-    kg_adicional_row = tabela_frete_amazon_df[tabela_frete_amazon_df["PesoMaximoG"] == -1]
-    custo_kg_adicional = kg_adicional_row["CustoFrete"].iloc[0] if not kg_adicional_row.empty else 3.50
-    tabela_busca = tabela_frete_amazon_df[tabela_frete_amazon_df["PesoMaximoG"] != -1]
+        # Ponto de quebra fim
+        if fim == math.inf:
+            break
+        custo = np.broadcast_to(np.asarray(custo_no_preco(fim), dtype=float), (n,))
+        solucao = (total_custo_lucro + custo) / denominador
+        aceitar(pendentes & (solucao <= fim + 1e-9), fim, custo, faixa, np.abs(solucao - fim) <= 1e-9)
+        faixa += 1
 
-    for _, row in tabela_busca.iterrows():
-        if peso_g <= row["PesoMaximoG"]:
-            return row["CustoFrete"]
+    return precos, custos, faixas, exatos
 
-    if not tabela_busca.empty:
-        ultimo_limite = tabela_busca["PesoMaximoG"].iloc[-1]
-        ultimo_custo = tabela_busca["CustoFrete"].iloc[-1]
-        kg_extras = math.ceil((peso_g - ultimo_limite) / 1000)
-        return ultimo_custo + (kg_extras * custo_kg_adicional)
-    return 0.00
+# Memo do solver compartilhado entre chamadas (ex.: reexecuções do Streamlit, blocos do modo
+# streaming): por contexto (regra, denominador), guarda o resultado de cada combinação
+# (custo + lucro alvo, frete pelo peso) já resolvida. Limitado em contextos e em linhas por
+# contexto, descartando os mais antigos.
+MEMO_SOLVER_MAX_CONTEXTOS = 16
+MEMO_SOLVER_MAX_LINHAS = 500_000
+_MEMO_SOLVER = OrderedDict()
+_TRAVA_MEMO_SOLVER = threading.Lock()
 
-def calcular_preco_venda(custo_produto, custo_embalagem, margem_desejada_perc, imposto_perc, peso_g, comissoes_perc, tabela_frete_ml_df, tabela_frete_amazon_df):
+def limpar_memo_solver():
+    with _TRAVA_MEMO_SOLVER:
+        _MEMO_SOLVER.clear()
+
+_CAMPOS_MEMO = ("precos", "lucros", "margens", "exatos", "faixas")
+
+def _consultar_memo(contexto, chaves):
+    """Posição de cada chave no memo do contexto (-1 se ausente) e os arrays guardados."""
+    with _TRAVA_MEMO_SOLVER:
+        memo = _MEMO_SOLVER.get(contexto)
+        if memo is None:
+            return np.full(len(chaves), -1, dtype=np.int64), None
+        _MEMO_SOLVER.move_to_end(contexto)
+    return memo["indice"].get_indexer(chaves), memo
+
+def _guardar_memo(contexto, chaves, resultados):
+    with _TRAVA_MEMO_SOLVER:
+        memo = _MEMO_SOLVER.get(contexto)
+        novos = {"chaves": chaves, **dict(zip(_CAMPOS_MEMO, resultados))}
+        if memo is not None:
+            novos = {campo: np.concatenate([memo[campo], valores])[-MEMO_SOLVER_MAX_LINHAS:] for campo, valores in novos.items()}
+        novos["indice"] = pd.Index(novos["chaves"])
+        _MEMO_SOLVER[contexto] = novos
+        _MEMO_SOLVER.move_to_end(contexto)
+        while len(_MEMO_SOLVER) > MEMO_SOLVER_MAX_CONTEXTOS:
+            _MEMO_SOLVER.popitem(last=False)
+
+def precificar_marketplace(regra, custo_base, fretes_peso, margem_dec, denominador):
+    """Preço, lucro e margem (já arredondados), preço consistente e faixa de cada linha de um marketplace.
+
+    custo_base e fretes_peso são arrays por linha; margem_dec e denominador podem ser escalares
+    ou também um valor por linha (usado pela grade de cenários).
+    """
+    total_custo_lucro = custo_base + custo_base * margem_dec
+    if regra is None or not regra.tem_taxas:
+        preco_venda = total_custo_lucro / denominador
+        lucro_real = preco_venda * denominador - custo_base
+        exatos = np.ones(len(custo_base), dtype=bool)
+        faixas = np.zeros(len(custo_base), dtype=np.int64)
+    else:
+        preco_venda, custos_faixa, faixas, exatos = resolver_preco_por_faixas(
+            total_custo_lucro, denominador, regra.pontos_quebra,
+            lambda preco: regra.taxa_fixa(preco) + (fretes_peso if regra.frete_cobrado(preco) else 0.00)
+        )
+        lucro_real = preco_venda * denominador - custos_faixa - custo_base
+
+    margem_real = np.zeros(len(custo_base))
+    positivos = custo_base > 1e-6
+    margem_real[positivos] = lucro_real[positivos] / custo_base[positivos] * 100
+    return _arredondar(preco_venda), _arredondar(lucro_real), _arredondar(margem_real), exatos, faixas
+
+# Agrupar as linhas repetidas custa quase o mesmo que precificar todas (pd.factorize de 50 mil
+# linhas ~5 ms, o solver vetorizado 3-10 ms por marketplace): em blocos de 50 mil linhas o
+# agrupamento é ~40% mais rápido com 12% de combinações únicas e até 2x mais lento com 50%.
+# Por isso só se agrupa quando as primeiras linhas do bloco repetem bastante as combinações.
+AMOSTRA_DEDUPLICACAO = 4096
+FRACAO_MAX_UNICAS = 0.25
+
+def _poucas_repeticoes(custo_base, fretes_peso, margem_dec, denominador):
+    """Se mais de FRACAO_MAX_UNICAS das primeiras AMOSTRA_DEDUPLICACAO linhas são combinações únicas."""
+    n = min(len(custo_base), AMOSTRA_DEDUPLICACAO)
+    codigos, unicas = pd.factorize(custo_base[:n] + 1j * fretes_peso[:n])
+    if np.ndim(margem_dec) or np.ndim(denominador):
+        parametros = np.broadcast_to(margem_dec, custo_base.shape)[:n] + 1j * np.broadcast_to(denominador, custo_base.shape)[:n]
+        unicas = pd.unique(codigos.astype(np.int64) * n + pd.factorize(parametros)[0])
+    return len(unicas) > FRACAO_MAX_UNICAS * n
+
+def _precificar_deduplicado(nome, regra, custo_base, fretes_peso, margem_dec, denominador, usar_memo=True):
+    """precificar_marketplace calculando cada combinação (custo base, frete pelo peso) uma única vez.
+
+    Variações de um mesmo produto (cor, tamanho) costumam ter custo e peso iguais: as linhas são
+    agrupadas, só as combinações que ainda não estão no memo são calculadas e o resultado é
+    copiado de volta para todas as linhas do grupo. Retorna os arrays de precificar_marketplace
+    e as estatísticas {"combinacoes_unicas", "reaproveitadas_memo"}. Se a amostra do início do
+    bloco quase não tem repetições, todas as linhas vão direto para o solver, sem memo
+    (combinacoes_unicas None).
+
+    Com margem_dec ou denominador por linha (arrays), a combinação inclui os dois e o memo,
+    que é indexado pelos parâmetros escalares, não é usado.
+    """
+    fretes_peso = np.broadcast_to(np.asarray(fretes_peso, dtype=float), custo_base.shape)
+    if _poucas_repeticoes(custo_base, fretes_peso, margem_dec, denominador):
+        return precificar_marketplace(regra, custo_base, fretes_peso, margem_dec, denominador), {"combinacoes_unicas": None, "reaproveitadas_memo": 0}
+    if np.ndim(margem_dec) or np.ndim(denominador):
+        return _precificar_deduplicado_por_linha(regra, custo_base, fretes_peso, margem_dec, denominador)
+    # Os dois valores viram um único número complexo, que o pandas agrupa por hash em O(n)
+    codigos, chaves = pd.factorize(custo_base + 1j * fretes_peso)
+    contexto = (nome, regra, float(denominador), float(margem_dec))
+    if usar_memo:
+        posicoes, memo = _consultar_memo(contexto, chaves)
+    else:
+        posicoes, memo = np.full(len(chaves), -1, dtype=np.int64), None
+
+    resultados = (np.empty(len(chaves)), np.empty(len(chaves)), np.empty(len(chaves)),
+                  np.empty(len(chaves), dtype=bool), np.empty(len(chaves), dtype=np.int64))
+    no_memo = posicoes >= 0
+    if no_memo.any():
+        for destino, campo in zip(resultados, _CAMPOS_MEMO):
+            destino[no_memo] = memo[campo][posicoes[no_memo]]
+    faltantes = ~no_memo
+    if faltantes.any():
+        calculados = precificar_marketplace(regra, chaves.real[faltantes], chaves.imag[faltantes], margem_dec, denominador)
+        for destino, valores in zip(resultados, calculados):
+            destino[faltantes] = valores
+        if usar_memo:
+            _guardar_memo(contexto, chaves[faltantes], calculados)
+
+    estatisticas = {"combinacoes_unicas": len(chaves), "reaproveitadas_memo": int(no_memo.sum())}
+    return tuple(valores[codigos] for valores in resultados), estatisticas
+
+def _precificar_deduplicado_por_linha(regra, custo_base, fretes_peso, margem_dec, denominador):
+    """_precificar_deduplicado com margem e denominador por linha: agrupa por (custo, frete, margem, denominador)."""
+    margem_dec = np.broadcast_to(np.asarray(margem_dec, dtype=float), custo_base.shape)
+    denominador = np.broadcast_to(np.asarray(denominador, dtype=float), custo_base.shape)
+    codigos_base, _ = pd.factorize(custo_base + 1j * fretes_peso)
+    codigos_parametros, parametros = pd.factorize(margem_dec + 1j * denominador)
+    codigos, combinacoes = pd.factorize(codigos_base.astype(np.int64) * len(parametros) + codigos_parametros)
+    # Primeira linha de cada combinação, que a representa no cálculo
+    representantes = np.empty(len(combinacoes), dtype=np.int64)
+    representantes[codigos[::-1]] = np.arange(len(codigos))[::-1]
+    calculados = precificar_marketplace(regra, custo_base[representantes], fretes_peso[representantes],
+                                        margem_dec[representantes], denominador[representantes])
+    estatisticas = {"combinacoes_unicas": len(combinacoes), "reaproveitadas_memo": 0}
+    return tuple(valores[codigos] for valores in calculados), estatisticas
+
+def rotulos_faixas(pontos_quebra):
+    """Descrição de cada faixa de resolver_preco_por_faixas, na ordem dos índices."""
+    pontos = sorted(pontos_quebra)
+    if not pontos:
+        return ["sem faixas"]
+    rotulos = [f"< {pontos[0]:.2f}"]
+    for inicio, fim in zip(pontos, pontos[1:] + [None]):
+        rotulos.append(f"= {inicio:.2f}")
+        rotulos.append(f"> {inicio:.2f}" if fim is None else f"{inicio:.2f} a {fim:.2f}")
+    return rotulos
+
+def calcular_preco_venda(custo_produto, custo_embalagem, margem_desejada_perc, imposto_perc, peso_g, comissoes_perc, tabela_frete_ml_df=None, tabela_frete_amazon_df=None, tabelas_frete=None):
     if custo_produto is None or custo_embalagem is None or margem_desejada_perc is None or imposto_perc is None or peso_g is None:
         return {"Erro Geral": "Valor de entrada nulo"}
     if not all(isinstance(v, (int, float)) for v in [custo_produto, custo_embalagem, margem_desejada_perc, imposto_perc, peso_g]):
@@ -66,11 +332,7 @@ def calcular_preco_venda(custo_produto, custo_embalagem, margem_desejada_perc, i
     total_custo_lucro = custo_base + lucro_alvo
     imposto_dec = imposto_perc / 100.0
     resultados = {}
-
-    marketplace_funcs = {
-        "Mercado Livre": {"fixa_func": calcular_taxa_fixa_ml},
-        "Amazon": {"fixa_func": calcular_taxa_fixa_amazon}
-    }
+    tabelas = _compilar_tabelas(comissoes_perc, tabela_frete_ml_df, tabela_frete_amazon_df, tabelas_frete)
 
     for nome, comissao_perc_val in comissoes_perc.items():
         if not isinstance(comissao_perc_val, (int, float)) or comissao_perc_val < 0:
@@ -84,40 +346,374 @@ def calcular_preco_venda(custo_produto, custo_embalagem, margem_desejada_perc, i
             resultados[nome] = {"erro": "Imposto+Comissão >= 100%"}
             continue
 
-        funcs = marketplace_funcs.get(nome, {"fixa_func": None})
-        fixa_func = funcs["fixa_func"]
-
-        tabela_frete_df = None
-        frete_func_calculo = None
-        if nome == "Mercado Livre":
-            tabela_frete_df = tabela_frete_ml_df
-            frete_func_calculo = calcular_frete_ml
-        elif nome == "Amazon":
-            tabela_frete_df = tabela_frete_amazon_df
-            frete_func_calculo = calcular_frete_amazon
-
-        if fixa_func is None and frete_func_calculo is None:
+        regra = obter_regra(nome)
+        preco_consistente = True
+        faixa = 0
+        if regra is None or not regra.tem_taxas:
             preco_venda = total_custo_lucro / denominador_base
             lucro_real = preco_venda * denominador_base - custo_base
         else:
-            preco_estimado = total_custo_lucro / denominador_base
-            for _ in range(20):
-                taxa_fixa = fixa_func(preco_estimado) if fixa_func else 0
-                frete = frete_func_calculo(preco_estimado, peso_g, tabela_frete_df) if frete_func_calculo else 0
-                novo_preco = (total_custo_lucro + taxa_fixa + frete) / denominador_base
-                if abs(novo_preco - preco_estimado) < 0.001:
-                    break
-                preco_estimado = novo_preco
-            preco_venda = preco_estimado
-            taxa_fixa_final = fixa_func(preco_venda) if fixa_func else 0
-            frete_final = frete_func_calculo(preco_venda, peso_g, tabela_frete_df) if frete_func_calculo else 0
-            lucro_real = preco_venda * denominador_base - taxa_fixa_final - frete_final - custo_base
+            tabela = tabelas.get(regra.tabela_frete)
+            frete_peso = tabela.custo(peso_g) if tabela is not None else 0.00
+            precos, custos, faixas, exatos = resolver_preco_por_faixas(
+                [total_custo_lucro], denominador_base, regra.pontos_quebra,
+                lambda preco: regra.taxa_fixa(preco) + (frete_peso if regra.frete_cobrado(preco) else 0.00)
+            )
+            preco_venda = precos[0]
+            preco_consistente = bool(exatos[0])
+            faixa = int(faixas[0])
+            lucro_real = preco_venda * denominador_base - custos[0] - custo_base
 
         margem_real = (lucro_real / custo_base * 100) if custo_base > 1e-6 else 0
         resultados[nome] = {
-            "preco_venda": round(preco_venda, 2),
-            "lucro_real_rs": round(lucro_real, 2),
-            "margem_real_perc": round(margem_real, 2)
+            "preco_venda": round(float(preco_venda), 2),
+            "lucro_real_rs": round(float(lucro_real), 2),
+            "margem_real_perc": round(float(margem_real), 2),
+            "preco_consistente": preco_consistente,
+            "passos_solver": faixa + 1,
+            "faixa_preco": rotulos_faixas(regra.pontos_quebra if regra is not None else ())[faixa]
         }
 
     return resultados
+
+
+# --- CÁLCULO EM LOTE (VETORIZADO) ---
+
+def _arredondar(valores):
+    """Arredonda para centavos com o mesmo resultado de round(valor, 2) do Python.
+
+    np.round erra em valores muito próximos de meio centavo. Nesses casos o lado do desempate é
+    decidido comparando o valor exato de valor * 200 (separado em duas parcelas exatas) com o
+    ímpar mais próximo, como o round do Python faz com a expansão decimal exata.
+    """
+    valores = np.asarray(valores, dtype=float)
+    arredondados = np.round(valores, 2)
+    escalados = valores * 100
+    ambiguos = np.isfinite(valores) & (np.abs(escalados - np.floor(escalados) - 0.5) < 1e-6)
+    if ambiguos.any():
+        v = valores[ambiguos]
+        impar = 2 * np.floor(v * 100) + 1
+        # Divisão de Veltkamp: alto tem até 26 bits, então alto * 200 e baixo * 200 são exatos
+        c = v * 134217729.0
+        alto = c - (c - v)
+        baixo = v - alto
+        diferenca = (alto * 200 - impar) + baixo * 200
+        # Acima do meio centavo sobe, abaixo desce; empate exato vai para o centavo par
+        centavos = np.where(diferenca > 0, (impar + 1) / 2, (impar - 1) / 2)
+        empates = diferenca == 0
+        centavos[empates] = 2 * np.round((impar[empates] - 1) / 4 + 0.25)
+        arredondados[ambiguos] = centavos / 100
+    return arredondados
+
+def _coluna_numerica(valores):
+    serie = pd.Series(valores) if not isinstance(valores, pd.Series) else valores
+    numeros = pd.to_numeric(serie, errors="coerce").to_numpy(dtype=float)
+    nulos = serie.isna().to_numpy()
+    return numeros, nulos
+
+def _validar_entradas(colunas, parametros):
+    """Converte as colunas para float e aponta o erro de cada linha (parâmetros inválidos valem para todas).
+
+    Retorna (lista de arrays numéricos, array de erros com None nas linhas válidas, máscara das válidas).
+    """
+    convertidas = [_coluna_numerica(coluna) for coluna in colunas]
+    valores = [numeros for numeros, _ in convertidas]
+    n = len(valores[0])
+    erro_geral = np.full(n, None, dtype=object)
+    if any(v is None for v in parametros):
+        erro_geral[:] = "Valor de entrada nulo"
+    elif not all(isinstance(v, (int, float)) and math.isfinite(v) for v in parametros):
+        erro_geral[:] = "Valor de entrada não numérico"
+    elif any(v < 0 for v in parametros):
+        erro_geral[:] = "Valores de entrada negativos"
+    else:
+        nulos = np.zeros(n, dtype=bool)
+        nao_numericos = np.zeros(n, dtype=bool)
+        negativos = np.zeros(n, dtype=bool)
+        for numeros, nulos_coluna in convertidas:
+            nulos |= nulos_coluna
+            nao_numericos |= ~np.isfinite(numeros) & ~nulos_coluna
+            negativos |= numeros < 0
+        erro_geral[negativos] = "Valores de entrada negativos"
+        erro_geral[nao_numericos] = "Valor de entrada não numérico"
+        erro_geral[nulos] = "Valor de entrada nulo"
+    validos = np.equal(erro_geral, None)
+    return valores, erro_geral, validos
+
+def validar_colunas(colunas):
+    """Converte as colunas para float e aponta o erro de cada linha (valor nulo, não numérico ou negativo), com as mesmas regras do cálculo.
+
+    Retorna (lista de arrays numéricos, array de erros com None nas linhas válidas, máscara das válidas).
+    """
+    return _validar_entradas(colunas, [])
+
+# Valores guardados no armazém por linha e marketplace: os mesmos de precificar_marketplace
+_CAMPOS_ARMAZEM = ("precos", "lucros", "margens", "exatos", "faixas")
+
+def _por_linha(valor):
+    """Se o parâmetro tem um valor por linha (coluna) em vez de um valor único."""
+    return isinstance(valor, (pd.Series, np.ndarray, list, tuple))
+
+def _selecionar(valor, mascara):
+    return valor[mascara] if np.ndim(valor) else valor
+
+def _impressao_calculo(custo_embalagem, margem_desejada_perc, imposto_perc, comissoes_perc, tabelas):
+    """Impressão digital de tudo, além do custo e do peso, de que o resultado de uma linha depende."""
+    regras = {}
+    for nome in comissoes_perc:
+        regra = obter_regra(nome)
+        if regra is not None:
+            regras[nome] = regra.impressao()
+    fretes = {nome: [tabela.limites, tabela.custos, tabela.custo_kg_adicional] for nome, tabela in tabelas.items()}
+    return impressao_digital(custo_embalagem, margem_desejada_perc, imposto_perc, list(comissoes_perc.items()), regras, fretes)
+
+def calcular_precos_lote(custos_produto, pesos_g, custo_embalagem, margem_desejada_perc, imposto_perc, comissoes_perc, tabela_frete_ml_df=None, tabela_frete_amazon_df=None, tabelas_frete=None, instrumentacao=None, telemetria=False, deduplicar=True, armazem=None):
+    """Calcula preço, lucro e margem de todos os marketplaces para colunas inteiras de custo e peso.
+
+    Equivale a chamar calcular_preco_venda linha a linha, mas em uma única passada vetorizada.
+    Retorna um DataFrame com as colunas "<Marketplace> Preço Venda", "<Marketplace> Lucro R$",
+    "<Marketplace> Margem %", "<Marketplace> Preço Consistente" e "<Marketplace> Erro" para cada
+    marketplace, além de "Erro Geral". Com instrumentacao, a validação e o cálculo de cada
+    marketplace são medidos como fases separadas.
+
+    custo_embalagem, margem_desejada_perc, imposto_perc e cada comissão podem ser um valor único
+    ou um valor por linha (Series, array ou lista). Parâmetros gerais inválidos numa linha viram
+    o "Erro Geral" dela; comissões inválidas, o erro do marketplace só naquela linha.
+
+    Com deduplicar, linhas com o mesmo custo e o mesmo frete pelo peso são calculadas uma vez
+    quando o bloco tem muitas repetições (ver _precificar_deduplicado, que também reaproveita o
+    memo entre chamadas).
+
+    Estatísticas do solver por marketplace ficam em resultado.attrs["telemetria_solver"]:
+    histograma de passos, linhas sem preço consistente, linhas por faixa de preço, combinações
+    únicas e quantas delas vieram do memo. Com
+    telemetria=True também são incluídas as colunas por linha "<Marketplace> Passos Solver" e
+    "<Marketplace> Faixa".
+
+    Com armazem (ArmazemResultados), as linhas já calculadas com os mesmos parâmetros, comissões,
+    regras e tabelas de frete são lidas do armazém e só as demais passam pelo solver; os
+    acertos e falhas da chamada ficam em resultado.attrs["armazem"].
+    """
+    instrumentacao = instrumentacao or SEM_INSTRUMENTACAO
+    with instrumentacao.fase("validação"):
+        indice = custos_produto.index if isinstance(custos_produto, pd.Series) else None
+        # Parâmetros por linha são validados como colunas; os escalares valem para todas as linhas
+        parametros = {"custo_embalagem": custo_embalagem, "margem": margem_desejada_perc, "imposto": imposto_perc}
+        por_linha = [chave for chave, valor in parametros.items() if _por_linha(valor)]
+        colunas, erro_geral, validos = _validar_entradas(
+            [custos_produto, pesos_g, *(parametros[chave] for chave in por_linha)],
+            [valor for chave, valor in parametros.items() if chave not in por_linha]
+        )
+        custos, pesos = colunas[:2]
+        parametros.update({chave: coluna[validos] for chave, coluna in zip(por_linha, colunas[2:])})
+        comissoes_por_linha = {nome: _coluna_numerica(valor)[0][validos] for nome, valor in comissoes_perc.items() if _por_linha(valor)}
+        n = len(custos)
+    custos_validos = custos[validos]
+    pesos_validos = pesos[validos]
+
+    resultado = pd.DataFrame(index=indice if indice is not None else pd.RangeIndex(n))
+    if validos.any():
+        custo_base = custos_validos + parametros["custo_embalagem"]
+        margem_dec = parametros["margem"] / 100.0
+        imposto_dec = parametros["imposto"] / 100.0
+
+    tabelas = _compilar_tabelas(comissoes_perc, tabela_frete_ml_df, tabela_frete_amazon_df, tabelas_frete)
+    telemetria_solver = {}
+
+    # Com armazém: linhas válidas já calculadas (encontrados) e valores guardados, 5 por marketplace
+    armazenados = None
+    pendentes = np.ones(len(custos_validos), dtype=bool)
+    if armazem is not None and validos.any():
+        with instrumentacao.fase("armazém (consulta)"):
+            impressao = _impressao_calculo(
+                *("por linha" if chave in por_linha else valor for chave, valor in
+                  zip(("custo_embalagem", "margem", "imposto"), (custo_embalagem, margem_desejada_perc, imposto_perc))),
+                {nome: "por linha" if nome in comissoes_por_linha else valor for nome, valor in comissoes_perc.items()},
+                tabelas
+            )
+            chaves = chaves_linhas(custos_validos, pesos_validos, *(parametros[chave] for chave in por_linha), *comissoes_por_linha.values())
+            encontrados, armazenados = armazem.consultar(impressao, chaves, len(_CAMPOS_ARMAZEM) * len(comissoes_perc))
+            pendentes = ~encontrados
+            novos = np.full((int(pendentes.sum()), armazenados.shape[1]), np.nan)
+        instrumentacao.contar("linhas lidas do armazém", encontrados.sum())
+
+    for posicao_mp, (nome, comissao_perc_val) in enumerate(comissoes_perc.items()):
+        with instrumentacao.fase(f"cálculo {nome}"):
+            precos_col = np.full(n, np.nan)
+            lucros_col = np.full(n, np.nan)
+            margens_col = np.full(n, np.nan)
+            erro_col = np.full(n, None, dtype=object)
+            consistente_col = np.zeros(n, dtype=bool)
+            faixas_col = np.full(n, -1, dtype=np.int64)
+            rotulos = rotulos_faixas(())
+            estatisticas = {"combinacoes_unicas": None, "reaproveitadas_memo": 0}
+
+            if nome not in comissoes_por_linha and (not isinstance(comissao_perc_val, (int, float)) or comissao_perc_val < 0):
+                erro_col[validos] = f"Comissão inválida ({comissao_perc_val})"
+            elif validos.any():
+                regra = obter_regra(nome)
+                comissao = comissoes_por_linha.get(nome, comissao_perc_val)
+                denominador_base = 1 - imposto_dec - comissao / 100.0
+                erros = np.full(len(custos_validos), None, dtype=object)
+                if nome in comissoes_por_linha:
+                    invalidas = ~(comissao >= 0)
+                    brutos = np.asarray(comissao_perc_val, dtype=object)[validos][invalidas]
+                    erros[invalidas] = [f"Comissão inválida ({valor})" for valor in brutos]
+                erros[np.equal(erros, None) & (denominador_base <= 1e-6)] = "Imposto+Comissão >= 100%"
+                erro_col[validos] = erros
+                calcular = np.equal(erros, None)
+
+                # Arrays das linhas válidas; as linhas com erro de comissão ficam sem preço (faixa -1)
+                calculados = [np.full(len(custos_validos), np.nan), np.full(len(custos_validos), np.nan),
+                              np.full(len(custos_validos), np.nan), np.zeros(len(custos_validos), dtype=bool),
+                              np.full(len(custos_validos), -1, dtype=np.int64)]
+                selecionadas = calcular & pendentes
+                if selecionadas.any():
+                    tabela = tabelas.get(regra.tabela_frete) if regra is not None else None
+                    fretes_peso = tabela.custo(pesos_validos[selecionadas]) if tabela is not None else np.zeros(int(selecionadas.sum()))
+                    argumentos = (regra, custo_base[selecionadas], fretes_peso, _selecionar(margem_dec, selecionadas), _selecionar(denominador_base, selecionadas))
+                    if deduplicar:
+                        novos_valores, estatisticas = _precificar_deduplicado(nome, *argumentos)
+                    else:
+                        novos_valores = precificar_marketplace(*argumentos)
+                    for destino, valores in zip(calculados, novos_valores):
+                        destino[selecionadas] = valores
+                if armazenados is not None:
+                    colunas = slice(posicao_mp * len(_CAMPOS_ARMAZEM), (posicao_mp + 1) * len(_CAMPOS_ARMAZEM))
+                    novos[:, colunas] = np.column_stack([valores[pendentes] for valores in calculados])
+                    lidas = calcular & encontrados
+                    for destino, guardados in zip(calculados, armazenados[calcular[encontrados], colunas].T):
+                        destino[lidas] = guardados.astype(destino.dtype)
+                precos_col[validos], lucros_col[validos], margens_col[validos], consistente_col[validos], faixas_col[validos] = calculados
+                if calcular.any() and regra is not None and regra.tem_taxas:
+                    rotulos = rotulos_faixas(regra.pontos_quebra)
+
+        resultado[f"{nome} Preço Venda"] = precos_col
+        resultado[f"{nome} Lucro R$"] = lucros_col
+        resultado[f"{nome} Margem %"] = margens_col
+        # Nulo (pd.NA) nas linhas sem preço calculado
+        resultado[f"{nome} Preço Consistente"] = pd.arrays.BooleanArray(consistente_col, faixas_col < 0)
+        resultado[f"{nome} Erro"] = erro_col
+        if telemetria:
+            resultado[f"{nome} Passos Solver"] = pd.array(np.where(faixas_col >= 0, faixas_col + 1, None), dtype="Int64")
+            resultado[f"{nome} Faixa"] = np.array([rotulos[f] if f >= 0 else None for f in faixas_col.tolist()], dtype=object)
+
+        resolvidas = faixas_col[faixas_col >= 0]
+        contagem = np.bincount(resolvidas, minlength=len(rotulos))
+        nao_convergidos = int(np.count_nonzero(~consistente_col & (faixas_col >= 0)))
+        telemetria_solver[nome] = {
+            "histograma_passos": {passos + 1: int(c) for passos, c in enumerate(contagem) if c},
+            "nao_convergidos": nao_convergidos,
+            "linhas_por_faixa": {rotulos[f]: int(c) for f, c in enumerate(contagem) if c},
+            **estatisticas,
+        }
+        instrumentacao.contar(f"passos do solver ({nome})", (resolvidas + 1).sum())
+        instrumentacao.contar(f"linhas sem preço consistente ({nome})", nao_convergidos)
+        if estatisticas["combinacoes_unicas"] is not None:
+            instrumentacao.contar(f"combinações resolvidas ({nome})", estatisticas["combinacoes_unicas"] - estatisticas["reaproveitadas_memo"])
+
+    if armazenados is not None:
+        with instrumentacao.fase("armazém (gravação)"):
+            armazem.guardar(impressao, chaves[pendentes], novos)
+        resultado.attrs["armazem"] = {"acertos": int(encontrados.sum()), "falhas": int(pendentes.sum())}
+
+    resultado["Erro Geral"] = erro_geral
+    resultado.attrs["telemetria_solver"] = telemetria_solver
+    return resultado
+
+def coluna_ou_zeros(df, coluna):
+    """Coluna do DataFrame, ou uma Series de zeros com o mesmo índice se a coluna não existir."""
+    return df[coluna] if coluna in df.columns else pd.Series(0.0, index=df.index)
+
+def calcular_precos_dataframe(df, coluna_custo, coluna_peso, custo_embalagem, margem_desejada_perc, imposto_perc, comissoes_perc, tabela_frete_ml_df=None, tabela_frete_amazon_df=None, tabelas_frete=None, instrumentacao=None, telemetria=False, deduplicar=True, armazem=None, colunas_parametros=None):
+    """Versão de calcular_precos_lote que lê custo e peso das colunas de um DataFrame (0 se a coluna não existir).
+
+    Com colunas_parametros os parâmetros também podem vir de colunas (ver parametros_dataframe).
+    """
+    custos, pesos = coluna_ou_zeros(df, coluna_custo), coluna_ou_zeros(df, coluna_peso)
+    parametros = parametros_dataframe(df, custo_embalagem, margem_desejada_perc, imposto_perc, comissoes_perc, colunas_parametros)
+    return calcular_precos_lote(custos, pesos, *parametros, tabela_frete_ml_df, tabela_frete_amazon_df, tabelas_frete, instrumentacao, telemetria, deduplicar, armazem)
+
+def parametros_dataframe(df, custo_embalagem, margem_desejada_perc, imposto_perc, comissoes_perc, colunas_parametros=None):
+    """(custo_embalagem, margem_desejada_perc, imposto_perc, comissoes_perc) por linha, lidos das colunas do DataFrame.
+
+    colunas_parametros: {"custo_embalagem" | "margem_desejada_perc" | "imposto_perc": coluna,
+    "comissoes_perc": {marketplace: coluna}}. Parâmetros sem coluna, ou com a coluna ausente do
+    DataFrame, ficam com o valor geral, que também preenche as células vazias.
+    """
+    colunas_parametros = colunas_parametros or {}
+
+    def por_linha(coluna, padrao):
+        if not coluna or coluna not in df.columns:
+            return padrao
+        return df[coluna].where(df[coluna].notna(), padrao)
+
+    colunas_comissao = colunas_parametros.get("comissoes_perc") or {}
+    return (por_linha(colunas_parametros.get("custo_embalagem"), custo_embalagem),
+            por_linha(colunas_parametros.get("margem_desejada_perc"), margem_desejada_perc),
+            por_linha(colunas_parametros.get("imposto_perc"), imposto_perc),
+            {nome: por_linha(colunas_comissao.get(nome), valor) for nome, valor in comissoes_perc.items()})
+
+def colunas_dos_parametros(colunas_parametros):
+    """Nomes das colunas indicadas em colunas_parametros (ver parametros_dataframe)."""
+    colunas_parametros = colunas_parametros or {}
+    colunas = [colunas_parametros.get(chave) for chave in ("custo_embalagem", "margem_desejada_perc", "imposto_perc")]
+    colunas += list((colunas_parametros.get("comissoes_perc") or {}).values())
+    return [coluna for coluna in dict.fromkeys(colunas) if coluna]
+
+# --- AUDITORIA DE MARGENS (PREÇO -> MARGEM) ---
+
+def auditar_margens_lote(precos_venda, custos_produto, pesos_g, custo_embalagem, imposto_perc, comissoes_perc, margem_minima_perc=None, tabela_frete_ml_df=None, tabela_frete_amazon_df=None, tabelas_frete=None):
+    """Caminho inverso de calcular_precos_lote: lucro e margem realizados com os preços atuais dos anúncios.
+
+    Para cada marketplace desconta do preço a comissão, o imposto, a taxa fixa e o frete da faixa
+    do preço (as mesmas regras do cálculo de preço) e o custo com embalagem. Retorna um DataFrame
+    com "<Marketplace> Lucro Real R$", "<Marketplace> Margem Real %", "<Marketplace> Abaixo da
+    Margem" (margem real < margem_minima_perc; nulo sem limite ou sem cálculo) e
+    "<Marketplace> Erro" para cada marketplace, além de "Erro Geral".
+    """
+    indice = precos_venda.index if isinstance(precos_venda, pd.Series) else None
+    parametros = [custo_embalagem, imposto_perc] + ([margem_minima_perc] if margem_minima_perc is not None else [])
+    (precos, custos, pesos), erro_geral, validos = _validar_entradas([precos_venda, custos_produto, pesos_g], parametros)
+    n = len(precos)
+    precos_validos = precos[validos]
+    custo_base = custos[validos] + custo_embalagem if validos.any() else np.zeros(0)
+    tabelas = _compilar_tabelas(comissoes_perc, tabela_frete_ml_df, tabela_frete_amazon_df, tabelas_frete)
+
+    resultado = pd.DataFrame(index=indice if indice is not None else pd.RangeIndex(n))
+    for nome, comissao_perc_val in comissoes_perc.items():
+        lucros_col = np.full(n, np.nan)
+        margens_col = np.full(n, np.nan)
+        erro_col = np.full(n, None, dtype=object)
+        abaixo_col = np.zeros(n, dtype=bool)
+
+        if not isinstance(comissao_perc_val, (int, float)) or comissao_perc_val < 0:
+            erro_col[validos] = f"Comissão inválida ({comissao_perc_val})"
+        elif validos.any():
+            liquido = precos_validos * (1 - imposto_perc / 100.0 - comissao_perc_val / 100.0)
+            regra = obter_regra(nome)
+            if regra is not None and regra.tem_taxas:
+                tabela = tabelas.get(regra.tabela_frete)
+                fretes = tabela.custo(pesos[validos]) if tabela is not None else 0.00
+                liquido = liquido - regra.taxa_fixa(precos_validos) - np.where(regra.frete_cobrado(precos_validos), fretes, 0.00)
+            lucro_real = liquido - custo_base
+            margem_real = np.zeros(len(custo_base))
+            positivos = custo_base > 1e-6
+            margem_real[positivos] = lucro_real[positivos] / custo_base[positivos] * 100
+            lucros_col[validos] = _arredondar(lucro_real)
+            margens_col[validos] = _arredondar(margem_real)
+            if margem_minima_perc is not None:
+                abaixo_col[validos] = margens_col[validos] < margem_minima_perc
+
+        resultado[f"{nome} Lucro Real R$"] = lucros_col
+        resultado[f"{nome} Margem Real %"] = margens_col
+        resultado[f"{nome} Abaixo da Margem"] = pd.arrays.BooleanArray(abaixo_col, np.isnan(margens_col) | (margem_minima_perc is None))
+        resultado[f"{nome} Erro"] = erro_col
+
+    resultado["Erro Geral"] = erro_geral
+    return resultado
+
+def auditar_margens_dataframe(df, coluna_preco, coluna_custo, coluna_peso, custo_embalagem, imposto_perc, comissoes_perc, margem_minima_perc=None, tabela_frete_ml_df=None, tabela_frete_amazon_df=None, tabelas_frete=None):
+    """Versão de auditar_margens_lote que lê preço, custo e peso das colunas de um DataFrame (0 se custo ou peso não existirem)."""
+    custos, pesos = coluna_ou_zeros(df, coluna_custo), coluna_ou_zeros(df, coluna_peso)
+    return auditar_margens_lote(df[coluna_preco], custos, pesos, custo_embalagem, imposto_perc, comissoes_perc, margem_minima_perc, tabela_frete_ml_df, tabela_frete_amazon_df, tabelas_frete)
@@ -0,0 +1,60 @@
+# catalogo_sintetico.py
+# Gera catálogos sintéticos para testes de desempenho, com distribuições próximas das reais:
+# custos log-normais (a maioria barata, cauda de itens caros), uma parcela de custos que leva
+# o preço para perto de R$ 79 (onde mudam taxa fixa e frete) e pesos acima de 9,99 kg (faixa
+# do kg adicional da Amazon).
+import argparse
+
+import numpy as np
+import pandas as pd
+
+COLUNA_CUSTO = "Custo"
+COLUNA_PESO = "Peso (g)"
+
+TAMANHOS_PADRAO = {"1k": 1_000, "100k": 100_000, "1M": 1_000_000}
+
+
+def gerar_catalogo(n_linhas, semente=0, coluna_custo=COLUNA_CUSTO, coluna_peso=COLUNA_PESO,
+                   fracao_perto_79=0.15, fracao_pesados=0.05):
+    """Catálogo com n_linhas produtos (SKU, custo em R$ e peso em gramas)."""
+    gerador = np.random.default_rng(semente)
+
+    # Custos: log-normal com mediana ~R$ 25
+    custos = gerador.lognormal(mean=np.log(25.0), sigma=0.9, size=n_linhas)
+    # Custos que, com margem de 30% e taxas típicas, dão preço de venda entre ~R$ 70 e ~R$ 90
+    perto_79 = gerador.random(n_linhas) < fracao_perto_79
+    custos[perto_79] = gerador.uniform(28.0, 40.0, size=perto_79.sum())
+    custos = np.round(np.clip(custos, 0.50, 5000.0), 2)
+
+    # Pesos: maioria leve (até ~2 kg), uma parcela entre 2 e 9,99 kg e outra acima de 9,99 kg
+    pesos = gerador.gamma(shape=2.0, scale=300.0, size=n_linhas)
+    medios = gerador.random(n_linhas) < 0.15
+    pesos[medios] = gerador.uniform(2000, 9990, size=medios.sum())
+    pesados = gerador.random(n_linhas) < fracao_pesados
+    pesos[pesados] = gerador.uniform(9991, 30000, size=pesados.sum())
+    pesos = np.round(np.clip(pesos, 50, None))
+
+    return pd.DataFrame({
+        "SKU": [f"SKU{i:07d}" for i in range(n_linhas)],
+        coluna_custo: custos,
+        coluna_peso: pesos,
+    })
+
+
+def salvar_catalogo(df, caminho):
+    """Salva o catálogo em CSV ou Excel, pela extensão do arquivo."""
+    if str(caminho).lower().endswith((".xlsx", ".xls")):
+        df.to_excel(caminho, index=False)
+    else:
+        df.to_csv(caminho, index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera um catálogo sintético de produtos para testes de desempenho.")
+    parser.add_argument('arquivo_saida', help='Caminho do catálogo gerado (.csv ou .xlsx).')
+    parser.add_argument('--linhas', type=int, default=100_000, help='Número de produtos (padrão: 100000).')
+    parser.add_argument('--semente', type=int, default=0, help='Semente do gerador aleatório (padrão: 0).')
+    args = parser.parse_args()
+
+    salvar_catalogo(gerar_catalogo(args.linhas, args.semente), args.arquivo_saida)
+    print(f"Catálogo com {args.linhas} produtos salvo em '{args.arquivo_saida}'.")
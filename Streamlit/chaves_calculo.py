@@ -0,0 +1,33 @@
+# chaves_calculo.py
+# Chaves estáveis para reaproveitar resultados do cálculo: a impressão digital de tudo o que não
+# muda de uma linha para outra (parâmetros, comissões, regras, tabelas de frete) e uma chave de
+# 64 bits por linha a partir dos valores que mudam (custo, peso, parâmetros por linha). Usadas
+# pela calculadora para consultar o armazém de resultados, sem depender de como ele guarda.
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+
+# Muda quando o cálculo muda, para não reaproveitar resultados de versões anteriores
+VERSAO_CALCULO = 1
+
+
+def impressao_digital(*partes):
+    """Hash estável (hex) de valores simples, listas, dicionários e arrays."""
+    def normalizar(valor):
+        if isinstance(valor, np.ndarray):
+            return valor.astype(float).tolist()
+        if isinstance(valor, dict):
+            return {str(chave): normalizar(item) for chave, item in sorted(valor.items(), key=lambda par: str(par[0]))}
+        if isinstance(valor, (list, tuple)):
+            return [normalizar(item) for item in valor]
+        return valor
+    texto = json.dumps([VERSAO_CALCULO, *map(normalizar, partes)], default=repr, ensure_ascii=False)
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()[:32]
+
+
+def chaves_linhas(*colunas):
+    """Chave de 64 bits (int64) de cada linha a partir dos valores numéricos das colunas."""
+    hashes = pd.util.hash_pandas_object(pd.DataFrame({i: np.asarray(coluna, dtype=float) for i, coluna in enumerate(colunas)}), index=False)
+    return hashes.to_numpy().view(np.int64)
@@ -0,0 +1,171 @@
+# escritores_saida.py
+# Escritores que recebem o resultado em blocos de linhas e gravam direto no destino (caminho ou
+# buffer em memória), sem montar a tabela inteira de novo no formato de saída.
+import io
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+FORMATOS_SAIDA = ("xlsx", "csv", "parquet")
+
+EXTENSOES = {"xlsx": ".xlsx", "csv": ".csv", "parquet": ".parquet"}
+
+MIME_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def _valor_celula(valor):
+    if valor is None or (not isinstance(valor, str) and pd.isna(valor)):
+        return None
+    if isinstance(valor, np.generic):
+        return valor.item()
+    return valor
+
+
+class EscritorCsv:
+    """Acrescenta blocos a um CSV (UTF-8); o cabeçalho é escrito só no primeiro bloco.
+
+    Em todos os escritores, fechar() pode ser chamado mais de uma vez (só a primeira grava).
+    """
+
+    def __init__(self, destino):
+        if isinstance(destino, (str, os.PathLike)):
+            self._arquivo = open(destino, "w", newline="", encoding="utf-8")
+            self._buffer_externo = False
+        else:
+            self._arquivo = io.TextIOWrapper(destino, encoding="utf-8", newline="")
+            self._buffer_externo = True
+        self._primeiro_bloco = True
+
+    def escrever(self, df):
+        df.to_csv(self._arquivo, header=self._primeiro_bloco, index=False)
+        self._primeiro_bloco = False
+
+    def fechar(self):
+        if self._arquivo is None:
+            return
+        self._arquivo.flush()
+        if self._buffer_externo:
+            self._arquivo.detach()
+        else:
+            self._arquivo.close()
+        self._arquivo = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+
+
+class EscritorXlsx:
+    """Acrescenta blocos a um .xlsx usando o modo write-only do openpyxl (linhas vão direto para o disco)."""
+
+    def __init__(self, destino):
+        from openpyxl import Workbook
+
+        self.destino = destino
+        self._livro = Workbook(write_only=True)
+        self._planilha = self._livro.create_sheet("Sheet1")
+        self._primeiro_bloco = True
+
+    def escrever(self, df):
+        if self._primeiro_bloco:
+            self._planilha.append([str(coluna) for coluna in df.columns])
+            self._primeiro_bloco = False
+        for linha in df.itertuples(index=False, name=None):
+            self._planilha.append([_valor_celula(valor) for valor in linha])
+
+    def fechar(self):
+        if self._livro is not None:
+            self._livro.save(self.destino)
+            self._livro = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+
+
+class EscritorParquet:
+    """Acrescenta blocos a um arquivo Parquet (um row group por bloco). Requer pyarrow.
+
+    O esquema vem do primeiro bloco; colunas de texto/mistas são gravadas como string para que
+    todos os blocos tenham o mesmo esquema.
+    """
+
+    def __init__(self, destino):
+        import pyarrow  # noqa: F401  (falha cedo se pyarrow não estiver instalado)
+
+        self.destino = destino
+        self._escritor = None
+        self._esquema = None
+
+    def _tabela(self, df):
+        import pyarrow as pa
+
+        df = df.copy()
+        df.columns = [str(coluna) for coluna in df.columns]
+        for coluna in df.columns:
+            texto_no_esquema = self._esquema is not None and pa.types.is_string(self._esquema.field(coluna).type)
+            if texto_no_esquema or df[coluna].dtype == object or pd.api.types.is_string_dtype(df[coluna]):
+                df[coluna] = df[coluna].map(lambda v: None if _valor_celula(v) is None else str(v)).astype(object)
+        if self._esquema is None:
+            tabela = pa.Table.from_pandas(df, preserve_index=False)
+            campos = [pa.field(campo.name, pa.string()) if pa.types.is_null(campo.type) else campo for campo in tabela.schema]
+            self._esquema = pa.schema(campos)
+        return pa.Table.from_pandas(df, schema=self._esquema, preserve_index=False)
+
+    def escrever(self, df):
+        import pyarrow.parquet as pq
+
+        tabela = self._tabela(df)
+        if self._escritor is None:
+            self._escritor = pq.ParquetWriter(self.destino, self._esquema)
+        self._escritor.write_table(tabela)
+
+    def fechar(self):
+        if self._escritor is not None:
+            self._escritor.close()
+            self._escritor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+
+
+ESCRITORES = {"xlsx": EscritorXlsx, "csv": EscritorCsv, "parquet": EscritorParquet}
+
+
+def formato_do_arquivo(caminho, padrao="xlsx"):
+    """Deduz o formato de saída pela extensão do arquivo."""
+    extensao = os.path.splitext(str(caminho))[1].lower()
+    for formato, extensao_formato in EXTENSOES.items():
+        if extensao == extensao_formato:
+            return formato
+    return padrao
+
+
+def abrir_escritor(destino, formato=None):
+    """Abre o escritor do formato indicado (ou deduzido pela extensão do destino)."""
+    formato = formato or formato_do_arquivo(destino)
+    if formato not in ESCRITORES:
+        raise ValueError(f"Formato de saída desconhecido: {formato}. Use um de {', '.join(FORMATOS_SAIDA)}.")
+    return ESCRITORES[formato](destino)
+
+
+def escrever_resultado(df, destino, formato=None, tamanho_bloco=50000):
+    """Grava o DataFrame inteiro em blocos no formato escolhido e devolve o tempo gasto (segundos)."""
+    inicio = time.perf_counter()
+    with abrir_escritor(destino, formato) as escritor:
+        for posicao in range(0, max(len(df), 1), tamanho_bloco):
+            escritor.escrever(df.iloc[posicao:posicao + tamanho_bloco])
+    return time.perf_counter() - inicio
@@ -0,0 +1,120 @@
+# grade_cenarios.py
+# Grade de cenários ("e se"): preço e margem de cada SKU em cada marketplace para todas as
+# combinações de margem desejada x imposto x embalagem, calculados numa passada vetorizada por
+# bloco de pontos da grade. SKUs com o mesmo custo e frete são calculados uma vez, e o tamanho
+# dos blocos é limitado para caber na memória.
+import itertools
+
+import numpy as np
+import pandas as pd
+
+import calculadora_modulo as calculadora
+from regras_marketplace import PRECO_REFERENCIA, obter_regra
+
+MAX_PONTOS_GRADE = 1000
+# Combinações (custo, frete) x pontos da grade calculadas de uma vez (cada célula ocupa algumas dezenas de bytes)
+MAX_CELULAS_BLOCO = 2_000_000
+# Limite para devolver o preço e a margem de cada SKU em cada ponto (detalhado=True)
+MAX_CELULAS_DETALHE = 5_000_000
+
+
+def valores_faixa(inicio, fim, passos):
+    """passos valores igualmente espaçados de inicio a fim (só inicio se passos <= 1)."""
+    if passos <= 1 or fim == inicio:
+        return np.array([float(inicio)])
+    return np.round(np.linspace(inicio, fim, int(passos)), 4)
+
+
+def pontos_grade(margens_perc, impostos_perc, embalagens):
+    """Combinações (margem %, imposto %, embalagem R$) da grade, validando o limite de pontos."""
+    pontos = list(itertools.product(margens_perc, impostos_perc, embalagens))
+    if len(pontos) > MAX_PONTOS_GRADE:
+        raise ValueError(f"A grade tem {len(pontos)} pontos; o máximo é {MAX_PONTOS_GRADE}. Reduza o número de passos.")
+    return np.array(pontos, dtype=float).reshape(-1, 3)
+
+
+def calcular_grade_cenarios(custos_produto, pesos_g, margens_perc, impostos_perc, embalagens, comissoes_perc,
+                            tabelas_frete=None, preco_referencia=PRECO_REFERENCIA, detalhado=False,
+                            max_celulas_bloco=MAX_CELULAS_BLOCO):
+    """Calcula o catálogo em todos os pontos da grade margem x imposto x embalagem.
+
+    Retorna um DataFrame com uma linha por ponto e marketplace: "Margem %", "Imposto %",
+    "Embalagem R$", "Marketplace", "Preço Médio", "Margem Real Média %", "% Acima de R$ 79"
+    (preço >= preco_referencia), "SKUs Inconsistentes" e "SKUs". Linhas com custo ou peso
+    inválido (as mesmas que calcular_precos_lote recusa) são ignoradas; quantas por erro fica em
+    resultado.attrs["linhas_ignoradas"]. Com detalhado=True retorna também {marketplace: {"precos": array,
+    "margens": array}} com forma (pontos, SKUs), se couber em MAX_CELULAS_DETALHE.
+    """
+    pontos = pontos_grade(margens_perc, impostos_perc, embalagens)
+    (custos, pesos), erros, validos = calculadora.validar_colunas([custos_produto, pesos_g])
+    linhas_ignoradas = {str(erro): int(quantidade) for erro, quantidade in pd.Series(erros[~validos]).value_counts().items()}
+    custos, pesos = custos[validos], pesos[validos]
+    n = len(custos)
+    if detalhado and len(pontos) * n * len(comissoes_perc) > MAX_CELULAS_DETALHE:
+        raise ValueError(f"O detalhamento teria {len(pontos) * n * len(comissoes_perc)} valores; o máximo é {MAX_CELULAS_DETALHE}.")
+
+    # O frete pelo peso não depende dos parâmetros da grade: calculado uma vez por tabela
+    tabelas = calculadora.compilar_tabelas_frete(tabelas_frete or {})
+    fretes_por_tabela = {nome: tabela.custo(pesos) for nome, tabela in tabelas.items()}
+
+    agregados = {}
+    detalhes = {} if detalhado else None
+    for nome, comissao_perc in comissoes_perc.items():
+        destino = {campo: np.full(len(pontos), np.nan) for campo in ("preco", "margem", "acima", "inconsistentes")}
+        agregados[nome] = destino
+        if detalhado:
+            detalhes[nome] = {"precos": np.full((len(pontos), n), np.nan), "margens": np.full((len(pontos), n), np.nan)}
+        regra = obter_regra(nome)
+        fretes = fretes_por_tabela.get(regra.tabela_frete) if regra is not None else None
+        fretes = fretes if fretes is not None else np.zeros(n)
+        # Cada combinação (custo, frete) é calculada uma vez; as médias são ponderadas pelo
+        # número de SKUs de cada combinação
+        codigos, chaves = pd.factorize(custos + 1j * fretes)
+        contagens = np.bincount(codigos, minlength=len(chaves)).astype(float)
+        u = len(chaves)
+        # Pontos em que imposto + comissão chegam a 100% não têm preço
+        possiveis = np.flatnonzero(1 - pontos[:, 1] / 100.0 - comissao_perc / 100.0 > 1e-6)
+        pontos_por_bloco = max(1, max_celulas_bloco // max(u, 1))
+
+        for inicio in range(0, len(possiveis) if u else 0, pontos_por_bloco):
+            posicoes = possiveis[inicio:inicio + pontos_por_bloco]
+            bloco = pontos[posicoes]
+            k = len(bloco)
+            margem_dec = np.repeat(bloco[:, 0] / 100.0, u)
+            denominador = np.repeat(1 - bloco[:, 1] / 100.0 - comissao_perc / 100.0, u)
+            custo_base = np.tile(chaves.real, k) + np.repeat(bloco[:, 2], u)
+            precos, _, margens, exatos, _ = calculadora.precificar_marketplace(
+                regra, custo_base, np.tile(chaves.imag, k), margem_dec, denominador
+            )
+            precos, margens, exatos = precos.reshape(k, u), margens.reshape(k, u), exatos.reshape(k, u)
+            destino["preco"][posicoes] = precos @ contagens / n
+            destino["margem"][posicoes] = margens @ contagens / n
+            destino["acima"][posicoes] = (precos >= preco_referencia) @ contagens / n * 100
+            destino["inconsistentes"][posicoes] = (~exatos) @ contagens
+            if detalhado:
+                detalhes[nome]["precos"][posicoes] = precos[:, codigos]
+                detalhes[nome]["margens"][posicoes] = margens[:, codigos]
+
+    resultado = pd.concat([
+        pd.DataFrame({
+            "Margem %": pontos[:, 0],
+            "Imposto %": pontos[:, 1],
+            "Embalagem R$": pontos[:, 2],
+            "Marketplace": nome,
+            "Preço Médio": np.round(valores["preco"], 2),
+            "Margem Real Média %": np.round(valores["margem"], 2),
+            f"% Acima de R$ {preco_referencia:.0f}": np.round(valores["acima"], 2),
+            "SKUs Inconsistentes": pd.array(np.where(np.isnan(valores["inconsistentes"]), None, valores["inconsistentes"]), dtype="Int64"),
+            "SKUs": n,
+        })
+        for nome, valores in agregados.items()
+    ], ignore_index=True)
+    resultado.attrs["linhas_ignoradas"] = linhas_ignoradas
+    return (resultado, detalhes) if detalhado else resultado
+
+
+def calcular_grade_dataframe(df, coluna_custo, coluna_peso, margens_perc, impostos_perc, embalagens, comissoes_perc, tabelas_frete=None, **opcoes):
+    """Versão de calcular_grade_cenarios que lê custo e peso das colunas de um DataFrame (0 se a coluna não existir)."""
+    custos, pesos = calculadora.coluna_ou_zeros(df, coluna_custo), calculadora.coluna_ou_zeros(df, coluna_peso)
+    return calcular_grade_cenarios(custos, pesos, margens_perc, impostos_perc, embalagens,
+                                   comissoes_perc, tabelas_frete, **opcoes)
@@ -0,0 +1,144 @@
+# instrumentacao.py
+# Instrumentação de uma execução: tempo e pico de memória de cada fase (leitura, validação,
+# cálculo por marketplace, escrita), contadores de linhas e, opcionalmente, um perfil cProfile
+# gravado em arquivo para análise com pstats/snakeviz.
+import cProfile
+import io
+import marshal
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+class Instrumentacao:
+    """Acumula tempos, picos de memória e contadores de uma execução.
+
+    Com ativa=False todas as operações são vazias, assim o código instrumentado não precisa
+    testar se a medição está ligada.
+    """
+
+    def __init__(self, ativa=True, medir_memoria=False, arquivo_cprofile=None, cprofile=False):
+        self.ativa = ativa
+        self.medir_memoria = ativa and medir_memoria
+        self.arquivo_cprofile = arquivo_cprofile
+        self.fases = {}
+        self.contadores = {}
+        self._perfil = cProfile.Profile() if ativa and (cprofile or arquivo_cprofile) else None
+        self._inicio = None
+        self._total = None
+        self._pico_total = 0
+        self._iniciou_tracemalloc = False
+
+    def iniciar(self):
+        if not self.ativa:
+            return self
+        if self.medir_memoria and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._iniciou_tracemalloc = True
+        if self._perfil is not None:
+            self._perfil.enable()
+        self._inicio = time.perf_counter()
+        return self
+
+    def finalizar(self):
+        if not self.ativa or self._inicio is None:
+            return self
+        self._total = time.perf_counter() - self._inicio
+        if self._perfil is not None:
+            self._perfil.disable()
+            if self.arquivo_cprofile:
+                self._perfil.dump_stats(self.arquivo_cprofile)
+        if self.medir_memoria and tracemalloc.is_tracing():
+            self._pico_total = max(self._pico_total, tracemalloc.get_traced_memory()[1])
+            if self._iniciou_tracemalloc:
+                tracemalloc.stop()
+        self._inicio = None
+        return self
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.finalizar()
+
+    @contextmanager
+    def fase(self, nome):
+        """Mede o tempo (acumulado entre chamadas) e o pico de memória do bloco."""
+        if not self.ativa:
+            yield
+            return
+        medir_memoria = self.medir_memoria and tracemalloc.is_tracing()
+        if medir_memoria:
+            self._pico_total = max(self._pico_total, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            fase = self.fases.setdefault(nome, {"segundos": 0.0, "chamadas": 0, "pico_memoria_mb": None})
+            fase["segundos"] += time.perf_counter() - inicio
+            fase["chamadas"] += 1
+            if medir_memoria:
+                pico = tracemalloc.get_traced_memory()[1]
+                self._pico_total = max(self._pico_total, pico)
+                fase["pico_memoria_mb"] = max(fase["pico_memoria_mb"] or 0.0, pico / 1024 ** 2)
+
+    def contar(self, nome, quantidade=1):
+        if self.ativa:
+            self.contadores[nome] = self.contadores.get(nome, 0) + int(quantidade)
+
+    def relatorio(self):
+        """Resumo da execução como dicionário (serializável em JSON)."""
+        return {
+            "total_segundos": self._total,
+            "pico_memoria_mb": self._pico_total / 1024 ** 2 if self.medir_memoria else None,
+            "fases": {nome: dict(fase) for nome, fase in self.fases.items()},
+            "contadores": dict(self.contadores),
+            "arquivo_cprofile": self.arquivo_cprofile,
+        }
+
+    def tabela_fases(self):
+        """Fases como DataFrame (uma linha por fase, na ordem em que foram executadas)."""
+        return pd.DataFrame([
+            {"Fase": nome, "Tempo (s)": round(fase["segundos"], 4), "Chamadas": fase["chamadas"],
+             "Pico de Memória (MB)": None if fase["pico_memoria_mb"] is None else round(fase["pico_memoria_mb"], 2)}
+            for nome, fase in self.fases.items()
+        ], columns=["Fase", "Tempo (s)", "Chamadas", "Pico de Memória (MB)"])
+
+    def linhas_resumo(self):
+        """Resumo em texto para a linha de comando."""
+        relatorio = self.relatorio()
+        linhas = ["Perfil de execução:"]
+        for nome, fase in relatorio["fases"].items():
+            memoria = "" if fase["pico_memoria_mb"] is None else f"  pico {fase['pico_memoria_mb']:.1f} MB"
+            linhas.append(f"  {nome:<28} {fase['segundos']:>9.3f}s{memoria}")
+        if relatorio["total_segundos"] is not None:
+            linhas.append(f"  {'total':<28} {relatorio['total_segundos']:>9.3f}s")
+        for nome, valor in relatorio["contadores"].items():
+            linhas.append(f"  {nome}: {valor}")
+        if relatorio["pico_memoria_mb"] is not None:
+            linhas.append(f"  pico de memória: {relatorio['pico_memoria_mb']:.1f} MB")
+        if relatorio["arquivo_cprofile"]:
+            linhas.append(f"  perfil cProfile salvo em '{relatorio['arquivo_cprofile']}'")
+        return linhas
+
+    def perfil_cprofile(self):
+        """Estatísticas do cProfile serializadas (formato do pstats/dump_stats), ou None."""
+        if self._perfil is None:
+            return None
+        self._perfil.create_stats()
+        return marshal.dumps(self._perfil.stats)
+
+    def funcoes_mais_lentas(self, quantidade=20):
+        """Texto com as funções de maior tempo acumulado no cProfile, ou None."""
+        if self._perfil is None:
+            return None
+        saida = io.StringIO()
+        pstats.Stats(self._perfil, stream=saida).sort_stats("cumulative").print_stats(quantidade)
+        return saida.getvalue()
+
+
+SEM_INSTRUMENTACAO = Instrumentacao(ativa=False)
@@ -0,0 +1,127 @@
+# leitura_planilha.py
+# Leitura das planilhas de produtos. O separador e a vírgula decimal do CSV são detectados numa
+# amostra do início do arquivo e a leitura usa o parser em C do pandas (em vez do parser em
+# Python exigido por sep=None), só com as colunas pedidas. Custo e peso escritos com vírgula
+# decimal ("12,50" ou "1.234,50") viram float; os demais valores inválidos ficam como estão
+# para a validação apontar o problema de cada linha.
+import csv
+import io
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+import calculadora_modulo as calculadora
+
+TAMANHO_AMOSTRA = 64 * 1024
+_NUMERO_VIRGULA = re.compile(r"\s*[-+]?(?:\d{1,3}(?:\.\d{3})+|\d*),\d+\s*")
+_NUMERO_PONTO = re.compile(r"\s*[-+]?\d*\.\d+\s*")
+_MILHAR_PONTO = re.compile(r"\s*[-+]?\d{1,3}(?:\.\d{3})+,\d+\s*")
+
+
+def ler_amostra(origem, tamanho_amostra=TAMANHO_AMOSTRA):
+    """Início do arquivo (caminho, bytes ou arquivo aberto) como texto, terminando numa linha completa."""
+    if isinstance(origem, (str, os.PathLike)):
+        with open(origem, "rb") as arquivo:
+            dados = arquivo.read(tamanho_amostra)
+    elif isinstance(origem, (bytes, bytearray)):
+        dados = bytes(origem[:tamanho_amostra])
+    else:
+        posicao = origem.tell()
+        dados = origem.read(tamanho_amostra)
+        origem.seek(posicao)
+    amostra = dados.decode("utf-8", errors="replace")
+    if len(dados) == tamanho_amostra and "\n" in amostra:
+        amostra = amostra[:amostra.rindex("\n")]
+    return amostra
+
+
+def _separador(amostra):
+    try:
+        return csv.Sniffer().sniff(amostra, delimiters=",;\t|").delimiter
+    except csv.Error:
+        return ","
+
+
+def detectar_separador(origem, tamanho_amostra=TAMANHO_AMOSTRA):
+    """Detecta o separador do CSV a partir de uma amostra do início do arquivo."""
+    return _separador(ler_amostra(origem, tamanho_amostra))
+
+
+def detectar_decimal(amostra, separador):
+    """(decimal, milhar) dos números da amostra: (",", "." ou None) no padrão brasileiro, senão (".", None)."""
+    if separador == ",":
+        return ".", None
+    campos = [campo for linha in csv.reader(io.StringIO(amostra), delimiter=separador) for campo in linha]
+    virgulas = sum(1 for campo in campos if _NUMERO_VIRGULA.fullmatch(campo))
+    pontos = sum(1 for campo in campos if _NUMERO_PONTO.fullmatch(campo))
+    if virgulas <= pontos:
+        return ".", None
+    return ",", "." if any(_MILHAR_PONTO.fullmatch(campo) for campo in campos) else None
+
+
+def opcoes_csv(origem, tamanho_amostra=TAMANHO_AMOSTRA):
+    """Argumentos de pd.read_csv (sep, decimal, thousands e engine em C) detectados na amostra."""
+    amostra = ler_amostra(origem, tamanho_amostra)
+    separador = _separador(amostra)
+    decimal, milhar = detectar_decimal(amostra, separador)
+    return {"sep": separador, "decimal": decimal, "thousands": milhar, "engine": "c"}
+
+
+def converter_decimal_virgula(serie):
+    """Converte os textos numéricos com vírgula decimal da coluna; o resto fica igual.
+
+    Se todos os valores não nulos ficarem numéricos, a coluna volta como float.
+    """
+    if serie.dtype != object and not pd.api.types.is_string_dtype(serie):
+        return serie
+    texto = serie.astype(object)
+    com_virgula = texto.str.fullmatch(_NUMERO_VIRGULA).fillna(False).to_numpy(dtype=bool)
+    if com_virgula.any():
+        texto = texto.copy()
+        convertidos = texto[com_virgula].str.strip().str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+        texto[com_virgula] = convertidos.astype(float)
+    numeros = pd.to_numeric(texto, errors="coerce")
+    if (numeros.notna() | texto.isna()).all():
+        return numeros.astype(float)
+    return texto if com_virgula.any() else serie
+
+
+def ler_planilha(origem, nome_arquivo=None, colunas=None, colunas_numericas=(), formato=None):
+    """Lê um Excel (.xlsx, .xls) ou CSV de um caminho, bytes ou arquivo aberto.
+
+    colunas limita a leitura a essas colunas (None lê todas; colunas ausentes são ignoradas
+    e ficam para a verificação de colunas). colunas_numericas passam por
+    converter_decimal_virgula. formato ("excel" ou "csv") força o tipo; sem ele vale a extensão
+    de nome_arquivo (ou do caminho), e arquivos sem extensão conhecida são lidos como CSV.
+    """
+    if isinstance(origem, (bytes, bytearray)):
+        origem = io.BytesIO(origem)
+    nome = str(nome_arquivo or (origem if isinstance(origem, (str, os.PathLike)) else getattr(origem, "name", ""))).lower()
+    formato = formato or ("excel" if nome.endswith((".xlsx", ".xls")) else "csv")
+    usecols = None if colunas is None else set(colunas).__contains__
+    if formato == "excel":
+        df = pd.read_excel(origem, usecols=usecols, engine="xlrd" if nome.endswith(".xls") else None)
+    else:
+        df = pd.read_csv(origem, usecols=usecols, **opcoes_csv(origem))
+    for coluna in colunas_numericas:
+        if coluna in df.columns:
+            df[coluna] = converter_decimal_virgula(df[coluna])
+    return df
+
+
+def resumo_validacao(df, coluna_custo, coluna_peso):
+    """Linhas com custo ou peso nulo, não numérico ou negativo, numa única passada vetorizada.
+
+    Retorna um DataFrame com "Problema", "Linhas" e "Exemplos" (números de linha da planilha,
+    contando o cabeçalho), vazio se todas as linhas forem válidas.
+    """
+    colunas = [calculadora.coluna_ou_zeros(df, coluna) for coluna in (coluna_custo, coluna_peso)]
+    _, erros, validos = calculadora.validar_colunas(colunas)
+    problemas = []
+    for problema in pd.unique(erros[~validos]):
+        posicoes = np.flatnonzero(erros == problema)
+        exemplos = ", ".join(str(linha) for linha in (posicoes[:5] + 2).tolist()) + (", ..." if len(posicoes) > 5 else "")
+        problemas.append({"Problema": problema, "Linhas": len(posicoes), "Exemplos": exemplos})
+    return pd.DataFrame(problemas, columns=["Problema", "Linhas", "Exemplos"])
@@ -2,290 +2,474 @@
 import pandas as pd
 import math
 import argparse
+import io
 import os
+import time
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from armazem_resultados import MAX_LINHAS_PADRAO, ArmazemResultados
+from escritores_saida import FORMATOS_SAIDA, abrir_escritor, escrever_resultado
+from instrumentacao import SEM_INSTRUMENTACAO, Instrumentacao
+from leitura_planilha import converter_decimal_virgula, ler_planilha, opcoes_csv
+from vigia_pasta import ESTABILIDADE_PADRAO_S, INTERVALO_PADRAO_S, erro_pastas, vigiar
+import calculadora_modulo as calculadora
+from regras_marketplace import comissoes_padrao, tabelas_frete_padrao
+
+# Comissões e tabelas de frete usadas pela linha de comando, vindas do registro de regras dos marketplaces
+COMISSOES_PADRAO = comissoes_padrao()
+TABELAS_FRETE_PADRAO = tabelas_frete_padrao()
+
+# Compiladas uma vez na carga do módulo e reaproveitadas em todas as chamadas
+FRETES_PADRAO = calculadora.compilar_tabelas_frete(TABELAS_FRETE_PADRAO)
 
 def calcular_taxa_fixa_ml(preco_venda):
     """Calcula a taxa fixa do Mercado Livre com base no preço de venda."""
-    if preco_venda <= 29.00:
-        return 3.00
-    elif 29.01 <= preco_venda <= 50.00:
-        return 3.50
-    elif 50.01 <= preco_venda <= 79.00:
-        return 4.00
-    else:
-        return 0.00 # Acima de R$ 79, não há taxa fixa, entra o frete
+    return calculadora.calcular_taxa_fixa_ml(preco_venda)
 
 def calcular_frete_ml(preco_venda, peso_g):
-    """Calcula o custo de frete do Mercado Livre com base no preço de venda e peso."""
-    if preco_venda <= 79.00:
-        return 0.00 # Frete só se aplica acima de R$ 79
-
-    if peso_g <= 300:
-        return 19.95
-    elif 300 < peso_g <= 500:
-        return 21.45
-    elif 500 < peso_g <= 1000:
-        return 22.45
-    elif 1000 < peso_g <= 2000:
-        return 23.45
-    elif 2000 < peso_g <= 3000:
-        return 24.95
-    elif 3000 < peso_g <= 4000:
-        return 26.95
-    elif 4000 < peso_g <= 5000:
-        return 28.45
-    else: # Acima de 5kg
-        # A tabela fornecida não especifica acima de 5kg, usando a última faixa como padrão.
-        # Idealmente, confirmar essa regra ou adicionar lógica para kg adicional se existir.
-        print(f"Aviso: Peso {peso_g}g excede a tabela de frete ML fornecida (máx 5kg). Usando taxa de R$ 28,45.")
-        return 28.45
+    """Calcula o custo de frete do Mercado Livre com base no preço de venda e peso (tabela padrão)."""
+    return calculadora.calcular_frete_ml(preco_venda, peso_g, FRETES_PADRAO["tabela_frete_ml_df"])
 
 def calcular_taxa_fixa_amazon(preco_venda):
     """Calcula a taxa fixa da Amazon com base no preço de venda."""
-    if preco_venda <= 30.00:
-        return 4.50
-    elif 30.01 <= preco_venda <= 78.99:
-        return 8.00
-    else:
-        return 0.00 # Acima de R$ 78.99, não há taxa fixa, entra o frete
+    return calculadora.calcular_taxa_fixa_amazon(preco_venda)
 
 def calcular_frete_amazon(preco_venda, peso_g):
-    """Calcula o custo de frete da Amazon com base no preço de venda e peso."""
-    if preco_venda < 79.00:
-        return 0.00 # Frete só se aplica a partir de R$ 79
-
-    if peso_g <= 0:
-         print("Aviso: Peso inválido ou zero detectado. Usando a menor taxa de frete Amazon (R$ 15,94).")
-         return 15.94
-    elif 0 < peso_g <= 249:
-        return 15.94
-    elif 249 < peso_g <= 499:
-        return 16.94
-    elif 499 < peso_g <= 999:
-        return 17.94
-    elif 999 < peso_g <= 1990: # 1.99kg
-        return 18.44
-    elif 1990 < peso_g <= 2990: # 2.99kg
-        return 21.69
-    elif 2990 < peso_g <= 3990: # 3.99kg
-        return 22.94
-    elif 3990 < peso_g <= 4990: # 4.99kg
-        return 28.44
-    elif 4990 < peso_g <= 5990: # 5.99kg
-        return 31.30
-    elif 5990 < peso_g <= 6990: # 6.99kg
-        return 33.13
-    elif 6990 < peso_g <= 7990: # 7.99kg
-        return 33.94
-    elif 7990 < peso_g <= 8990: # 8.99kg
-        return 40.29
-    elif 8990 < peso_g <= 9990: # 9.99kg
-        return 46.65
-    else: # Acima de 9.99kg (9990g)
-        # Arredonda para cima o número de kgs adicionais
-        kg_adicionais = math.ceil((peso_g - 9990) / 1000)
-        frete = 46.65 + (kg_adicionais * 3.50)
-        print(f"Aviso: Peso {peso_g}g excede 9.99kg. Calculando frete Amazon com {kg_adicionais}kg adicionais (R$ {frete:.2f}).")
-        return frete
+    """Calcula o custo de frete da Amazon com base no preço de venda e peso (tabela padrão)."""
+    return calculadora.calcular_frete_amazon(preco_venda, peso_g, FRETES_PADRAO["tabela_frete_amazon_df"])
 
 def calcular_preco_venda(custo_produto, custo_embalagem, margem_desejada_perc, imposto_perc, peso_g):
     """Calcula o preço de venda necessário para atingir a margem desejada em cada marketplace."""
+    return calculadora.calcular_preco_venda(custo_produto, custo_embalagem, margem_desejada_perc, imposto_perc, peso_g,
+                                            COMISSOES_PADRAO, tabelas_frete=FRETES_PADRAO)
 
-    # Validação inicial
-    if custo_produto < 0 or custo_embalagem < 0 or margem_desejada_perc < 0 or imposto_perc < 0 or peso_g < 0:
-        return {"Erro Geral": "Valores de entrada (custo, embalagem, margem, imposto, peso) não podem ser negativos."}
-
-    custo_base = custo_produto + custo_embalagem
-    lucro_alvo = custo_base * (margem_desejada_perc / 100.0)
-    total_custo_lucro = custo_base + lucro_alvo
-    imposto_dec = imposto_perc / 100.0
-
-    resultados = {}
-
-    # --- Shopee --- (20% comissão)
-    comissao_shopee_dec = 0.20
-    denominador_shopee = 1 - imposto_dec - comissao_shopee_dec
-    if denominador_shopee > 1e-6: # Evita divisão por zero ou número muito pequeno
-        preco_venda_shopee = total_custo_lucro / denominador_shopee
-        lucro_real_shopee = preco_venda_shopee * (1 - imposto_dec - comissao_shopee_dec) - custo_base
-        margem_real_shopee = (lucro_real_shopee / custo_base * 100) if custo_base > 1e-6 else 0
-        resultados["Shopee"] = {"preco_venda": round(preco_venda_shopee, 2), "lucro_real_rs": round(lucro_real_shopee, 2), "margem_real_perc": round(margem_real_shopee, 2)}
-    else:
-        resultados["Shopee"] = {"erro": "Imposto + Comissão excedem ou igualam 100%"}
-
-    # --- Shein --- (16% comissão)
-    comissao_shein_dec = 0.16
-    denominador_shein = 1 - imposto_dec - comissao_shein_dec
-    if denominador_shein > 1e-6:
-        preco_venda_shein = total_custo_lucro / denominador_shein
-        lucro_real_shein = preco_venda_shein * (1 - imposto_dec - comissao_shein_dec) - custo_base
-        margem_real_shein = (lucro_real_shein / custo_base * 100) if custo_base > 1e-6 else 0
-        resultados["Shein"] = {"preco_venda": round(preco_venda_shein, 2), "lucro_real_rs": round(lucro_real_shein, 2), "margem_real_perc": round(margem_real_shein, 2)}
-    else:
-        resultados["Shein"] = {"erro": "Imposto + Comissão excedem ou igualam 100%"}
-
-    # --- Mercado Livre --- (17% comissão + Taxa Fixa + Frete)
-    comissao_ml_dec = 0.17
-    denominador_base_ml = 1 - imposto_dec - comissao_ml_dec
-    if denominador_base_ml > 1e-6:
-        preco_venda_ml = 0
-        preco_estimado = total_custo_lucro / denominador_base_ml # Estimativa inicial
-        # Iteração para encontrar o preço que considera taxa fixa e frete
-        for i in range(20): # Aumentado limite de iterações
-            taxa_fixa_ml = calcular_taxa_fixa_ml(preco_estimado)
-            frete_ml = calcular_frete_ml(preco_estimado, peso_g)
-            # Verifica se o denominador é válido antes de calcular novo_preco
-            if denominador_base_ml <= 1e-6:
-                 preco_venda_ml = -1 # Indica erro
-                 break
-            novo_preco = (total_custo_lucro + taxa_fixa_ml + frete_ml) / denominador_base_ml
-            # Condição de parada: diferença pequena ou preço estabilizado
-            if abs(novo_preco - preco_estimado) < 0.001:
-                preco_venda_ml = novo_preco
-                break
-            preco_estimado = novo_preco
-        else: # Se não convergir após as iterações
-             print(f"Aviso ML: Cálculo iterativo não convergiu completamente para custo_base {custo_base}. Usando última estimativa.")
-             preco_venda_ml = preco_estimado # Usa a última estimativa
-
-        if preco_venda_ml >= 0:
-            taxa_fixa_final_ml = calcular_taxa_fixa_ml(preco_venda_ml)
-            frete_final_ml = calcular_frete_ml(preco_venda_ml, peso_g)
-            lucro_real_ml = preco_venda_ml * (1 - imposto_dec - comissao_ml_dec) - taxa_fixa_final_ml - frete_final_ml - custo_base
-            margem_real_ml = (lucro_real_ml / custo_base * 100) if custo_base > 1e-6 else 0
-            resultados["Mercado Livre"] = {"preco_venda": round(preco_venda_ml, 2), "lucro_real_rs": round(lucro_real_ml, 2), "margem_real_perc": round(margem_real_ml, 2)}
-        else:
-            resultados["Mercado Livre"] = {"erro": "Cálculo falhou (denominador inválido durante iteração)"}
-    else:
-        resultados["Mercado Livre"] = {"erro": "Imposto + Comissão excedem ou igualam 100%"}
-
-    # --- Amazon --- (15% comissão + Taxa Fixa + Frete)
-    comissao_amz_dec = 0.15
-    denominador_base_amz = 1 - imposto_dec - comissao_amz_dec
-    if denominador_base_amz > 1e-6:
-        preco_venda_amz = 0
-        preco_estimado = total_custo_lucro / denominador_base_amz
-        # Iteração
-        for i in range(20):
-            taxa_fixa_amz = calcular_taxa_fixa_amazon(preco_estimado)
-            frete_amz = calcular_frete_amazon(preco_estimado, peso_g)
-            if denominador_base_amz <= 1e-6:
-                preco_venda_amz = -1
-                break
-            novo_preco = (total_custo_lucro + taxa_fixa_amz + frete_amz) / denominador_base_amz
-            if abs(novo_preco - preco_estimado) < 0.001:
-                preco_venda_amz = novo_preco
-                break
-            preco_estimado = novo_preco
-        else:
-            print(f"Aviso Amazon: Cálculo iterativo não convergiu completamente para custo_base {custo_base}. Usando última estimativa.")
-            preco_venda_amz = preco_estimado
-
-        if preco_venda_amz >= 0:
-            taxa_fixa_final_amz = calcular_taxa_fixa_amazon(preco_venda_amz)
-            frete_final_amz = calcular_frete_amazon(preco_venda_amz, peso_g)
-            lucro_real_amz = preco_venda_amz * (1 - imposto_dec - comissao_amz_dec) - taxa_fixa_final_amz - frete_final_amz - custo_base
-            margem_real_amz = (lucro_real_amz / custo_base * 100) if custo_base > 1e-6 else 0
-            resultados["Amazon"] = {"preco_venda": round(preco_venda_amz, 2), "lucro_real_rs": round(lucro_real_amz, 2), "margem_real_perc": round(margem_real_amz, 2)}
+def precificar_dataframe(df, margem_desejada_perc, custo_embalagem, imposto_perc, coluna_custo, coluna_peso, instrumentacao=None, telemetria=False, armazem=None, colunas_parametros=None):
+    """Calcula os preços de todas as linhas de uma vez e devolve o DataFrame com as colunas de resultado e a lista de avisos.
+
+    Com telemetria, inclui por marketplace as colunas do solver: passos, faixa de preço e se o preço é consistente.
+    Com armazem, as linhas já calculadas são lidas dele; os acertos e falhas ficam em df.attrs["armazem"].
+    Com colunas_parametros, margem, embalagem, imposto e comissões podem vir de colunas da
+    planilha (ver calculadora.parametros_dataframe); células vazias usam os valores gerais.
+    """
+    instrumentacao = instrumentacao or SEM_INSTRUMENTACAO
+    with instrumentacao.fase("validação"):
+        custos_brutos = df[coluna_custo]
+        pesos_brutos = df[coluna_peso]
+        custos = pd.to_numeric(custos_brutos, errors="coerce")
+        pesos = pd.to_numeric(pesos_brutos, errors="coerce")
+
+        nulos = (custos_brutos.isna() | pesos_brutos.isna()).to_numpy()
+        nao_convertidos = (custos.isna() | pesos.isna()).to_numpy() & ~nulos
+        negativos = ((custos < 0) | (pesos < 0)).to_numpy() & ~nulos & ~nao_convertidos
+        validos = ~(nulos | nao_convertidos | negativos)
+
+    avisos = []
+    erros = np.full(len(df), None, dtype=object)
+    for posicao in np.flatnonzero(~validos):
+        linha = df.index[posicao] + 2
+        if nulos[posicao]:
+            avisos.append(f"Aviso: Linha {linha} ignorada devido a valor não numérico em custo ou peso.")
+            erros[posicao] = "Custo ou Peso inválido/não numérico"
+        elif nao_convertidos[posicao]:
+            avisos.append(f"Aviso: Linha {linha} ignorada. Não foi possível converter custo ('{custos_brutos.iloc[posicao]}') ou peso ('{pesos_brutos.iloc[posicao]}') para número.")
+            erros[posicao] = "Valor não numérico"
         else:
-             resultados["Amazon"] = {"erro": "Cálculo falhou (denominador inválido durante iteração)"}
-    else:
-        resultados["Amazon"] = {"erro": "Imposto + Comissão excedem ou igualam 100%"}
+            avisos.append(f"Aviso: Linha {linha} ignorada devido a valor negativo em custo ({custos.iloc[posicao]}) ou peso ({pesos.iloc[posicao]}).")
+            erros[posicao] = "Custo ou Peso negativo"
 
-    return resultados
+    custo_embalagem, margem_desejada_perc, imposto_perc, comissoes = calculadora.parametros_dataframe(
+        df, custo_embalagem, margem_desejada_perc, imposto_perc, COMISSOES_PADRAO, colunas_parametros
+    )
+    resultados = calculadora.calcular_precos_lote(
+        custos[validos], pesos[validos],
+        *(valor[validos] if isinstance(valor, pd.Series) else valor for valor in (custo_embalagem, margem_desejada_perc, imposto_perc)),
+        {nome: valor[validos] if isinstance(valor, pd.Series) else valor for nome, valor in comissoes.items()},
+        tabelas_frete=FRETES_PADRAO, instrumentacao=instrumentacao, telemetria=True, armazem=armazem
+    )
+    uso_armazem = resultados.attrs.get("armazem")
+    resultados = resultados.reindex(df.index)
+    with instrumentacao.fase("montagem do resultado"):
+        erros[validos] = resultados["Erro Geral"].to_numpy()[validos]
 
-def processar_tabela(arquivo_entrada, arquivo_saida, margem_desejada_perc, custo_embalagem, imposto_perc, coluna_custo, coluna_peso):
-    """Lê a tabela de produtos, calcula os preços e salva os resultados."""
-    try:
-        # Tenta ler como Excel, se falhar, tenta como CSV
+        colunas = {}
+        for marketplace in COMISSOES_PADRAO:
+            preco = resultados[f"{marketplace} Preço Venda"]
+            lucro = resultados[f"{marketplace} Lucro R$"]
+            margem = resultados[f"{marketplace} Margem %"]
+            erro = resultados[f"{marketplace} Erro"]
+            # Um aviso por marketplace (e não um por linha), com até 5 linhas de exemplo
+            inconsistentes = df.index[~resultados[f"{marketplace} Preço Consistente"].fillna(True).to_numpy(dtype=bool)]
+            if len(inconsistentes):
+                exemplos = ", ".join(str(indice + 2) for indice in inconsistentes[:5]) + (", ..." if len(inconsistentes) > 5 else "")
+                faixas = ", ".join(f"{faixa}: {quantidade}" for faixa, quantidade in resultados.loc[inconsistentes, f"{marketplace} Faixa"].value_counts().items())
+                avisos.append(f"Aviso {marketplace}: {len(inconsistentes)} linha(s) sem preço consistente (linhas {exemplos}; faixas {faixas}). Usando o menor preço que atinge a margem.")
+            if erro.notna().any():
+                preco = preco.astype(object).mask(erro.notna(), "Erro")
+                lucro = lucro.astype(object).mask(erro.notna(), erro)
+                margem = margem.astype(object).mask(erro.notna(), "")
+            colunas[f"{marketplace} Preço Venda"] = preco
+            colunas[f"{marketplace} Lucro R$"] = lucro
+            colunas[f"{marketplace} Margem %"] = margem
+            if telemetria:
+                for coluna in ("Passos Solver", "Faixa", "Preço Consistente"):
+                    colunas[f"{marketplace} {coluna}"] = resultados[f"{marketplace} {coluna}"]
+        colunas["Erro Cálculo"] = pd.Series(erros, index=df.index)
+
+        df = df.drop(columns=[c for c in colunas if c in df.columns]).assign(**colunas)
+    if uso_armazem is not None:
+        df.attrs["armazem"] = uso_armazem
+    return df, avisos
+
+def precificar_em_paralelo(df, workers, margem_desejada_perc, custo_embalagem, imposto_perc, coluna_custo, coluna_peso, instrumentacao=None, telemetria=False, armazem=None, colunas_parametros=None, executor=None):
+    """Divide o catálogo em partições e calcula cada uma em um processo separado.
+
+    As partições são reunidas na ordem original, assim linhas e avisos saem iguais aos do modo serial.
+    Em paralelo, a instrumentação mede o cálculo como uma fase só (as fases internas rodam nos outros processos).
+    Com executor (já iniciado, como no modo vigia), os processos são reaproveitados em vez de criados a cada chamada.
+    """
+    instrumentacao = instrumentacao or SEM_INSTRUMENTACAO
+    if workers <= 1 or len(df) < 2:
+        return precificar_dataframe(df, margem_desejada_perc, custo_embalagem, imposto_perc, coluna_custo, coluna_peso, instrumentacao, telemetria, armazem, colunas_parametros)
+    tamanho_particao = math.ceil(len(df) / workers)
+    particoes = [df.iloc[inicio:inicio + tamanho_particao] for inicio in range(0, len(df), tamanho_particao)]
+    with instrumentacao.fase("cálculo (paralelo)"), (ProcessPoolExecutor(max_workers=workers) if executor is None else nullcontext(executor)) as executor:
+        futuros = [executor.submit(precificar_dataframe, particao, margem_desejada_perc, custo_embalagem, imposto_perc, coluna_custo, coluna_peso, None, telemetria, armazem, colunas_parametros) for particao in particoes]
+        resultados = [futuro.result() for futuro in futuros]
+    df = pd.concat([particao for particao, _ in resultados])
+    if armazem is not None:
+        df.attrs["armazem"] = acumular_armazem({}, *(particao for particao, _ in resultados))
+    avisos = [aviso for _, avisos_particao in resultados for aviso in avisos_particao]
+    return df, avisos
+
+def contar_linhas(instrumentacao, df):
+    """Conta linhas processadas e linhas com erro (entrada inválida ou erro em algum marketplace)."""
+    com_erro = df["Erro Cálculo"].notna()
+    for marketplace in COMISSOES_PADRAO:
+        com_erro |= df[f"{marketplace} Preço Venda"].astype(object).eq("Erro")
+    instrumentacao.contar("linhas processadas", len(df))
+    instrumentacao.contar("linhas com erro", com_erro.sum())
+
+def acumular_solver(totais, df):
+    """Soma ao resumo do solver (por marketplace) o histograma de passos e as linhas sem preço consistente de df."""
+    for marketplace in COMISSOES_PADRAO:
+        if f"{marketplace} Passos Solver" not in df.columns:
+            continue
+        resumo = totais.setdefault(marketplace, {"histograma_passos": {}, "nao_convergidos": 0})
+        for passos, quantidade in df[f"{marketplace} Passos Solver"].value_counts().items():
+            resumo["histograma_passos"][int(passos)] = resumo["histograma_passos"].get(int(passos), 0) + int(quantidade)
+        resumo["nao_convergidos"] += int((df[f"{marketplace} Preço Consistente"] == False).sum())  # noqa: E712
+    return totais
+
+def acumular_armazem(totais, *dfs):
+    """Soma os acertos e falhas do armazém de resultados registrados em df.attrs["armazem"]."""
+    for df in dfs:
+        for campo, valor in df.attrs.get("armazem", {}).items():
+            totais[campo] = totais.get(campo, 0) + valor
+    return totais
+
+def imprimir_resumo_armazem(totais, armazem):
+    estatisticas = armazem.estatisticas()
+    print(f"Armazém '{armazem.caminho}': {totais.get('acertos', 0)} linha(s) reaproveitada(s), {totais.get('falhas', 0)} calculada(s); "
+          f"{estatisticas['linhas']} linhas guardadas ({estatisticas['tamanho_mb']:.1f} MB).")
+
+def imprimir_resumo_solver(totais):
+    for marketplace, resumo in totais.items():
+        histograma = ", ".join(f"{passos} passo(s): {quantidade}" for passos, quantidade in sorted(resumo["histograma_passos"].items()))
+        print(f"Solver {marketplace}: {histograma or 'nenhuma linha'}; sem preço consistente: {resumo['nao_convergidos']}")
+
+def verificar_colunas(colunas, coluna_custo, coluna_peso):
+    """Verifica se as colunas de custo e peso existem, informando as disponíveis em caso de erro."""
+    if coluna_custo not in colunas:
+        print(f"Erro: Coluna de custo '{coluna_custo}' não encontrada no arquivo.")
+        print(f"Colunas disponíveis: {list(colunas)}")
+        return False
+    if coluna_peso not in colunas:
+        print(f"Erro: Coluna de peso '{coluna_peso}' não encontrada no arquivo.")
+        print(f"Colunas disponíveis: {list(colunas)}")
+        return False
+    return True
+
+def ler_tabela_entrada(arquivo_entrada, colunas=None, colunas_numericas=()):
+    """Lê a tabela de produtos (Excel ou CSV, pela extensão; sem extensão conhecida tenta Excel e depois CSV).
+
+    colunas limita a leitura a essas colunas e colunas_numericas aceitam vírgula decimal (ver
+    leitura_planilha.ler_planilha). Retorna None se não conseguir ler.
+    """
+    if not arquivo_entrada.lower().endswith(".csv"):
         try:
-            df = pd.read_excel(arquivo_entrada)
+            df = ler_planilha(arquivo_entrada, colunas=colunas, colunas_numericas=colunas_numericas, formato="excel")
             print(f"Arquivo Excel '{arquivo_entrada}' lido com sucesso.")
+            return df
         except Exception as e_excel:
             print(f"Falha ao ler como Excel ({e_excel}), tentando como CSV...")
-            try:
-                # Tenta detectar o separador comum (vírgula ou ponto e vírgula)
-                df = pd.read_csv(arquivo_entrada, sep=None, engine='python')
-                print(f"Arquivo CSV '{arquivo_entrada}' lido com sucesso.")
-            except Exception as e_csv:
-                print(f"Erro: Não foi possível ler o arquivo '{arquivo_entrada}' como Excel ou CSV. Verifique o formato e o caminho. Detalhes: {e_csv}")
-                return False
+    try:
+        df = ler_planilha(arquivo_entrada, colunas=colunas, colunas_numericas=colunas_numericas, formato="csv")
+        print(f"Arquivo CSV '{arquivo_entrada}' lido com sucesso.")
+    except Exception as e_csv:
+        print(f"Erro: Não foi possível ler o arquivo '{arquivo_entrada}' como Excel ou CSV. Verifique o formato e o caminho. Detalhes: {e_csv}")
+        return None
+    return df
 
-        # Verifica se as colunas necessárias existem
-        if coluna_custo not in df.columns:
-            print(f"Erro: Coluna de custo '{coluna_custo}' não encontrada no arquivo.")
-            print(f"Colunas disponíveis: {list(df.columns)}")
+def avisar_colunas_parametros(colunas, colunas_parametros):
+    """Avisa quais colunas de parâmetros por linha não existem no arquivo (nelas vale o valor geral)."""
+    for coluna in calculadora.colunas_dos_parametros(colunas_parametros):
+        if coluna not in colunas:
+            print(f"Aviso: Coluna de parâmetro '{coluna}' não encontrada no arquivo. Usando o valor geral.")
+
+def colunas_leitura(colunas_necessarias, colunas_saida):
+    """Colunas a ler do arquivo: todas (None) ou as necessárias ao cálculo mais as repassadas para a saída."""
+    return None if colunas_saida is None else list(dict.fromkeys([*colunas_necessarias, *colunas_saida]))
+
+def processar_tabela(arquivo_entrada, arquivo_saida, margem_desejada_perc, custo_embalagem, imposto_perc, coluna_custo, coluna_peso, workers=1, formato=None, instrumentacao=None, telemetria=False, armazem=None, colunas_saida=None, colunas_parametros=None, executor=None, avisar_conclusao=True):
+    """Lê a tabela de produtos, calcula os preços e salva os resultados (xlsx, csv ou parquet).
+
+    Com colunas_saida, só essas colunas (além de custo, peso e das colunas de parâmetros) são lidas e repassadas para a saída.
+    Com avisar_conclusao=False o aviso de conclusão fica para quem chamou (ex.: o modo vigia, que
+    grava num nome temporário e só depois renomeia).
+    """
+    instrumentacao = instrumentacao or SEM_INSTRUMENTACAO
+    try:
+        with instrumentacao.fase("leitura"):
+            colunas_numericas = [coluna_custo, coluna_peso, *calculadora.colunas_dos_parametros(colunas_parametros)]
+            df = ler_tabela_entrada(arquivo_entrada, colunas_leitura(colunas_numericas, colunas_saida), colunas_numericas)
+        if df is None:
             return False
-        if coluna_peso not in df.columns:
-            print(f"Erro: Coluna de peso '{coluna_peso}' não encontrada no arquivo.")
-            print(f"Colunas disponíveis: {list(df.columns)}")
+
+        # Verifica se as colunas necessárias existem
+        if not verificar_colunas(df.columns, coluna_custo, coluna_peso):
             return False
+        avisar_colunas_parametros(df.columns, colunas_parametros)
 
-        resultados_lista = []
         print(f"Processando {len(df)} produtos...")
+        df, avisos = precificar_em_paralelo(df, workers, margem_desejada_perc, custo_embalagem, imposto_perc, coluna_custo, coluna_peso, instrumentacao, telemetria, armazem, colunas_parametros, executor)
+        contar_linhas(instrumentacao, df)
+        for aviso in avisos:
+            print(aviso)
+        if telemetria:
+            imprimir_resumo_solver(acumular_solver({}, df))
+        if armazem is not None:
+            imprimir_resumo_armazem(acumular_armazem({}, df), armazem)
 
-        for index, row in df.iterrows():
-            try:
-                custo_produto = float(row[coluna_custo])
-                peso_g = float(row[coluna_peso])
-
-                # Verifica se os valores são numéricos e válidos
-                if pd.isna(custo_produto) or pd.isna(peso_g):
-                    print(f"Aviso: Linha {index+2} ignorada devido a valor não numérico em custo ou peso.")
-                    resultados_produto = {"Erro Geral": "Custo ou Peso inválido/não numérico"}
-                elif custo_produto < 0 or peso_g < 0:
-                     print(f"Aviso: Linha {index+2} ignorada devido a valor negativo em custo ({custo_produto}) ou peso ({peso_g}).")
-                     resultados_produto = {"Erro Geral": "Custo ou Peso negativo"}
-                else:
-                    resultados_produto = calcular_preco_venda(custo_produto, custo_embalagem, margem_desejada_perc, imposto_perc, peso_g)
-
-            except ValueError:
-                 print(f"Aviso: Linha {index+2} ignorada. Não foi possível converter custo ('{row[coluna_custo]}') ou peso ('{row[coluna_peso]}') para número.")
-                 resultados_produto = {"Erro Geral": "Valor não numérico"}
-            except Exception as e:
-                 print(f"Erro inesperado ao processar linha {index+2}: {e}")
-                 resultados_produto = {"Erro Geral": f"Erro inesperado: {e}"}
-
-            # Adiciona os resultados ao DataFrame original
-            for marketplace, data in resultados_produto.items():
-                if marketplace == "Erro Geral":
-                    df.loc[index, 'Erro Cálculo'] = data
-                    break # Sai do loop de marketplaces para este produto
-                if "erro" in data:
-                    df.loc[index, f'{marketplace} Preço Venda'] = 'Erro'
-                    df.loc[index, f'{marketplace} Lucro R$'] = data['erro']
-                    df.loc[index, f'{marketplace} Margem %'] = ''
-                else:
-                    df.loc[index, f'{marketplace} Preço Venda'] = data['preco_venda']
-                    df.loc[index, f'{marketplace} Lucro R$'] = data['lucro_real_rs']
-                    df.loc[index, f'{marketplace} Margem %'] = data['margem_real_perc']
+        # Salva o DataFrame com os resultados no formato escolhido (padrão pela extensão do arquivo)
+        with instrumentacao.fase("escrita"):
+            tempo_escrita = escrever_resultado(df, arquivo_saida, formato)
+        if avisar_conclusao:
+            print(f"Processamento concluído. Resultados salvos em '{arquivo_saida}' (escrita: {tempo_escrita:.2f}s)")
+        return True
+
+    except FileNotFoundError:
+        print(f"Erro: Arquivo de entrada '{arquivo_entrada}' não encontrado.")
+        return False
+    except ImportError as e:
+        print(f"Erro: Biblioteca necessária não está instalada ({e}). Use 'pip install openpyxl' para Excel ou 'pip install pyarrow' para Parquet.")
+        return False
+    except Exception as e:
+        print(f"Erro inesperado durante o processamento: {e}")
+        return False
+
+def processar_tabela_streaming(arquivo_entrada, arquivo_saida, margem_desejada_perc, custo_embalagem, imposto_perc, coluna_custo, coluna_peso, tamanho_bloco=50000, workers=1, formato=None, instrumentacao=None, telemetria=False, armazem=None, colunas_saida=None, colunas_parametros=None):
+    """Lê o CSV em blocos de tamanho fixo, calcula os preços de cada bloco e acrescenta ao arquivo de saída.
+
+    O uso de memória depende do tamanho do bloco, não do tamanho do catálogo. O resultado é o
+    mesmo do modo em memória (processar_tabela). Com workers > 1 os blocos são calculados em
+    paralelo (no máximo 2 * workers blocos em andamento) e gravados na ordem de leitura.
+    """
+    if arquivo_entrada.lower().endswith((".xls", ".xlsx")):
+        print("Aviso: O modo streaming só lê arquivos CSV. Processando o arquivo Excel em memória.")
+        return processar_tabela(arquivo_entrada, arquivo_saida, margem_desejada_perc, custo_embalagem, imposto_perc, coluna_custo, coluna_peso, workers, formato, instrumentacao, telemetria, armazem, colunas_saida, colunas_parametros)
+    instrumentacao = instrumentacao or SEM_INSTRUMENTACAO
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        opcoes = opcoes_csv(arquivo_entrada)
+        colunas_numericas = [coluna_custo, coluna_peso, *calculadora.colunas_dos_parametros(colunas_parametros)]
+        colunas = colunas_leitura(colunas_numericas, colunas_saida)
+        total_linhas = 0
+        tempo_escrita = 0.0
+        totais_solver = {}
+        totais_armazem = {}
+        pendentes = deque()
+        usecols = None if colunas is None else set(colunas).__contains__
+        with instrumentacao.fase("leitura"):
+            cabecalho = pd.read_csv(arquivo_entrada, nrows=0, usecols=usecols, **opcoes)
+            blocos = pd.read_csv(arquivo_entrada, chunksize=tamanho_bloco, usecols=usecols, **opcoes)
+            # Arquivo só com o cabeçalho: calcula o bloco vazio para gravar as colunas da saída
+            bloco = next(blocos, cabecalho)
+        # Colunas conferidas pelo cabeçalho antes de abrir a saída, para não deixar um arquivo vazio
+        if not verificar_colunas(cabecalho.columns, coluna_custo, coluna_peso):
+            return False
+        avisar_colunas_parametros(cabecalho.columns, colunas_parametros)
+        with abrir_escritor(arquivo_saida, formato) as escritor:
+            def gravar(resultado):
+                nonlocal total_linhas, tempo_escrita
+                bloco, avisos = resultado
+                contar_linhas(instrumentacao, bloco)
+                acumular_solver(totais_solver, bloco)
+                acumular_armazem(totais_armazem, bloco)
+                for aviso in avisos:
+                    print(aviso)
+                inicio = time.perf_counter()
+                with instrumentacao.fase("escrita"):
+                    escritor.escrever(bloco)
+                tempo_escrita += time.perf_counter() - inicio
+                total_linhas += len(bloco)
+                print(f"{total_linhas} produtos processados...")
 
-        # Salva o DataFrame com os resultados em um novo arquivo Excel
-        df.to_excel(arquivo_saida, index=False, engine='openpyxl')
-        print(f"Processamento concluído. Resultados salvos em '{arquivo_saida}'")
+            while bloco is not None:
+                for coluna in colunas_numericas:
+                    if coluna in bloco.columns:
+                        bloco[coluna] = converter_decimal_virgula(bloco[coluna])
+                argumentos = (bloco, margem_desejada_perc, custo_embalagem, imposto_perc, coluna_custo, coluna_peso)
+                if executor is None:
+                    gravar(precificar_dataframe(*argumentos, instrumentacao, telemetria, armazem, colunas_parametros))
+                else:
+                    pendentes.append(executor.submit(precificar_dataframe, *argumentos, None, telemetria, armazem, colunas_parametros))
+                    if len(pendentes) >= 2 * workers:
+                        gravar(pendentes.popleft().result())
+                with instrumentacao.fase("leitura"):
+                    bloco = next(blocos, None)
+            while pendentes:
+                gravar(pendentes.popleft().result())
+            # O .xlsx e o Parquet só terminam de ser gravados ao fechar o escritor
+            with instrumentacao.fase("escrita"):
+                inicio = time.perf_counter()
+                escritor.fechar()
+                tempo_escrita += time.perf_counter() - inicio
+        imprimir_resumo_solver(totais_solver)
+        if armazem is not None:
+            imprimir_resumo_armazem(totais_armazem, armazem)
+        print(f"Processamento concluído. Resultados salvos em '{arquivo_saida}' (escrita: {tempo_escrita:.2f}s)")
         return True
 
     except FileNotFoundError:
         print(f"Erro: Arquivo de entrada '{arquivo_entrada}' não encontrado.")
         return False
-    except ImportError:
-        print("Erro: Biblioteca 'openpyxl' necessária para ler/escrever arquivos Excel não está instalada. Use 'pip install openpyxl'.")
+    except ImportError as e:
+        print(f"Erro: Biblioteca necessária não está instalada ({e}). Use 'pip install openpyxl' para Excel ou 'pip install pyarrow' para Parquet.")
         return False
     except Exception as e:
         print(f"Erro inesperado durante o processamento: {e}")
         return False
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+def processar_pasta(pasta_entrada, pasta_saida, margem_desejada_perc, custo_embalagem, imposto_perc, coluna_custo, coluna_peso, workers=1, formato=None, telemetria=False, armazem=None, colunas_saida=None, colunas_parametros=None, intervalo=INTERVALO_PADRAO_S, estabilidade=ESTABILIDADE_PADRAO_S):
+    """Modo vigia: calcula cada planilha que chega em pasta_entrada e grava o resultado em pasta_saida (ver vigia_pasta).
+
+    Importações, tabelas de frete e processos de cálculo ficam carregados entre um arquivo e outro.
+    """
+    formato = formato or "xlsx"
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        # Um cálculo e uma escrita de exemplo carregam o que o primeiro arquivo usaria (openpyxl, pyarrow)
+        exemplo = pd.DataFrame({coluna_custo: [1.0], coluna_peso: [100.0]})
+        try:
+            escrever_resultado(precificar_dataframe(exemplo, margem_desejada_perc, custo_embalagem, imposto_perc, coluna_custo, coluna_peso)[0], io.BytesIO(), formato)
+        except ImportError as e:
+            print(f"Aviso: Biblioteca para gravar {formato} não está instalada ({e}).")
+        if executor is not None:
+            for futuro in [executor.submit(precificar_dataframe, exemplo, margem_desejada_perc, custo_embalagem, imposto_perc, coluna_custo, coluna_peso) for _ in range(workers)]:
+                futuro.result()
+
+        def processar(arquivo_entrada, arquivo_saida, instrumentacao):
+            return processar_tabela(arquivo_entrada, arquivo_saida, margem_desejada_perc, custo_embalagem, imposto_perc, coluna_custo, coluna_peso,
+                                    workers, formato, instrumentacao, telemetria, armazem, colunas_saida, colunas_parametros, executor,
+                                    avisar_conclusao=False)
+
+        vigiar(pasta_entrada, pasta_saida, processar, formato, intervalo, estabilidade)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+def processar_auditoria(arquivo_entrada, arquivo_saida, coluna_preco, custo_embalagem, imposto_perc, coluna_custo, coluna_peso, margem_minima_perc=None, formato=None, instrumentacao=None, colunas_saida=None):
+    """Lê a tabela com os preços atuais dos anúncios, calcula lucro e margem realizados em cada marketplace e salva os resultados."""
+    instrumentacao = instrumentacao or SEM_INSTRUMENTACAO
+    try:
+        with instrumentacao.fase("leitura"):
+            df = ler_tabela_entrada(arquivo_entrada, colunas_leitura([coluna_preco, coluna_custo, coluna_peso], colunas_saida), (coluna_preco, coluna_custo, coluna_peso))
+        if df is None:
+            return False
+        if coluna_preco not in df.columns:
+            print(f"Erro: Coluna de preço '{coluna_preco}' não encontrada no arquivo.")
+            print(f"Colunas disponíveis: {list(df.columns)}")
+            return False
+        if not verificar_colunas(df.columns, coluna_custo, coluna_peso):
+            return False
+
+        print(f"Auditando {len(df)} produtos...")
+        with instrumentacao.fase("auditoria"):
+            auditoria = calculadora.auditar_margens_dataframe(df, coluna_preco, coluna_custo, coluna_peso, custo_embalagem, imposto_perc, COMISSOES_PADRAO, margem_minima_perc, tabelas_frete=FRETES_PADRAO)
+        erros = int(auditoria["Erro Geral"].notna().sum())
+        instrumentacao.contar("linhas processadas", len(auditoria))
+        instrumentacao.contar("linhas com erro", erros)
+        if margem_minima_perc is not None:
+            for marketplace in COMISSOES_PADRAO:
+                abaixo = int(auditoria[f"{marketplace} Abaixo da Margem"].sum())
+                if abaixo:
+                    print(f"Aviso: {abaixo} produto(s) abaixo da margem mínima de {margem_minima_perc:g}% em {marketplace}.")
+        if erros:
+            print(f"Aviso: {erros} produto(s) com preço, custo ou peso inválido não foram auditados.")
+
+        with instrumentacao.fase("escrita"):
+            tempo_escrita = escrever_resultado(pd.concat([df, auditoria], axis=1), arquivo_saida, formato)
+        print(f"Auditoria concluída. Resultados salvos em '{arquivo_saida}' (escrita: {tempo_escrita:.2f}s)")
+        return True
+
+    except ImportError as e:
+        print(f"Erro: Biblioteca necessária não está instalada ({e}). Use 'pip install openpyxl' para Excel ou 'pip install pyarrow' para Parquet.")
+        return False
+    except Exception as e:
+        print(f"Erro inesperado durante a auditoria: {e}")
+        return False
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Calculadora de Preços para Marketplaces')
-    parser.add_argument('arquivo_entrada', help='Caminho para o arquivo Excel ou CSV de produtos.')
-    parser.add_argument('arquivo_saida', help='Caminho para salvar o arquivo Excel com os resultados.')
-    parser.add_argument('--margem', type=float, required=True, help='Margem de lucro desejada (em porcentagem, ex: 30).')
+    parser.add_argument('arquivo_entrada', help='Caminho para o arquivo Excel ou CSV de produtos (com --vigiar, a pasta de entrada).')
+    parser.add_argument('arquivo_saida', help='Caminho para salvar o arquivo com os resultados (com --vigiar, a pasta de saída).')
+    parser.add_argument('--margem', type=float, help='Margem de lucro desejada (em porcentagem, ex: 30). Obrigatória, exceto com --auditar.')
     parser.add_argument('--embalagem', type=float, required=True, help='Custo da embalagem por produto (em R$, ex: 1.50).')
     parser.add_argument('--imposto', type=float, required=True, help='Alíquota de imposto sobre a venda (em porcentagem, ex: 5).')
     parser.add_argument('--coluna_custo', default='Custo', help='Nome da coluna com o preço de custo (padrão: Custo).')
     parser.add_argument('--coluna_peso', default='Peso (g)', help='Nome da coluna com o peso em gramas (padrão: Peso (g)).')
+    parser.add_argument('--coluna_margem', help='Coluna com a margem desejada de cada produto; células vazias usam --margem.')
+    parser.add_argument('--coluna_embalagem', help='Coluna com o custo da embalagem de cada produto; células vazias usam --embalagem.')
+    parser.add_argument('--coluna_imposto', help='Coluna com o imposto de cada produto; células vazias usam --imposto.')
+    parser.add_argument('--coluna_comissao', action='append', default=[], metavar='MARKETPLACE=COLUNA', help='Coluna com a comissão do marketplace em cada produto (pode ser repetido); células vazias usam a comissão padrão.')
+    parser.add_argument('--colunas_saida', nargs='+', metavar='COLUNA', help='Lê e repassa para a saída só essas colunas, além das de custo e peso (padrão: todas as colunas do arquivo).')
+    parser.add_argument('--streaming', action='store_true', help='Lê o CSV em blocos e grava cada bloco na saída, com uso de memória constante.')
+    parser.add_argument('--tamanho_bloco', type=int, default=50000, help='Linhas por bloco no modo streaming (padrão: 50000).')
+    parser.add_argument('--formato', choices=FORMATOS_SAIDA, help='Formato do arquivo de saída (padrão: pela extensão do arquivo, ou xlsx).')
+    parser.add_argument('--workers', type=int, default=1, help='Número de processos para calcular o catálogo em paralelo (padrão: 1).')
+    parser.add_argument('--profile', action='store_true', help='Mostra o tempo e o pico de memória de cada fase (leitura, validação, cálculo por marketplace, escrita) e a contagem de linhas.')
+    parser.add_argument('--telemetria_solver', action='store_true', help='Inclui na saída, por marketplace, os passos do solver, a faixa de preço e se o preço é consistente, e mostra um resumo do solver.')
+    parser.add_argument('--cprofile', metavar='ARQUIVO', help='Grava um perfil cProfile da execução nesse arquivo (implica --profile).')
+    parser.add_argument('--armazem', metavar='ARQUIVO', help='Armazém SQLite de resultados: linhas já calculadas com os mesmos parâmetros são lidas dele e só as novas ou alteradas são calculadas.')
+    parser.add_argument('--armazem_max_linhas', type=int, default=MAX_LINHAS_PADRAO, help=f'Máximo de linhas guardadas no armazém; acima disso as usadas há mais tempo são descartadas (padrão: {MAX_LINHAS_PADRAO}).')
+    parser.add_argument('--vigiar', action='store_true', help='Modo vigia: arquivo_entrada e arquivo_saida são pastas; o processo fica aberto e calcula cada planilha que chega na pasta de entrada, gravando o resultado na pasta de saída.')
+    parser.add_argument('--intervalo', type=float, default=INTERVALO_PADRAO_S, help=f'Com --vigiar, segundos entre as varreduras da pasta de entrada (padrão: {INTERVALO_PADRAO_S:g}).')
+    parser.add_argument('--estabilidade', type=float, default=ESTABILIDADE_PADRAO_S, help=f'Com --vigiar, segundos sem mudar de tamanho e data de modificação para um arquivo ser considerado completo (padrão: {ESTABILIDADE_PADRAO_S:g}).')
+    parser.add_argument('--auditar', metavar='COLUNA_PRECO', help='Em vez de calcular preços, audita os preços atuais dessa coluna: lucro e margem realizados em cada marketplace.')
+    parser.add_argument('--margem_minima', type=float, help='Com --auditar, marca os produtos com margem realizada abaixo desse valor (em porcentagem).')
 
     args = parser.parse_args()
+    if args.margem is None and not args.auditar:
+        parser.error("o argumento --margem é obrigatório (exceto com --auditar)")
+    if args.vigiar and (args.auditar or args.streaming):
+        parser.error("--vigiar não pode ser usado com --auditar ou --streaming")
+    if args.vigiar and erro_pastas(args.arquivo_entrada, args.arquivo_saida):
+        parser.error(erro_pastas(args.arquivo_entrada, args.arquivo_saida))
+    colunas_comissao = {}
+    for opcao in args.coluna_comissao:
+        marketplace, separador, coluna = opcao.partition("=")
+        if not separador or marketplace not in COMISSOES_PADRAO or not coluna:
+            parser.error(f"--coluna_comissao deve ser MARKETPLACE=COLUNA, com MARKETPLACE entre {list(COMISSOES_PADRAO)}: '{opcao}'")
+        colunas_comissao[marketplace] = coluna
+    colunas_parametros = {"custo_embalagem": args.coluna_embalagem, "margem_desejada_perc": args.coluna_margem,
+                          "imposto_perc": args.coluna_imposto, "comissoes_perc": colunas_comissao}
 
     # Verifica se o diretório de saída existe, se não, cria
     output_dir = os.path.dirname(args.arquivo_saida)
@@ -293,5 +477,21 @@ if __name__ == "__main__":
         os.makedirs(output_dir)
         print(f"Diretório de saída '{output_dir}' criado.")
 
-    processar_tabela(args.arquivo_entrada, args.arquivo_saida, args.margem, args.embalagem, args.imposto, args.coluna_custo, args.coluna_peso)
+    instrumentacao = Instrumentacao(ativa=args.profile or bool(args.cprofile), medir_memoria=True, arquivo_cprofile=args.cprofile)
+    armazem = ArmazemResultados(args.armazem, args.armazem_max_linhas) if args.armazem else None
+    with instrumentacao:
+        if args.auditar:
+            processar_auditoria(args.arquivo_entrada, args.arquivo_saida, args.auditar, args.embalagem, args.imposto, args.coluna_custo, args.coluna_peso, args.margem_minima, args.formato, instrumentacao, args.colunas_saida)
+        elif args.vigiar:
+            try:
+                processar_pasta(args.arquivo_entrada, args.arquivo_saida, args.margem, args.embalagem, args.imposto, args.coluna_custo, args.coluna_peso, args.workers, args.formato,
+                                args.telemetria_solver, armazem, args.colunas_saida, colunas_parametros, args.intervalo, args.estabilidade)
+            except KeyboardInterrupt:
+                print("Vigia encerrado.")
+        elif args.streaming:
+            processar_tabela_streaming(args.arquivo_entrada, args.arquivo_saida, args.margem, args.embalagem, args.imposto, args.coluna_custo, args.coluna_peso, args.tamanho_bloco, args.workers, args.formato, instrumentacao, args.telemetria_solver, armazem, args.colunas_saida, colunas_parametros)
+        else:
+            processar_tabela(args.arquivo_entrada, args.arquivo_saida, args.margem, args.embalagem, args.imposto, args.coluna_custo, args.coluna_peso, args.workers, args.formato, instrumentacao, args.telemetria_solver, armazem, args.colunas_saida, colunas_parametros)
+    if instrumentacao.ativa:
+        print("\n".join(instrumentacao.linhas_resumo()))
 
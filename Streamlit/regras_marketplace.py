@@ -0,0 +1,141 @@
+# regras_marketplace.py
+# Registro das regras de cada marketplace, declaradas como dados: comissão padrão, faixas de
+# taxa fixa por preço e regra de frete (a partir de qual preço é cobrado e tabela padrão).
+# Cada regra é compilada uma vez em arrays de limites, usados tanto no cálculo escalar quanto
+# no cálculo em lote. Para incluir um marketplace basta uma entrada nova, por exemplo:
+#
+#     registrar_marketplace("Magalu", {
+#         "comissao_padrao": 16.0,
+#         "taxas_fixas": [(79.00, 5.00)],
+#         "frete": {"tabela": "tabela_frete_magalu_df", "preco_minimo": 79.00, "inclui_minimo": True,
+#                   "tabela_padrao": [(500, 18.00), (1000, 20.00)]},
+#     })
+import bisect
+
+import numpy as np
+import pandas as pd
+
+# Preço em que mudam a taxa fixa e a cobrança de frete na maioria das regras; referência dos
+# resumos ("acima de R$ 79") da grade de cenários e da visualização do resultado
+PRECO_REFERENCIA = 79.00
+
+# taxas_fixas: lista de (preço até, taxa). A taxa vale para preços <= limite; acima do último
+# limite não há taxa fixa.
+# frete: cobrado quando o preço passa de preco_minimo (ou é igual, se inclui_minimo). "tabela" é
+# o nome do argumento com a tabela de frete em calcular_preco_venda/calcular_precos_lote;
+# com kg_adicional, a linha PesoMaximoG == -1 da tabela é o custo por kg acima do último limite.
+REGRAS_MARKETPLACE = {
+    "Shopee": {"comissao_padrao": 20.0},
+    "Shein": {"comissao_padrao": 16.0},
+    "Mercado Livre": {
+        "comissao_padrao": 17.0,
+        "taxas_fixas": [(29.00, 3.00), (50.00, 3.50), (79.00, 4.00)],
+        "frete": {
+            "tabela": "tabela_frete_ml_df",
+            "preco_minimo": 79.00,
+            "inclui_minimo": False,
+            "tabela_padrao": [(300, 19.95), (500, 21.45), (1000, 22.45), (2000, 23.45),
+                              (3000, 24.95), (4000, 26.95), (5000, 28.45)],
+        },
+    },
+    "Amazon": {
+        "comissao_padrao": 15.0,
+        "taxas_fixas": [(30.00, 4.50), (78.99, 8.00)],
+        "frete": {
+            "tabela": "tabela_frete_amazon_df",
+            "preco_minimo": 79.00,
+            "inclui_minimo": True,
+            "kg_adicional": True,
+            "tabela_padrao": [(249, 15.94), (499, 16.94), (999, 17.94), (1990, 18.44),
+                              (2990, 21.69), (3990, 22.94), (4990, 28.44), (5990, 31.30),
+                              (6990, 33.13), (7990, 33.94), (8990, 40.29), (9990, 46.65),
+                              (-1, 3.50)],
+        },
+    },
+}
+
+
+class RegraMarketplace:
+    """Regra de um marketplace compilada em arrays de limites de preço."""
+
+    def __init__(self, nome, regra):
+        self.nome = nome
+        self.comissao_padrao = float(regra.get("comissao_padrao", 0.0))
+        faixas = sorted(regra.get("taxas_fixas", []))
+        self.limites_taxa = np.array([limite for limite, _ in faixas], dtype=float)
+        # Uma taxa por faixa e 0 acima do último limite
+        self.valores_taxa = np.array([taxa for _, taxa in faixas] + [0.00], dtype=float)
+        self._limites_taxa_lista = self.limites_taxa.tolist()
+        self._valores_taxa_lista = self.valores_taxa.tolist()
+
+        frete = regra.get("frete")
+        self.tabela_frete = frete["tabela"] if frete else None
+        self.frete_preco_minimo = float(frete["preco_minimo"]) if frete else None
+        self.frete_inclui_minimo = bool(frete.get("inclui_minimo", False)) if frete else False
+        self.kg_adicional = bool(frete.get("kg_adicional", False)) if frete else False
+        self.tabela_frete_padrao = frete.get("tabela_padrao", []) if frete else []
+
+        pontos = set(self._limites_taxa_lista)
+        if frete:
+            pontos.add(self.frete_preco_minimo)
+        self.pontos_quebra = tuple(sorted(pontos))
+
+    @property
+    def tem_taxas(self):
+        return bool(self._limites_taxa_lista) or self.tabela_frete is not None
+
+    def taxa_fixa(self, precos):
+        """Taxa fixa para um preço (float) ou um array de preços (ndarray)."""
+        if np.ndim(precos) == 0:
+            return self._valores_taxa_lista[bisect.bisect_left(self._limites_taxa_lista, precos)]
+        return self.valores_taxa[np.searchsorted(self.limites_taxa, precos, side="left")]
+
+    def frete_cobrado(self, precos):
+        """Indica se o frete é cobrado no preço (float) ou em cada preço do array."""
+        if self.tabela_frete is None:
+            return False if np.ndim(precos) == 0 else np.zeros(np.shape(precos), dtype=bool)
+        if self.frete_inclui_minimo:
+            return precos >= self.frete_preco_minimo
+        return precos > self.frete_preco_minimo
+
+    def impressao(self):
+        """Valores de que o preço depende (faixas de taxa e regra de frete), para a impressão digital do cálculo."""
+        return [self.limites_taxa, self.valores_taxa, self.tabela_frete,
+                self.frete_preco_minimo, self.frete_inclui_minimo, self.kg_adicional]
+
+    def tabela_frete_padrao_df(self):
+        return pd.DataFrame(self.tabela_frete_padrao, columns=["PesoMaximoG", "CustoFrete"])
+
+
+_REGRAS_COMPILADAS = {nome: RegraMarketplace(nome, regra) for nome, regra in REGRAS_MARKETPLACE.items()}
+
+
+def registrar_marketplace(nome, regra):
+    """Inclui (ou substitui) um marketplace no registro e compila sua regra."""
+    REGRAS_MARKETPLACE[nome] = regra
+    _REGRAS_COMPILADAS[nome] = RegraMarketplace(nome, regra)
+    return _REGRAS_COMPILADAS[nome]
+
+
+def obter_regra(nome):
+    """Regra compilada do marketplace, ou None se ele não estiver registrado (só comissão)."""
+    return _REGRAS_COMPILADAS.get(nome)
+
+
+def marketplaces_registrados():
+    return list(_REGRAS_COMPILADAS)
+
+
+def comissoes_padrao():
+    return {nome: regra.comissao_padrao for nome, regra in _REGRAS_COMPILADAS.items()}
+
+
+def tabelas_frete_padrao():
+    """Tabelas de frete padrão de todos os marketplaces, pelo nome do argumento da tabela."""
+    return {regra.tabela_frete: regra.tabela_frete_padrao_df()
+            for regra in _REGRAS_COMPILADAS.values() if regra.tabela_frete is not None}
+
+
+def tabela_frete_do_marketplace():
+    """Nome da tabela de frete de que cada marketplace depende (só os que cobram frete)."""
+    return {nome: regra.tabela_frete for nome, regra in _REGRAS_COMPILADAS.items() if regra.tabela_frete is not None}
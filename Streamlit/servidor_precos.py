@@ -0,0 +1,287 @@
+# servidor_precos.py
+# Servidor HTTP/JSON local de preços: fica em execução com as tabelas de frete compiladas e os
+# processos de cálculo já iniciados, assim cada consulta não paga a partida do Python e do pandas.
+# A recepção é assíncrona (asyncio); o cálculo roda num pool de processos. Consultas de um SKU
+# que chegam quase ao mesmo tempo com os mesmos parâmetros são agrupadas num único cálculo em
+# lote. Exemplo:
+#
+#     python servidor_precos.py --porta 8502 --margem 30 --embalagem 1.5 --imposto 7
+#     curl -X POST localhost:8502/preco -d '{"custo": 25.9, "peso": 350}'
+#     curl -X POST localhost:8502/precos -d '{"itens": [{"sku": "A1", "custo": 25.9, "peso": 350}], "margem": 35}'
+import argparse
+import asyncio
+import json
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+
+import pandas as pd
+
+import calculadora_modulo as calculadora
+from regras_marketplace import comissoes_padrao, tabelas_frete_padrao
+
+COMISSOES_PADRAO = comissoes_padrao()
+FRETES_PADRAO = calculadora.compilar_tabelas_frete(tabelas_frete_padrao())
+MAX_ITENS_LOTE = 200_000
+MAX_CORPO_BYTES = 64 * 1024 ** 2
+# Tempo que o primeiro pedido de um SKU espera por outros antes do cálculo em lote
+JANELA_AGRUPAMENTO_S = 0.002
+MAX_AGRUPAMENTO = 5000
+
+
+def precificar_itens(custos, pesos, margem_desejada_perc, custo_embalagem, imposto_perc, skus=None, por_item=False):
+    """Calcula os preços de uma lista de itens (executado no pool de processos) e devolve o JSON pronto.
+
+    Cada item traz as colunas da saída da calculadora ("<Marketplace> Preço Venda", "<Marketplace>
+    Lucro R$", ..., "Erro Geral"), precedidas de "SKU" se skus for informado. Retorna o JSON da
+    lista de itens ou, com por_item=True, uma lista com o JSON de cada item (com "SKU" só nos
+    itens que têm sku). Serializar aqui, com o to_json do pandas, evita montar e transferir um
+    dicionário por item entre processos.
+    """
+    resultado = calculadora.calcular_precos_lote(
+        pd.Series(custos, dtype=object), pd.Series(pesos, dtype=object), custo_embalagem,
+        margem_desejada_perc, imposto_perc, COMISSOES_PADRAO, tabelas_frete=FRETES_PADRAO,
+    )
+    if por_item:
+        linhas = resultado.to_json(orient="records", lines=True, force_ascii=False).rstrip("\n").split("\n")
+        if skus is None or all(sku is None for sku in skus):
+            return linhas
+        # Só os itens pedidos com sku trazem "SKU" na resposta
+        resultado.insert(0, "SKU", pd.Series(skus, dtype=object))
+        com_sku = resultado.to_json(orient="records", lines=True, force_ascii=False).rstrip("\n").split("\n")
+        return [linha_sku if sku is not None else linha for sku, linha, linha_sku in zip(skus, linhas, com_sku)]
+    if skus is not None:
+        resultado.insert(0, "SKU", pd.Series(skus, dtype=object))
+    return resultado.to_json(orient="records", force_ascii=False)
+
+
+def _numero_finito(texto):
+    """parse_float do json.loads: recusa números que viram infinito (ex.: 1e999)."""
+    valor = float(texto)
+    if not math.isfinite(valor):
+        raise ValueError(f"número fora do intervalo ({texto})")
+    return valor
+
+
+def _recusar_constante(nome):
+    """parse_constant do json.loads: NaN, Infinity e -Infinity não são aceitos."""
+    raise ValueError(f"valor não finito ({nome}) não é aceito")
+
+
+class ErroPedido(Exception):
+    """Pedido inválido (responde 400 com a mensagem)."""
+
+
+class AgrupadorPrecos:
+    """Junta pedidos de um SKU com os mesmos parâmetros num único cálculo em lote.
+
+    Com processos livres, o primeiro pedido de um grupo espera `janela` segundos por outros.
+    Com todos ocupados, os pedidos se acumulam e cada grupo é calculado de uma vez assim que um
+    processo termina, então o tamanho dos lotes acompanha a carga. Um grupo com `maximo` itens é
+    enviado na hora.
+    """
+
+    def __init__(self, executor, capacidade, janela=JANELA_AGRUPAMENTO_S, maximo=MAX_AGRUPAMENTO):
+        self.executor = executor
+        self.capacidade = capacidade
+        self.janela = janela
+        self.maximo = maximo
+        self.lotes = 0
+        self.itens = 0
+        self._pendentes = {}
+        self._em_andamento = 0
+        self._temporizador = None
+
+    async def precificar(self, custo, peso, sku, parametros):
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+        fila = self._pendentes.setdefault(parametros, [])
+        fila.append((custo, peso, sku, futuro))
+        if len(fila) >= self.maximo:
+            self._enviar(parametros)
+        elif self._em_andamento < self.capacidade and self._temporizador is None:
+            self._temporizador = loop.call_later(self.janela, self._enviar_pendentes)
+        return await futuro
+
+    def _enviar_pendentes(self):
+        self._temporizador = None
+        while self._pendentes and self._em_andamento < self.capacidade:
+            self._enviar(next(iter(self._pendentes)))
+
+    def _enviar(self, parametros):
+        fila = self._pendentes.pop(parametros)
+        self._em_andamento += 1
+        self.lotes += 1
+        self.itens += len(fila)
+        asyncio.ensure_future(self._calcular(fila, parametros))
+
+    async def _calcular(self, fila, parametros):
+        custos, pesos, skus, futuros = zip(*fila)
+        try:
+            respostas = await asyncio.get_running_loop().run_in_executor(
+                self.executor, precificar_itens, list(custos), list(pesos), *parametros, list(skus), True
+            )
+        except Exception as erro:
+            for futuro in futuros:
+                if not futuro.done():
+                    futuro.set_exception(erro)
+        else:
+            for futuro, resposta in zip(futuros, respostas):
+                if not futuro.done():
+                    futuro.set_result(resposta)
+        finally:
+            self._em_andamento -= 1
+            if self._temporizador is None:
+                self._enviar_pendentes()
+
+
+class ServidorPrecos:
+    """Servidor HTTP/1.1 mínimo (asyncio) com os endpoints de preço."""
+
+    def __init__(self, executor, workers, margem_desejada_perc=None, custo_embalagem=0.0, imposto_perc=0.0,
+                 janela=JANELA_AGRUPAMENTO_S):
+        self.executor = executor
+        self.padroes = {"margem": margem_desejada_perc, "embalagem": custo_embalagem, "imposto": imposto_perc}
+        self.agrupador = AgrupadorPrecos(executor, workers, janela)
+        self.pedidos = 0
+        self.segundos_total = 0.0
+        self._inicio = time.time()
+
+    def _parametros(self, corpo):
+        """(margem, embalagem, imposto) do pedido, com os padrões do servidor para os ausentes."""
+        valores = []
+        for nome in ("margem", "embalagem", "imposto"):
+            valor = corpo.get(nome, self.padroes[nome])
+            if valor is None:
+                raise ErroPedido(f"Parâmetro '{nome}' não informado.")
+            if isinstance(valor, bool) or not isinstance(valor, (int, float)) or not math.isfinite(valor):
+                raise ErroPedido(f"Parâmetro '{nome}' deve ser numérico ({valor!r}).")
+            valores.append(float(valor))
+        return tuple(valores)
+
+    async def preco(self, corpo):
+        if "custo" not in corpo:
+            raise ErroPedido("Campo 'custo' não informado.")
+        return await self.agrupador.precificar(corpo["custo"], corpo.get("peso", 0), corpo.get("sku"), self._parametros(corpo))
+
+    async def precos(self, corpo):
+        itens = corpo.get("itens")
+        if not isinstance(itens, list) or not all(isinstance(item, dict) for item in itens):
+            raise ErroPedido("Campo 'itens' deve ser uma lista de objetos com 'custo' e 'peso'.")
+        if len(itens) > MAX_ITENS_LOTE:
+            raise ErroPedido(f"O lote tem {len(itens)} itens; o máximo é {MAX_ITENS_LOTE}.")
+        skus = [item.get("sku") for item in itens] if any("sku" in item for item in itens) else None
+        itens_json = await asyncio.get_running_loop().run_in_executor(
+            self.executor, precificar_itens,
+            [item.get("custo") for item in itens], [item.get("peso", 0) for item in itens], *self._parametros(corpo), skus,
+        )
+        return f'{{"itens": {itens_json}}}'
+
+    def estatisticas(self):
+        return {
+            "pedidos": self.pedidos,
+            "tempo_medio_ms": round(self.segundos_total / self.pedidos * 1000, 3) if self.pedidos else None,
+            "lotes_agrupados": self.agrupador.lotes,
+            "itens_agrupados": self.agrupador.itens,
+            "segundos_em_execucao": round(time.time() - self._inicio, 1),
+        }
+
+    async def rotear(self, metodo, caminho, corpo_bytes):
+        """Retorna (status HTTP, resposta): um objeto a serializar ou um texto já em JSON."""
+        caminho = caminho.split("?", 1)[0].rstrip("/") or "/"
+        if metodo == "GET" and caminho == "/saude":
+            return HTTPStatus.OK, {"status": "ok", "marketplaces": list(COMISSOES_PADRAO)}
+        if metodo == "GET" and caminho == "/estatisticas":
+            return HTTPStatus.OK, self.estatisticas()
+        rotas = {"/preco": self.preco, "/precos": self.precos}
+        if caminho not in rotas:
+            return HTTPStatus.NOT_FOUND, {"erro": f"Endpoint '{caminho}' não encontrado."}
+        if metodo != "POST":
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"erro": f"Método {metodo} não permitido em '{caminho}'."}
+        try:
+            corpo = json.loads(corpo_bytes or b"{}", parse_float=_numero_finito, parse_constant=_recusar_constante)
+        except ValueError as erro:
+            return HTTPStatus.BAD_REQUEST, {"erro": f"JSON inválido: {erro}"}
+        if not isinstance(corpo, dict):
+            return HTTPStatus.BAD_REQUEST, {"erro": "O corpo do pedido deve ser um objeto JSON."}
+        inicio = time.perf_counter()
+        try:
+            resposta = await rotas[caminho](corpo)
+        except ErroPedido as erro:
+            return HTTPStatus.BAD_REQUEST, {"erro": str(erro)}
+        except Exception as erro:
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"erro": f"Erro inesperado no cálculo: {erro}"}
+        self.pedidos += 1
+        self.segundos_total += time.perf_counter() - inicio
+        return HTTPStatus.OK, resposta
+
+    async def atender(self, leitor, escritor):
+        """Atende uma conexão (com keep-alive) até o cliente fechar."""
+        try:
+            while True:
+                linha = await leitor.readline()
+                if not linha.strip():
+                    break
+                metodo, caminho, versao = linha.decode("latin-1").split()
+                cabecalhos = {}
+                while True:
+                    linha = await leitor.readline()
+                    if linha in (b"\r\n", b"\n", b""):
+                        break
+                    nome, _, valor = linha.decode("latin-1").partition(":")
+                    cabecalhos[nome.strip().lower()] = valor.strip()
+                tamanho = int(cabecalhos.get("content-length", 0))
+                if tamanho > MAX_CORPO_BYTES:
+                    await self._responder(escritor, HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                          {"erro": f"Corpo maior que {MAX_CORPO_BYTES} bytes."}, False)
+                    break
+                corpo = await leitor.readexactly(tamanho) if tamanho else b""
+                status, resposta = await self.rotear(metodo.upper(), caminho, corpo)
+                manter = versao == "HTTP/1.1" and cabecalhos.get("connection", "").lower() != "close"
+                await self._responder(escritor, status, resposta, manter)
+                if not manter:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            escritor.close()
+
+    @staticmethod
+    async def _responder(escritor, status, resposta, manter):
+        corpo = (resposta if isinstance(resposta, str) else json.dumps(resposta, ensure_ascii=False)).encode("utf-8")
+        escritor.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(corpo)}\r\n"
+            f"Connection: {'keep-alive' if manter else 'close'}\r\n\r\n".encode("latin-1") + corpo
+        )
+        await escritor.drain()
+
+
+async def servir(host, porta, workers, margem_desejada_perc, custo_embalagem, imposto_perc, janela=JANELA_AGRUPAMENTO_S):
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Inicia os processos (e as importações) antes do primeiro pedido
+        await asyncio.gather(*(asyncio.get_running_loop().run_in_executor(executor, precificar_itens, [1.0], [100.0], 30.0, 0.0, 0.0)
+                               for _ in range(workers)))
+        servidor = ServidorPrecos(executor, workers, margem_desejada_perc, custo_embalagem, imposto_perc, janela)
+        async with await asyncio.start_server(servidor.atender, host, porta) as tcp:
+            print(f"Servidor de preços em http://{host}:{porta} ({workers} processo(s) de cálculo).")
+            await tcp.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor HTTP/JSON local da calculadora de preços.")
+    parser.add_argument('--host', default='127.0.0.1', help='Endereço de escuta (padrão: 127.0.0.1).')
+    parser.add_argument('--porta', type=int, default=8502, help='Porta de escuta (padrão: 8502).')
+    parser.add_argument('--workers', type=int, default=2, help='Processos de cálculo (padrão: 2).')
+    parser.add_argument('--margem', type=float, help='Margem padrão (em porcentagem) para pedidos que não informam "margem".')
+    parser.add_argument('--embalagem', type=float, default=0.0, help='Custo de embalagem padrão (em R$, padrão: 0).')
+    parser.add_argument('--imposto', type=float, default=0.0, help='Imposto padrão (em porcentagem, padrão: 0).')
+    parser.add_argument('--janela_ms', type=float, default=JANELA_AGRUPAMENTO_S * 1000, help='Espera para agrupar consultas de um SKU, em ms (padrão: 2).')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(servir(args.host, args.porta, max(1, args.workers), args.margem, args.embalagem, args.imposto, args.janela_ms / 1000))
+    except KeyboardInterrupt:
+        print("Servidor encerrado.")
@@ -6,41 +6,17 @@ import pandas as pd
 import math
 import io
 import os
+import hashlib
 
 st.set_page_config(layout="wide")
 st.title("Calculadora de Preços para Marketplaces")
 
-# --- TABELAS DE FRETE PADRÃO ---
-default_tabela_frete_ml = pd.DataFrame([
-    {"PesoMaximoG": 300, "CustoFrete": 19.95},
-    {"PesoMaximoG": 500, "CustoFrete": 21.45},
-    {"PesoMaximoG": 1000, "CustoFrete": 22.45},
-    {"PesoMaximoG": 2000, "CustoFrete": 23.45},
-    {"PesoMaximoG": 3000, "CustoFrete": 24.95},
-    {"PesoMaximoG": 4000, "CustoFrete": 26.95},
-    {"PesoMaximoG": 5000, "CustoFrete": 28.45},
-])
-
-default_tabela_frete_amazon = pd.DataFrame([
-    {"PesoMaximoG": 249, "CustoFrete": 15.94},
-    {"PesoMaximoG": 499, "CustoFrete": 16.94},
-    {"PesoMaximoG": 999, "CustoFrete": 17.94},
-    {"PesoMaximoG": 1990, "CustoFrete": 18.44},
-    {"PesoMaximoG": 2990, "CustoFrete": 21.69},
-    {"PesoMaximoG": 3990, "CustoFrete": 22.94},
-    {"PesoMaximoG": 4990, "CustoFrete": 28.44},
-    {"PesoMaximoG": 5990, "CustoFrete": 31.30},
-    {"PesoMaximoG": 6990, "CustoFrete": 33.13},
-    {"PesoMaximoG": 7990, "CustoFrete": 33.94},
-    {"PesoMaximoG": 8990, "CustoFrete": 40.29},
-    {"PesoMaximoG": 9990, "CustoFrete": 46.65},
-    {"PesoMaximoG": -1, "CustoFrete": 3.50},
-])
-
-if "tabela_frete_ml" not in st.session_state:
-    st.session_state.tabela_frete_ml = default_tabela_frete_ml.copy()
-if "tabela_frete_amazon" not in st.session_state:
-    st.session_state.tabela_frete_amazon = default_tabela_frete_amazon.copy()
+# --- REGRAS DOS MARKETPLACES ---
+# Marketplaces, comissões padrão e tabelas de frete padrão vêm do registro de regras
+from regras_marketplace import PRECO_REFERENCIA, comissoes_padrao, marketplaces_registrados, obter_regra, tabela_frete_do_marketplace, tabelas_frete_padrao
+
+if "tabelas_frete" not in st.session_state:
+    st.session_state.tabelas_frete = tabelas_frete_padrao()
 
 # --- SIDEBAR ---
 st.sidebar.header("Parâmetros Gerais")
@@ -49,94 +25,350 @@ custo_embalagem = st.sidebar.number_input("Custo da Embalagem (R$)", min_value=0
 imposto_perc = st.sidebar.number_input("Alíquota de Imposto (%)", min_value=0.0, max_value=99.0, value=7.0, step=0.5)
 
 st.sidebar.header("Selecionar Marketplaces")
-usar_shopee = st.sidebar.checkbox("Shopee", value=True)
-usar_shein = st.sidebar.checkbox("Shein", value=True)
-usar_ml = st.sidebar.checkbox("Mercado Livre", value=True)
-usar_amazon = st.sidebar.checkbox("Amazon", value=True)
+marketplaces_usados = [nome for nome in marketplaces_registrados() if st.sidebar.checkbox(nome, value=True)]
 
 st.sidebar.header("Comissões dos Marketplaces (%)")
 comissoes_input = {}
-if usar_shopee:
-    comissoes_input["Shopee"] = st.sidebar.number_input("Shopee", min_value=0.0, max_value=100.0, value=20.0)
-if usar_shein:
-    comissoes_input["Shein"] = st.sidebar.number_input("Shein", min_value=0.0, max_value=100.0, value=16.0)
-if usar_ml:
-    comissoes_input["Mercado Livre"] = st.sidebar.number_input("Mercado Livre", min_value=0.0, max_value=100.0, value=17.0)
-if usar_amazon:
-    comissoes_input["Amazon"] = st.sidebar.number_input("Amazon", min_value=0.0, max_value=100.0, value=15.0)
+for nome in marketplaces_usados:
+    comissoes_input[nome] = st.sidebar.number_input(nome, min_value=0.0, max_value=100.0, value=comissoes_padrao()[nome])
 
 # --- FRETE CONFIG (mantido) ---
 st.sidebar.header("Configuração de Frete")
-with st.sidebar.expander("Mercado Livre"):
-    edited_ml_df = st.data_editor(st.session_state.tabela_frete_ml, num_rows="dynamic")
-    if edited_ml_df is not None and not edited_ml_df.isnull().values.any():
-        st.session_state.tabela_frete_ml = edited_ml_df.copy()
-
-with st.sidebar.expander("Amazon"):
-    edited_amazon_df = st.data_editor(st.session_state.tabela_frete_amazon, num_rows="dynamic")
-    if edited_amazon_df is not None and not edited_amazon_df.isnull().values.any():
-        st.session_state.tabela_frete_amazon = edited_amazon_df.copy()
+for nome, tabela in tabela_frete_do_marketplace().items():
+    with st.sidebar.expander(nome):
+        edited_df = st.data_editor(st.session_state.tabelas_frete[tabela], num_rows="dynamic", key=f"editor_{tabela}")
+        if edited_df is not None and not edited_df.isnull().values.any():
+            st.session_state.tabelas_frete[tabela] = edited_df.copy()
 
 # --- COLUNAS PADRÃO ---
 st.sidebar.header("Colunas da Planilha")
 coluna_custo = st.sidebar.text_input("Nome da Coluna de Custo", value="Custo Produto (N)")
 coluna_peso = st.sidebar.text_input("Nome da Coluna de Peso (g)", value="Peso (kg) (N)")
 coluna_preco_saida = "Preço Anúncio (S)"
+# Colunas opcionais com parâmetros por produto; células vazias usam os valores gerais
+with st.sidebar.expander("Parâmetros por produto (opcional)"):
+    colunas_parametros = {
+        "margem_desejada_perc": st.text_input("Coluna de Margem (%)").strip() or None,
+        "custo_embalagem": st.text_input("Coluna de Embalagem (R$)").strip() or None,
+        "imposto_perc": st.text_input("Coluna de Imposto (%)").strip() or None,
+        "comissoes_perc": {nome: coluna for nome in marketplaces_usados
+                           if (coluna := st.text_input(f"Coluna de Comissão {nome} (%)").strip())},
+    }
+
+# --- DESEMPENHO ---
+st.sidebar.header("Desempenho")
+gerar_perfil = st.sidebar.checkbox("Gerar perfil cProfile do cálculo", value=False)
+medir_memoria = st.sidebar.checkbox("Medir pico de memória (tracemalloc)", value=False,
+                                    help="Deixa leitura, cálculo e escrita bem mais lentos e vale para o processo inteiro, inclusive outras sessões abertas.")
+usar_armazem = st.sidebar.checkbox("Reaproveitar resultados salvos em disco", value=False,
+                                   help="Guarda as linhas calculadas num armazém SQLite local; em um novo upload só as linhas novas ou alteradas são calculadas.")
+
+# --- CACHE ENTRE EXECUÇÕES ---
+# O Streamlit reexecuta o script a cada interação; leitura e cálculo ficam em cache
+# (limitado por max_entries, descartando as entradas mais antigas) e só são refeitos
+# quando o conteúdo do arquivo, as tabelas de frete ou os parâmetros mudam.
+from calculadora_modulo import calcular_precos_dataframe, colunas_dos_parametros  # seu módulo de cálculo externo
+from escritores_saida import EXTENSOES, FORMATOS_SAIDA, MIME_TYPES, escrever_resultado
+from instrumentacao import Instrumentacao
+from armazem_resultados import ArmazemResultados
+import leitura_planilha
+import visualizacao_resultado
+import altair as alt
+
+ARQUIVO_ARMAZEM = os.environ.get("CALCULADORA_ARMAZEM", "resultados_calculadora.sqlite")
+
+PARAMETROS_GERAIS = ("coluna_custo", "coluna_peso", "custo_embalagem", "margem_desejada_perc", "imposto_perc")
+
+def hash_arquivo(arquivo):
+    """Hash SHA-256 do conteúdo enviado, calculado uma vez por upload."""
+    hashes = st.session_state.setdefault("hashes_arquivos", {})
+    if arquivo.file_id not in hashes:
+        hashes.clear()
+        hashes[arquivo.file_id] = hashlib.sha256(arquivo.getvalue()).hexdigest()
+    return hashes[arquivo.file_id]
+
+@st.cache_data(max_entries=3, show_spinner="Lendo planilha...")
+def ler_planilha(hash_conteudo, nome_arquivo, colunas_numericas, _conteudo):
+    # Todas as colunas são lidas: a planilha inteira volta no arquivo de saída
+    if not nome_arquivo.endswith((".xlsx", ".xls", ".csv")):
+        return None
+    return leitura_planilha.ler_planilha(_conteudo, nome_arquivo, colunas_numericas=colunas_numericas)
+
+def _serializar(valor):
+    if isinstance(valor, pd.DataFrame):
+        return valor.to_json()
+    if isinstance(valor, dict):
+        return "{" + ",".join(f"{chave!r}:{_serializar(item)}" for chave, item in sorted(valor.items())) + "}"
+    return repr(valor)
+
+def chave_calculo(hash_conteudo, parametros):
+    """Chave do resultado: hash do arquivo + parâmetros de preço + tabelas de frete."""
+    partes = [hash_conteudo] + [f"{nome}={_serializar(valor)}" for nome, valor in sorted(parametros.items())]
+    return hashlib.sha256("|".join(partes).encode()).hexdigest()
+
+def dependencias_marketplace(nome, parametros):
+    """Entradas de que as colunas de um marketplace dependem: parâmetros gerais, a própria comissão e a própria tabela de frete."""
+    dependencias = {chave: parametros[chave] for chave in PARAMETROS_GERAIS}
+    dependencias["comissoes_perc"] = {nome: parametros["comissoes_perc"][nome]}
+    colunas = parametros["colunas_parametros"]
+    dependencias["colunas_parametros"] = {**colunas, "comissoes_perc": {nome: colunas["comissoes_perc"][nome]} if nome in colunas["comissoes_perc"] else {}}
+    regra = obter_regra(nome)
+    tabela = regra.tabela_frete if regra is not None else None
+    dependencias["tabelas_frete"] = {tabela: parametros["tabelas_frete"][tabela]} if tabela is not None else {}
+    return dependencias
+
+@st.cache_resource
+def abrir_armazem(caminho):
+    """Um armazém (conexão SQLite) por arquivo, compartilhado entre sessões."""
+    return ArmazemResultados(caminho)
+
+@st.cache_data(max_entries=32, show_spinner="Calculando preços...")
+def calcular_marketplace(chave, _df_original, _dependencias, _instrumentacao=None, _armazem=None):
+    return calcular_precos_dataframe(_df_original, **_dependencias, instrumentacao=_instrumentacao, armazem=_armazem)
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def calcular_resultado(chave, _df_original, _blocos, _comissoes):
+    df_resultado = _df_original.copy()
+    # Escreve resultado no campo de preço final (primeiro marketplace selecionado com preço)
+    preco_saida = None
+    for marketplace in _comissoes:
+        precos = _blocos[marketplace][f"{marketplace} Preço Venda"]
+        preco_saida = precos if preco_saida is None else preco_saida.fillna(precos)
+    com_preco = preco_saida.notna()
+    df_resultado.loc[com_preco, coluna_preco_saida] = preco_saida[com_preco]
+    return df_resultado
+
+@st.cache_data(max_entries=4, show_spinner="Gerando arquivo de saída...")
+def gerar_saida(chave, formato, _df_resultado):
+    """Gera o arquivo de download no formato escolhido; devolve os bytes e o tempo de escrita."""
+    output = io.BytesIO()
+    tempo_escrita = escrever_resultado(_df_resultado, output, formato)
+    return output.getvalue(), tempo_escrita
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def resumir_resultado(chave, _blocos):
+    """Resumo e distribuição de preços por marketplace, calculados uma vez por resultado."""
+    return visualizacao_resultado.resumo_marketplaces(_blocos), visualizacao_resultado.distribuicao_precos(_blocos)
+
+@st.cache_data(max_entries=16, show_spinner="Filtrando...")
+def selecionar_linhas(chave, filtros, _df_resultado, _com_erro):
+    filtros = dict(filtros)
+    mascara = _com_erro.to_numpy() if filtros.pop("somente_erros") else None
+    return visualizacao_resultado.filtrar_ordenar(_df_resultado, mascara=mascara, **filtros)
+
+def mostrar_resultado(chave, df_resultado, blocos, com_erro):
+    """Resumo por marketplace e tabela paginada: filtro, ordenação e recorte da página são feitos aqui, o navegador recebe só a página."""
+    resumo, distribuicao = resumir_resultado(chave, blocos)
+    st.dataframe(resumo, hide_index=True)
+    if not distribuicao.empty:
+        st.altair_chart(alt.Chart(distribuicao).mark_bar().encode(
+            x=alt.X("Faixa:N", title="Preço de venda (R$)", sort=alt.SortField("Preço De")),
+            y=alt.Y("Linhas:Q", title="Linhas"),
+            color="Marketplace:N",
+            xOffset="Marketplace:N",
+            tooltip=["Marketplace", "Faixa", "Linhas"],
+        ), width="stretch")
+
+    colunas = list(df_resultado.columns)
+    filtro, busca, minimo, maximo = st.columns(4)
+    coluna_filtro = filtro.selectbox("Filtrar coluna", [None, *colunas], format_func=lambda c: "(nenhuma)" if c is None else c)
+    texto = busca.text_input("Contém", disabled=coluna_filtro is None)
+    valor_minimo = minimo.number_input("Mínimo", value=None, disabled=coluna_filtro is None)
+    valor_maximo = maximo.number_input("Máximo", value=None, disabled=coluna_filtro is None)
+    ordem, direcao, erros, tamanho = st.columns(4)
+    coluna_ordem = ordem.selectbox("Ordenar por", [None, *colunas], format_func=lambda c: "(ordem da planilha)" if c is None else c)
+    crescente = direcao.radio("Ordem", ["Crescente", "Decrescente"], horizontal=True) == "Crescente"
+    somente_erros = erros.checkbox("Só linhas com erro")
+    tamanho_pagina = tamanho.selectbox("Linhas por página", visualizacao_resultado.TAMANHOS_PAGINA)
+
+    filtros = (("coluna_filtro", coluna_filtro), ("texto", texto), ("minimo", valor_minimo), ("maximo", valor_maximo),
+               ("somente_erros", somente_erros), ("coluna_ordem", coluna_ordem), ("crescente", crescente))
+    posicoes = selecionar_linhas(chave, filtros, df_resultado, com_erro)
+    paginas = visualizacao_resultado.total_paginas(len(posicoes), tamanho_pagina)
+    numero = st.number_input("Página", min_value=1, max_value=paginas, value=1, step=1)
+    st.dataframe(visualizacao_resultado.pagina(df_resultado, posicoes, numero, tamanho_pagina))
+    st.caption(f"{len(posicoes)} de {len(df_resultado)} linha(s); página {numero} de {paginas}.")
+
+def mostrar_metricas(instrumentacao, reaproveitados, blocos, armazem=None):
+    """Painel com tempo e memória de cada fase executada nesta interação, a contagem de linhas e as estatísticas do solver."""
+    relatorio = instrumentacao.relatorio()
+    with st.expander("Métricas de desempenho"):
+        colunas = st.columns(4)
+        colunas[0].metric("Tempo total", f"{relatorio['total_segundos']:.2f} s")
+        colunas[1].metric("Pico de memória", "não medido" if relatorio["pico_memoria_mb"] is None else f"{relatorio['pico_memoria_mb']:.1f} MB")
+        colunas[2].metric("Linhas processadas", relatorio["contadores"].get("linhas processadas", 0))
+        colunas[3].metric("Linhas com erro", relatorio["contadores"].get("linhas com erro", 0))
+        st.dataframe(instrumentacao.tabela_fases(), hide_index=True)
+        if reaproveitados:
+            st.caption(f"Reaproveitados do cache (não medidos): {', '.join(reaproveitados)}.")
+        if armazem is not None:
+            usos = [bloco.attrs["armazem"] for marketplace, bloco in blocos.items() if marketplace not in reaproveitados and "armazem" in bloco.attrs]
+            estatisticas = armazem.estatisticas()
+            st.caption(f"Armazém em disco: {sum(uso['acertos'] for uso in usos)} linha(s) lidas, {sum(uso['falhas'] for uso in usos)} calculada(s) nesta interação; "
+                       f"{estatisticas['linhas']} linhas guardadas ({estatisticas['tamanho_mb']:.1f} MB).")
+            if st.button("Limpar armazém"):
+                armazem.limpar()
+        st.dataframe(pd.DataFrame([
+            {"Marketplace": marketplace,
+             "Sem Preço Consistente": telemetria["nao_convergidos"],
+             "Passos do Solver": ", ".join(f"{passos}: {quantidade}" for passos, quantidade in telemetria["histograma_passos"].items()),
+             "Linhas por Faixa": ", ".join(f"{faixa}: {quantidade}" for faixa, quantidade in telemetria["linhas_por_faixa"].items())}
+            for marketplace, bloco in blocos.items()
+            for telemetria in [bloco.attrs["telemetria_solver"][marketplace]]
+        ]), hide_index=True)
+        perfil = instrumentacao.perfil_cprofile()
+        if perfil is not None:
+            st.download_button("Download perfil cProfile (.prof)", data=perfil, file_name="calculo.prof", mime="application/octet-stream")
+            st.code(instrumentacao.funcoes_mais_lentas(), language=None)
+
+# Mede cada interação; fases em cache não executam e por isso não aparecem
+instrumentacao = Instrumentacao(medir_memoria=medir_memoria, cprofile=gerar_perfil).iniciar()
+armazem = abrir_armazem(ARQUIVO_ARMAZEM) if usar_armazem else None
 
 # --- UPLOAD DE PLANILHA ---
 st.header("1. Carregar Planilha")
 uploaded_file = st.file_uploader("Escolha um arquivo Excel (.xls, .xlsx) ou CSV (.csv)", type=["xls", "xlsx", "csv"])
 df_original = None
+hash_conteudo = None
 if uploaded_file is not None:
     try:
-        if uploaded_file.name.endswith(".xlsx"):
-            df_original = pd.read_excel(uploaded_file, engine="openpyxl")
-        elif uploaded_file.name.endswith(".xls"):
-            import xlrd
-            df_original = pd.read_excel(uploaded_file, engine="xlrd")
-        elif uploaded_file.name.endswith(".csv"):
-            df_original = pd.read_csv(uploaded_file, sep=None, engine="python")
+        with instrumentacao.fase("leitura"):
+            hash_conteudo = hash_arquivo(uploaded_file)
+            colunas_numericas = (coluna_custo, coluna_peso, *colunas_dos_parametros(colunas_parametros))
+            df_original = ler_planilha(hash_conteudo, uploaded_file.name, colunas_numericas, uploaded_file.getvalue())
         st.success("Arquivo carregado com sucesso!")
         st.dataframe(df_original.head())
+        problemas = leitura_planilha.resumo_validacao(df_original, coluna_custo, coluna_peso)
+        if not problemas.empty:
+            st.warning(f"{problemas['Linhas'].sum()} linha(s) com custo ou peso inválido serão ignoradas no cálculo.")
+            st.dataframe(problemas, hide_index=True)
+        ausentes = [coluna for coluna in colunas_dos_parametros(colunas_parametros) if coluna not in df_original.columns]
+        if ausentes:
+            st.warning(f"Coluna(s) de parâmetros não encontrada(s): {', '.join(ausentes)}. Nelas vale o valor geral.")
     except Exception as e:
         st.error(f"Erro ao ler o arquivo: {e}")
 
 # --- CÁLCULO E RESULTADO ---
-from calculadora_modulo import calcular_preco_venda  # seu módulo de cálculo externo
-
 st.header("2. Calcular Preços")
 if df_original is not None and comissoes_input:
+    # O resultado continua visível nas reexecuções seguintes enquanto o arquivo não mudar
     if st.button("Calcular Preços de Venda"):
-        df_resultado = df_original.copy()
-        for idx, row in df_resultado.iterrows():
-            custo = row.get(coluna_custo, 0)
-            peso = row.get(coluna_peso, 0)
-            resultados = calcular_preco_venda(
-                custo_produto=custo,
-                custo_embalagem=custo_embalagem,
-                margem_desejada_perc=margem_desejada,
-                imposto_perc=imposto_perc,
-                peso_g=peso,
-                comissoes_perc=comissoes_input,
-                tabela_frete_ml_df=st.session_state.tabela_frete_ml,
-                tabela_frete_amazon_df=st.session_state.tabela_frete_amazon
-            )
-            # Escreve resultado no campo de preço final (primeiro marketplace selecionado)
-            for marketplace, dados in resultados.items():
-                if "preco_venda" in dados:
-                    df_resultado.at[idx, coluna_preco_saida] = dados["preco_venda"]
-                    break  # só escreve uma vez
+        st.session_state.arquivo_calculado = hash_conteudo
+    if st.session_state.get("arquivo_calculado") == hash_conteudo:
+        parametros = dict(
+            coluna_custo=coluna_custo,
+            coluna_peso=coluna_peso,
+            custo_embalagem=custo_embalagem,
+            margem_desejada_perc=margem_desejada,
+            imposto_perc=imposto_perc,
+            comissoes_perc=comissoes_input,
+            colunas_parametros=colunas_parametros,
+            tabelas_frete=st.session_state.tabelas_frete
+        )
+        # Cada marketplace é calculado (e fica em cache) separadamente: mudar a comissão da
+        # Shopee ou a tabela do Mercado Livre recalcula só as colunas desse marketplace.
+        blocos = {}
+        recalculados = []
+        chaves_anteriores = st.session_state.setdefault("chaves_marketplace", {})
+        for marketplace in comissoes_input:
+            dependencias = dependencias_marketplace(marketplace, parametros)
+            chave_marketplace = chave_calculo(hash_conteudo, dependencias)
+            if chaves_anteriores.get(marketplace) != chave_marketplace:
+                recalculados.append(marketplace)
+                chaves_anteriores[marketplace] = chave_marketplace
+            blocos[marketplace] = calcular_marketplace(chave_marketplace, df_original, dependencias, instrumentacao, armazem)
+        chave = chave_calculo(hash_conteudo, parametros)
+        with instrumentacao.fase("montagem do resultado"):
+            df_resultado = calcular_resultado(chave, df_original, blocos, comissoes_input)
+        com_erro = pd.Series(False, index=df_original.index)
+        for marketplace, bloco in blocos.items():
+            com_erro |= bloco["Erro Geral"].notna() | bloco[f"{marketplace} Erro"].notna()
+        instrumentacao.contar("linhas processadas", len(df_resultado))
+        instrumentacao.contar("linhas com erro", com_erro.sum())
         st.header("3. Resultado")
-        st.dataframe(df_resultado)
+        if recalculados and len(recalculados) < len(comissoes_input):
+            st.caption(f"Recalculado: {', '.join(recalculados)} (demais marketplaces reaproveitados).")
+        mostrar_resultado(chave, df_resultado, blocos, com_erro)
 
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine="openpyxl") as writer:
-            df_resultado.to_excel(writer, index=False)
+        formato_saida = st.selectbox(
+            "Formato do arquivo",
+            FORMATOS_SAIDA,
+            format_func={"xlsx": "Excel (.xlsx)", "csv": "CSV (.csv)", "parquet": "Parquet (.parquet)"}.get
+        )
+        with instrumentacao.fase("escrita"):
+            dados_saida, tempo_escrita = gerar_saida(chave, formato_saida, df_resultado)
         st.download_button(
-            label="Download Resultado (.xlsx)",
-            data=output.getvalue(),
-            file_name="resultado_magis.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            label=f"Download Resultado ({EXTENSOES[formato_saida]})",
+            data=dados_saida,
+            file_name=f"resultado_magis{EXTENSOES[formato_saida]}",
+            mime=MIME_TYPES[formato_saida]
         )
+        st.caption(f"Arquivo {formato_saida} gerado em {tempo_escrita:.2f}s ({len(dados_saida) / 1024:.0f} KB).")
+        instrumentacao.finalizar()
+        mostrar_metricas(instrumentacao, [m for m in comissoes_input if m not in recalculados], blocos, armazem)
 else:
     st.info("Por favor, carregue uma planilha e selecione pelo menos um marketplace.")
+instrumentacao.finalizar()
+
+# --- GRADE DE CENÁRIOS ---
+# Preço de todo o catálogo em cada combinação de margem x imposto x embalagem, numa passada só
+from grade_cenarios import calcular_grade_dataframe, valores_faixa
+
+@st.cache_data(max_entries=4, show_spinner="Calculando grade de cenários...")
+def calcular_grade(chave, _df_original, _parametros):
+    return calcular_grade_dataframe(_df_original, **_parametros)
+
+def mapa_calor(dados, metrica):
+    return alt.Chart(dados).mark_rect().encode(
+        x=alt.X("Margem %:O", title="Margem desejada (%)"),
+        y=alt.Y("Imposto %:O", title="Imposto (%)", sort="descending"),
+        color=alt.Color(f"{metrica}:Q", title=metrica, scale=alt.Scale(scheme="viridis")),
+        tooltip=["Margem %", "Imposto %", "Embalagem R$", "Preço Médio", "Margem Real Média %", metrica_acima, "SKUs Inconsistentes"],
+    )
+
+metrica_acima = f"% Acima de R$ {PRECO_REFERENCIA:.0f}"
+if df_original is not None and comissoes_input:
+    st.header("4. Grade de Cenários")
+    coluna_margem, coluna_imposto, coluna_embalagem = st.columns(3)
+    with coluna_margem:
+        margem_min, margem_max = st.slider("Faixa de Margem (%)", 0.0, 100.0, (20.0, 40.0), step=1.0)
+        passos_margem = st.number_input("Passos da Margem", min_value=1, max_value=25, value=5)
+    with coluna_imposto:
+        imposto_min, imposto_max = st.slider("Faixa de Imposto (%)", 0.0, 50.0, (4.0, 12.0), step=0.5)
+        passos_imposto = st.number_input("Passos do Imposto", min_value=1, max_value=25, value=5)
+    with coluna_embalagem:
+        embalagem_min, embalagem_max = st.slider("Faixa de Embalagem (R$)", 0.0, 20.0, (0.0, 2.0), step=0.1)
+        passos_embalagem = st.number_input("Passos da Embalagem", min_value=1, max_value=10, value=3)
+    parametros_grade = dict(
+        coluna_custo=coluna_custo,
+        coluna_peso=coluna_peso,
+        margens_perc=valores_faixa(margem_min, margem_max, passos_margem).tolist(),
+        impostos_perc=valores_faixa(imposto_min, imposto_max, passos_imposto).tolist(),
+        embalagens=valores_faixa(embalagem_min, embalagem_max, passos_embalagem).tolist(),
+        comissoes_perc=comissoes_input,
+        tabelas_frete=st.session_state.tabelas_frete
+    )
+    total_pontos = len(parametros_grade["margens_perc"]) * len(parametros_grade["impostos_perc"]) * len(parametros_grade["embalagens"])
+    st.caption(f"{total_pontos} cenários x {len(df_original)} SKUs x {len(comissoes_input)} marketplaces.")
+
+    if st.button("Calcular Grade de Cenários"):
+        st.session_state.grade_calculada = hash_conteudo
+    if st.session_state.get("grade_calculada") == hash_conteudo:
+        try:
+            grade = calcular_grade(chave_calculo(hash_conteudo, parametros_grade), df_original, parametros_grade)
+        except ValueError as e:
+            st.error(str(e))
+        else:
+            if grade.attrs.get("linhas_ignoradas"):
+                st.caption("SKUs fora da grade: " + "; ".join(f"{erro} ({quantidade})" for erro, quantidade in grade.attrs["linhas_ignoradas"].items()) + ".")
+            coluna_filtro_mp, coluna_filtro_embalagem = st.columns(2)
+            marketplace_grade = coluna_filtro_mp.selectbox("Marketplace da Grade", list(comissoes_input))
+            embalagem_grade = coluna_filtro_embalagem.selectbox("Embalagem (R$) da Grade", parametros_grade["embalagens"], format_func=lambda v: f"R$ {v:.2f}")
+            dados_grade = grade[(grade["Marketplace"] == marketplace_grade) & (grade["Embalagem R$"] == embalagem_grade)]
+            coluna_preco, coluna_acima = st.columns(2)
+            coluna_preco.subheader("Preço Médio (R$)")
+            coluna_preco.altair_chart(mapa_calor(dados_grade, "Preço Médio"), width="stretch")
+            coluna_acima.subheader(f"SKUs acima de R$ {PRECO_REFERENCIA:.2f} (%)")
+            coluna_acima.altair_chart(mapa_calor(dados_grade, metrica_acima), width="stretch")
+            with st.expander("Tabela da grade"):
+                st.dataframe(grade, hide_index=True)
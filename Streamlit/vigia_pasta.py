@@ -0,0 +1,177 @@
+# vigia_pasta.py
+# Modo vigia da linha de comando: o processo fica aberto (Python, pandas e tabelas de frete já
+# carregados) e varre uma pasta de entrada a cada poucos segundos. Cada planilha que chega é
+# calculada assim que fica completa: só é processada depois que o tamanho e a data de
+# modificação deixam de mudar por alguns segundos, e arquivos temporários (cópias em andamento,
+# arquivos de trava do Excel) são ignorados. O resultado é gravado com um nome temporário e
+# renomeado na pasta de saída (nome da entrada mais a extensão do formato, ex.: a.csv.xlsx), a
+# entrada vai para "processados" (ou "com_erro") e o tempo de cada arquivo fica registrado em
+# registro_vigia.csv na pasta de saída. Exemplo:
+#
+#     python price_calculator_app.py entrada/ saida/ --vigiar --margem 30 --embalagem 1.5 --imposto 7
+import csv
+import os
+import time
+from datetime import datetime
+
+from escritores_saida import EXTENSOES
+from instrumentacao import Instrumentacao
+
+EXTENSOES_ENTRADA = (".csv", ".xlsx", ".xls")
+# Arquivos ocultos, de trava do Excel/LibreOffice e downloads ou cópias ainda em andamento
+PREFIXOS_TEMPORARIOS = (".", "~")
+SUFIXOS_TEMPORARIOS = (".tmp", ".part", ".partial", ".crdownload", ".download", ".swp")
+PASTA_PROCESSADOS = "processados"
+PASTA_COM_ERRO = "com_erro"
+ARQUIVO_REGISTRO = "registro_vigia.csv"
+# Itens que o próprio modo vigia cria na pasta de entrada (ou na de saída, se for a mesma)
+NOMES_IGNORADOS = {ARQUIVO_REGISTRO, PASTA_PROCESSADOS, PASTA_COM_ERRO}
+INTERVALO_PADRAO_S = 1.0
+ESTABILIDADE_PADRAO_S = 2.0
+CAMPOS_REGISTRO = ["Arquivo", "Início", "Status", "Linhas", "Linhas com Erro", "Espera (s)", "Latência (s)", "Saída"]
+
+
+def arquivo_temporario(nome):
+    nome = nome.lower()
+    return nome.startswith(PREFIXOS_TEMPORARIOS) or nome.endswith(SUFIXOS_TEMPORARIOS)
+
+
+def erro_pastas(pasta_entrada, pasta_saida):
+    """Mensagem de erro se a pasta de saída for a de entrada ou estiver dentro dela (os resultados seriam lidos como entrada), ou None."""
+    entrada = os.path.realpath(pasta_entrada)
+    saida = os.path.realpath(pasta_saida)
+    if os.path.commonpath([entrada, saida]) == entrada:
+        return f"a pasta de saída '{pasta_saida}' não pode ser a pasta de entrada '{pasta_entrada}' nem ficar dentro dela"
+    return None
+
+
+class VigiaPasta:
+    """Planilhas completas de uma pasta: as que não mudaram de tamanho nem de data de modificação por estabilidade segundos."""
+
+    def __init__(self, pasta, estabilidade=ESTABILIDADE_PADRAO_S):
+        self.pasta = pasta
+        self.estabilidade = estabilidade
+        # nome -> ((tamanho, data de modificação), instante em que passou a ter essa assinatura)
+        self._observados = {}
+        # nome -> assinatura com que o arquivo falhou; só volta a ser processado se mudar
+        self._ignorados = {}
+
+    def prontos(self):
+        """Caminhos dos arquivos completos, do modificado há mais tempo para o mais recente."""
+        agora = time.monotonic()
+        observados = {}
+        prontos = []
+        with os.scandir(self.pasta) as entradas:
+            for entrada in entradas:
+                if (entrada.name in NOMES_IGNORADOS or arquivo_temporario(entrada.name)
+                        or not entrada.name.lower().endswith(EXTENSOES_ENTRADA)):
+                    continue
+                try:
+                    if not entrada.is_file():
+                        continue
+                    informacoes = entrada.stat()
+                except FileNotFoundError:
+                    continue
+                assinatura = (informacoes.st_size, informacoes.st_mtime_ns)
+                if self._ignorados.get(entrada.name) == assinatura:
+                    observados[entrada.name] = (assinatura, agora)
+                    continue
+                anterior = self._observados.get(entrada.name)
+                desde = anterior[1] if anterior is not None and anterior[0] == assinatura else agora
+                observados[entrada.name] = (assinatura, desde)
+                if agora - desde >= self.estabilidade:
+                    prontos.append((informacoes.st_mtime_ns, entrada.path))
+        self._observados = observados
+        self._ignorados = {nome: assinatura for nome, assinatura in self._ignorados.items() if nome in observados}
+        return [caminho for _, caminho in sorted(prontos)]
+
+    def ignorar(self, caminho):
+        """Deixa de devolver o arquivo enquanto ele não mudar (ex.: não pôde ser lido ou movido)."""
+        nome = os.path.basename(caminho)
+        if nome in self._observados:
+            self._ignorados[nome] = self._observados[nome][0]
+
+
+def mover_para(caminho, pasta):
+    """Move o arquivo para a pasta sem sobrescrever um arquivo de mesmo nome (acrescenta data e hora)."""
+    os.makedirs(pasta, exist_ok=True)
+    destino = os.path.join(pasta, os.path.basename(caminho))
+    if os.path.exists(destino):
+        base, extensao = os.path.splitext(destino)
+        destino = f"{base}_{datetime.now():%Y%m%d_%H%M%S_%f}{extensao}"
+    os.replace(caminho, destino)
+    return destino
+
+
+def processar_arquivo(caminho, pasta_saida, processar, formato):
+    """Calcula um arquivo com processar(entrada, saida, instrumentacao) -> bool e devolve a linha do registro.
+
+    A saída só aparece com o nome final depois de gravada por completo.
+    """
+    nome = os.path.basename(caminho)
+    # O nome de saída mantém a extensão da entrada: a.csv e a.xlsx geram a.csv.xlsx e a.xlsx.xlsx
+    destino = os.path.join(pasta_saida, nome + EXTENSOES[formato])
+    temporario = os.path.join(pasta_saida, f".{nome}{EXTENSOES[formato]}.tmp")
+    espera = time.time() - os.path.getmtime(caminho)
+    data_inicio = datetime.now()
+    inicio = time.perf_counter()
+    instrumentacao = Instrumentacao(medir_memoria=False)
+    try:
+        with instrumentacao:
+            sucesso = processar(caminho, temporario, instrumentacao)
+        if sucesso:
+            os.replace(temporario, destino)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+    mover_para(caminho, os.path.join(os.path.dirname(caminho), PASTA_PROCESSADOS if sucesso else PASTA_COM_ERRO))
+    return {
+        "Arquivo": nome,
+        "Início": data_inicio.isoformat(timespec="seconds"),
+        "Status": "ok" if sucesso else "erro",
+        "Linhas": instrumentacao.contadores.get("linhas processadas", 0),
+        "Linhas com Erro": instrumentacao.contadores.get("linhas com erro", 0),
+        "Espera (s)": round(espera, 3),
+        "Latência (s)": round(time.perf_counter() - inicio, 3),
+        "Saída": destino if sucesso else "",
+    }
+
+
+def registrar(caminho_registro, linha):
+    novo = not os.path.exists(caminho_registro)
+    with open(caminho_registro, "a", newline="", encoding="utf-8") as arquivo:
+        escritor = csv.DictWriter(arquivo, fieldnames=CAMPOS_REGISTRO)
+        if novo:
+            escritor.writeheader()
+        escritor.writerow(linha)
+
+
+def vigiar(pasta_entrada, pasta_saida, processar, formato="xlsx", intervalo=INTERVALO_PADRAO_S, estabilidade=ESTABILIDADE_PADRAO_S):
+    """Processa cada planilha completa que chega em pasta_entrada até o processo ser interrompido.
+
+    processar(caminho_entrada, caminho_saida, instrumentacao) calcula e grava um arquivo e
+    retorna se deu certo. A latência de cada arquivo vai para o registro na pasta de saída, que
+    não pode ser a pasta de entrada nem ficar dentro dela (ValueError).
+    """
+    erro = erro_pastas(pasta_entrada, pasta_saida)
+    if erro:
+        raise ValueError(erro)
+    os.makedirs(pasta_entrada, exist_ok=True)
+    os.makedirs(pasta_saida, exist_ok=True)
+    vigia = VigiaPasta(pasta_entrada, estabilidade)
+    caminho_registro = os.path.join(pasta_saida, ARQUIVO_REGISTRO)
+    print(f"Vigiando '{pasta_entrada}' (a cada {intervalo:g}s); resultados em '{pasta_saida}'. Ctrl+C encerra.")
+    while True:
+        for caminho in vigia.prontos():
+            try:
+                linha = processar_arquivo(caminho, pasta_saida, processar, formato)
+                registrar(caminho_registro, linha)
+            except OSError as e:
+                # Arquivo removido, sem permissão ou disco cheio: os demais continuam sendo processados
+                print(f"Erro ao processar '{caminho}': {e}. O arquivo só será tentado de novo se for modificado.")
+                vigia.ignorar(caminho)
+                continue
+            salvo = f" Resultados salvos em '{linha['Saída']}'." if linha["Saída"] else ""
+            print(f"[{linha['Início']}] {linha['Arquivo']}: {linha['Status']}, {linha['Linhas']} linha(s) em {linha['Latência (s)']:.2f}s "
+                  f"(esperou {linha['Espera (s)']:.1f}s desde a última modificação).{salvo}")
+        time.sleep(intervalo)
@@ -0,0 +1,106 @@
+# visualizacao_resultado.py
+# Visualização de resultados grandes: filtro e ordenação são feitos no servidor e devolvem só as
+# posições das linhas selecionadas; a página visível é recortada dessas posições, assim o
+# navegador recebe algumas dezenas de linhas em vez do catálogo inteiro. O resumo por
+# marketplace (distribuição de preços, erros, linhas acima do preço de referência) é calculado
+# uma vez por resultado a partir das colunas de cada marketplace.
+import math
+
+import numpy as np
+import pandas as pd
+
+from regras_marketplace import PRECO_REFERENCIA
+
+TAMANHOS_PAGINA = (50, 100, 250, 500)
+FAIXAS_DISTRIBUICAO = 20
+
+
+def filtrar_ordenar(df, coluna_filtro=None, texto=None, minimo=None, maximo=None, mascara=None, coluna_ordem=None, crescente=True):
+    """Posições (array) das linhas que passam nos filtros, na ordem pedida.
+
+    texto procura (sem diferenciar maiúsculas) na coluna_filtro; minimo e maximo limitam o valor
+    numérico dela. mascara (booleana, por linha) restringe as linhas antes dos filtros. A ordenação
+    é estável, com valores nulos no fim; colunas não numéricas são ordenadas como texto.
+    """
+    selecionadas = np.ones(len(df), dtype=bool) if mascara is None else np.asarray(mascara, dtype=bool).copy()
+    if coluna_filtro is not None and coluna_filtro in df.columns:
+        coluna = df[coluna_filtro]
+        if texto:
+            selecionadas &= coluna.astype(str).str.contains(texto, case=False, regex=False).to_numpy(dtype=bool) & coluna.notna().to_numpy()
+        if minimo is not None or maximo is not None:
+            numeros = pd.to_numeric(coluna, errors="coerce").to_numpy(dtype=float)
+            if minimo is not None:
+                selecionadas &= numeros >= minimo
+            if maximo is not None:
+                selecionadas &= numeros <= maximo
+    posicoes = np.flatnonzero(selecionadas)
+    if coluna_ordem is not None and coluna_ordem in df.columns and len(posicoes):
+        valores = df[coluna_ordem].iloc[posicoes].reset_index(drop=True)
+        if not pd.api.types.is_numeric_dtype(valores):
+            valores = valores.astype(str).where(valores.notna())
+        ordem = valores.sort_values(ascending=crescente, na_position="last", kind="stable").index.to_numpy()
+        posicoes = posicoes[ordem]
+    return posicoes
+
+
+def total_paginas(linhas, tamanho_pagina):
+    return max(1, math.ceil(linhas / tamanho_pagina))
+
+
+def pagina(df, posicoes, numero, tamanho_pagina):
+    """Linhas da página numero (a partir de 1) entre as posições selecionadas."""
+    inicio = (numero - 1) * tamanho_pagina
+    return df.iloc[posicoes[inicio:inicio + tamanho_pagina]]
+
+
+def _precos_e_erros(blocos):
+    """(precos, erros) por marketplace a partir das colunas "<Marketplace> Preço Venda" e dos erros."""
+    for marketplace, bloco in blocos.items():
+        precos = pd.to_numeric(bloco[f"{marketplace} Preço Venda"], errors="coerce").to_numpy(dtype=float)
+        erros = (bloco["Erro Geral"].notna() | bloco[f"{marketplace} Erro"].notna()).to_numpy()
+        yield marketplace, precos, erros
+
+
+def resumo_marketplaces(blocos, preco_referencia=PRECO_REFERENCIA):
+    """Uma linha por marketplace: linhas com preço e com erro, quartis e média do preço, e linhas acima de preco_referencia.
+
+    blocos: {marketplace: DataFrame com "<Marketplace> Preço Venda", "<Marketplace> Erro" e "Erro Geral"}.
+    """
+    acima = f"Acima de R$ {preco_referencia:.0f}"
+    linhas = []
+    for marketplace, precos, erros in _precos_e_erros(blocos):
+        com_preco = precos[np.isfinite(precos)]
+        quartis = np.percentile(com_preco, [0, 25, 50, 75, 100]) if len(com_preco) else np.full(5, np.nan)
+        linhas.append({
+            "Marketplace": marketplace,
+            "Com Preço": len(com_preco),
+            "Com Erro": int(erros.sum()),
+            "Preço Mínimo": quartis[0],
+            "1º Quartil": quartis[1],
+            "Mediana": quartis[2],
+            "3º Quartil": quartis[3],
+            "Preço Máximo": quartis[4],
+            "Preço Médio": com_preco.mean() if len(com_preco) else np.nan,
+            acima: int((com_preco >= preco_referencia).sum()),
+            f"% {acima}": (com_preco >= preco_referencia).mean() * 100 if len(com_preco) else np.nan,
+        })
+    return pd.DataFrame(linhas).round(2)
+
+
+def distribuicao_precos(blocos, faixas=FAIXAS_DISTRIBUICAO):
+    """Linhas por faixa de preço e marketplace ("Marketplace", "Faixa", "Preço De", "Linhas"), com as mesmas faixas para todos.
+
+    As faixas vão do menor preço ao percentil 99; os preços acima dele entram na última faixa.
+    """
+    precos_por_marketplace = {marketplace: precos[np.isfinite(precos)] for marketplace, precos, _ in _precos_e_erros(blocos)}
+    todos = np.concatenate([np.zeros(0), *precos_por_marketplace.values()])
+    if not len(todos):
+        return pd.DataFrame(columns=["Marketplace", "Faixa", "Preço De", "Linhas"])
+    limites = np.histogram_bin_edges(todos, bins=faixas, range=(todos.min(), max(np.percentile(todos, 99), todos.min() + 0.01)))
+    rotulos = [f"{inicio:.2f} a {fim:.2f}" for inicio, fim in zip(limites[:-1], limites[1:])]
+    rotulos[-1] = f">= {limites[-2]:.2f}"
+    partes = []
+    for marketplace, precos in precos_por_marketplace.items():
+        contagens, _ = np.histogram(np.minimum(precos, limites[-1]), bins=limites)
+        partes.append(pd.DataFrame({"Marketplace": marketplace, "Faixa": rotulos, "Preço De": limites[:-1].round(2), "Linhas": contagens}))
+    return pd.concat(partes, ignore_index=True)